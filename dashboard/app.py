@@ -1,27 +1,43 @@
 # dashboard/app.py
 
 import os
+import sys
+import time
+import resource
+RUN_START = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
-import plotly.express as px
 import streamlit.components.v1 as components
-import folium
 
 # ─── Paths & Config ─────────────────────────────────────────────────────────
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 DATA_DIR     = os.path.join(PROJECT_ROOT, "data", "processed")
-SHAPE_PATH   = os.path.join(PROJECT_ROOT, "data", "raw", "shapefiles",
-                            "cb_2018_us_county_500k.shp")
+STATIC_DIR   = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")   # served as app/static/
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from artifact_io import read_artifact, artifact_exists, artifact_columns
+from map_layer import geometry_json, geometry_asset, layer_json, render_map
 
-SHAP_CSV     = os.path.join(DATA_DIR, "shap_explanations.csv")
-GEOSHAP_CSV  = os.path.join(DATA_DIR, "geoshapley_explanations.csv")
-MGWR_CSV     = os.path.join(DATA_DIR, "mgwr_coefficients.csv")
-BOOT_CSV     = os.path.join(DATA_DIR, "bootstrap_shap_stats.csv")
-FAIR_CSV     = os.path.join(DATA_DIR, "fairness_metrics.csv")
+# Artifact names in data/processed (Parquet / Arrow, or CSV from older runs)
+SHAP_ART     = "shap_explanations"
+GEOSHAP_ART  = "geoshapley_explanations"
+MGWR_ART     = "mgwr_coefficients"
+BOOT_ART     = "bootstrap_shap_stats"
+BOOT_CTY_ART = "bootstrap_shap_county_stats"
+FAIR_ART     = "fairness_metrics"
+MORAN_ART    = "moran_global"
+LISA_ART     = "lisa_local"
+DRIFT_ART    = "explanation_drift"
+DRIFT_GLOBAL_ART = "explanation_drift_global"
 
 SENSITIVE_ATTRS = ["pct_black", "pct_hisp", "median_income"]
 
+# Simplified outlines for the national view (geometry_cache.SIMPLIFY_LEVELS;
+# listed here so the geometry stack is only imported when the map is built)
+MAP_LEVELS = ("national", "state", "county")
+MAP_LEVEL  = "national"
+
 st.set_page_config(layout="wide", page_title="🗺️ Explainable GeoAI Dashboard")
 
 # ─── Sidebar Help ───────────────────────────────────────────────────────────
@@ -30,47 +46,104 @@ st.sidebar.markdown("""
 **Mode Descriptions**  
 - **SHAP:** Exact `phi_…` columns from your SHAP output + bootstrap uncertainty  
 - **GeoShapley:** Decomposed spatial–feature effects  
-- **MGWR/OLS:** Local regression coefficients  
+- **MGWR/OLS:** Local (or global OLS) regression coefficients, on standardised covariates and target  
 - **Fairness:** Residual-based fairness gaps  
+- **Spatial Clustering:** Local Moran's I (LISA) of residuals and explanations  
+- **Explanation Drift:** Per-year SHAP and how each feature's role changed between years  
 """)
 with st.expander("❓ How to use"):
     st.write("""
       1. Pick a **Mode**.  
       2. Pick **View** (Point vs Uncertainty).  
       3. For SHAP, choose exactly one `phi_…` column from your CSV.  
-      4. Hover on the map or download any CSV below.
+      4. Hover on the map, or download the current mode's table below.
     """)
 
 # ─── Data Loader ─────────────────────────────────────────────────────────────
+# Nothing is read up front: selectors use the artifact schemas, map layers
+# read GEOID plus one column, and each table is cached on first use.
+def rss_mb():
+    """Current resident memory of the server process (peak RSS off Linux)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@st.cache_resource
+def process_stats():
+    """Shared across sessions: lets the first run after a (cold) start be told apart."""
+    return {"runs": 0}
+
+
+@st.cache_resource
+def geometry_layer(level=MAP_LEVEL):
+    """
+    Outlines for ``level``, serialised once and shared by every session.
+    With static serving enabled (.streamlit/config.toml) they are written
+    once to STATIC_DIR and pages only carry their URL, so the browser
+    downloads them a single time; otherwise they are embedded in each page.
+    """
+    from geometry_cache import load_simplified
+    t0 = time.perf_counter()
+    geometry = geometry_json(load_simplified(level))
+    size = f"{len(geometry)/2**20:.1f} MB"
+    if st.get_option("server.enableStaticServing"):
+        url = geometry_asset(geometry, STATIC_DIR, level)
+        print(f"[dashboard] outlines '{level}' built in {time.perf_counter()-t0:.2f}s ({size}), served at {url}")
+        return {"geometry_url": url}
+    print(f"[dashboard] outlines '{level}' built in {time.perf_counter()-t0:.2f}s ({size}), embedded per page "
+          f"(enable server.enableStaticServing to send them once)")
+    return {"geometry": geometry}
+
+
 @st.cache_data(ttl=86400)
-def load_data():
-    gdf = gpd.read_file(SHAPE_PATH).to_crs("EPSG:4326")
-    gdf["GEOID"] = gdf["GEOID"].astype(str).str.zfill(5)
-
-    shap_df    = pd.read_csv(SHAP_CSV,    dtype={"GEOID": str})
-    geoshap_df = pd.read_csv(GEOSHAP_CSV, dtype={"GEOID": str})
-    mgwr_df    = pd.read_csv(MGWR_CSV,    dtype={"GEOID": str})
-    boot_df    = pd.read_csv(BOOT_CSV)
-    fair_df    = pd.read_csv(FAIR_CSV,    dtype={"GEOID": str})
-
-    merged = (
-        gdf
-        .merge(shap_df,    on="GEOID", how="left")
-        .merge(geoshap_df, on="GEOID", how="left", suffixes=("_shap","_geoshap"))
-        .merge(mgwr_df,    on="GEOID", how="left", suffixes=("", "_mgwr"))
-    )
-    return merged, shap_df, geoshap_df, mgwr_df, boot_df, fair_df
+def artifact_schema(name):
+    """Column names of an artifact, or None when it does not exist (nothing is read)."""
+    return artifact_columns(name) if artifact_exists(name) else None
 
-map_df, shap_df, geoshap_df, mgwr_df, boot_df, fair_df = load_data()
+
+@st.cache_data(ttl=86400)
+def load_table(name, columns=None):
+    t0 = time.perf_counter()
+    df = read_artifact(name, columns=list(columns) if columns else None)
+    print(f"[dashboard] loaded {name}{list(columns) if columns else ''}: {len(df)} rows "
+          f"in {time.perf_counter()-t0:.2f}s, RSS {rss_mb():.0f} MB")
+    return df
+
+
+# Artifact behind each map source
+SOURCE_ARTIFACTS = {"SHAP": SHAP_ART, "SHAP uncertainty": BOOT_CTY_ART, "GeoShapley": GEOSHAP_ART,
+                    "MGWR/OLS": MGWR_ART, "Fairness": FAIR_ART, "Spatial Clustering": LISA_ART,
+                    "Explanation Drift": DRIFT_ART}
+
+
+@st.cache_data(ttl=86400)
+def cached_layer(source, column, palette, title):
+    """Value/colour table of one column (GEOID-keyed), reused on every revisit."""
+    df = load_table(SOURCE_ARTIFACTS[source], ("GEOID", column))
+    return layer_json(pd.Series(df[column].to_numpy(), index=df["GEOID"].to_numpy()), palette, title)
+
+
+@st.cache_data(ttl=86400)
+def cached_drift_layer(feature, year, column, palette, title):
+    """One feature-year slice of the long drift table (four columns read, once)."""
+    df = load_table(DRIFT_ART, ("GEOID", "year", "feature", column))
+    df = df[(df["feature"] == feature) & (df["year"] == year)]
+    return layer_json(pd.Series(df[column].to_numpy(), index=df["GEOID"].to_numpy()), palette, title)
 
 # ─── Mode & View ─────────────────────────────────────────────────────────────
-mode = st.sidebar.radio("Select Mode:", ["SHAP", "GeoShapley", "MGWR/OLS", "Fairness"])
+modes = (["SHAP", "GeoShapley", "MGWR/OLS", "Fairness"]
+         + (["Spatial Clustering"] if artifact_schema(LISA_ART) else [])
+         + (["Explanation Drift"] if artifact_schema(DRIFT_ART) else []))
+mode = st.sidebar.radio("Select Mode:", modes)
 view = st.sidebar.radio("View:", ["Point Estimate", "Uncertainty"])
 
 # ─── Sidebar selectors & titles ──────────────────────────────────────────────
 if mode == "SHAP":
     # list all existing phi_ columns
-    phi_cols = [c for c in shap_df.columns if c.startswith("phi_")]
+    phi_cols = [c for c in artifact_schema(SHAP_ART) if c.startswith("phi_")]
     feature  = st.sidebar.selectbox("SHAP Column:", sorted(phi_cols))
     col_point   = feature
     col_uncert  = "std_phi"
@@ -78,7 +151,7 @@ if mode == "SHAP":
     title_unc   = f"Bootstrap std of {feature}"
 
 elif mode == "GeoShapley":
-    geosh_cols = [c for c in geoshap_df.columns if c.startswith("phi_")]
+    geosh_cols = [c for c in artifact_schema(GEOSHAP_ART) if c.startswith("phi_")]
     comp       = st.sidebar.selectbox("GeoShapley Column:", sorted(geosh_cols))
     col_point   = comp
     col_uncert  = None
@@ -86,68 +159,98 @@ elif mode == "GeoShapley":
     title_unc   = ""
 
 elif mode == "MGWR/OLS":
-    mgwr_cols = [c for c in mgwr_df.columns if c != "GEOID"]
+    mgwr_all  = artifact_schema(MGWR_ART)
+    mgwr_cols = [c for c in mgwr_all if c != "GEOID" and not c.startswith("se_")]
     coef      = st.sidebar.selectbox("MGWR/OLS Column:", sorted(mgwr_cols))
     col_point   = coef
-    col_uncert  = None
+    col_uncert  = f"se_{coef}" if f"se_{coef}" in mgwr_all else None
     title_point = coef
+    title_unc   = f"Standard error of {coef}"
+
+elif mode == "Spatial Clustering":
+    lisa_cols = [c.removeprefix("lisa_q_") for c in artifact_schema(LISA_ART) if c.startswith("lisa_q_")]
+    tested    = st.sidebar.selectbox("Column:", sorted(lisa_cols))
+    col_point   = f"lisa_{tested}"
+    col_uncert  = f"lisa_p_{tested}"
+    title_point = f"Local Moran's I of {tested}"
+    title_unc   = f"Pseudo p-value of local Moran's I ({tested})"
+
+elif mode == "Explanation Drift":
+    drift_labels = {"phi": "SHAP value", "delta_phi": "Change since previous year",
+                    "rank": "Importance rank", "rank_change": "Rank change since previous year"}
+    drift_global = load_table(DRIFT_GLOBAL_ART)
+    drift_feat   = st.sidebar.selectbox("Feature:", sorted(drift_global["feature"].unique()))
+    drift_year   = st.sidebar.select_slider("Year:", sorted(int(y) for y in drift_global["year"].unique()))
+    metric       = st.sidebar.selectbox("Measure:", list(drift_labels), format_func=drift_labels.get)
+    col_point   = metric
+    col_uncert  = None
+    title_point = f"{drift_labels[metric]}: {drift_feat}, {drift_year}"
     title_unc   = ""
 
 else:  # Fairness
     fair_labels = {"pct_black":"Black %","pct_hisp":"Hispanic %","median_income":"Median Income"}
-    attr      = st.sidebar.selectbox("Attribute:", SENSITIVE_ATTRS,
-                                     format_func=lambda x: fair_labels[x])
+    # Every grouping in the artifact, including intersections (a_x_b)
+    groupings = [c.removesuffix("_fairness_score") for c in artifact_schema(FAIR_ART)
+                 if c.endswith("_fairness_score")] or SENSITIVE_ATTRS
+    attr      = st.sidebar.selectbox("Attribute:", groupings,
+                                     format_func=lambda x: " × ".join(fair_labels.get(a, a)
+                                                                      for a in x.split("_x_")))
     col_point   = f"{attr}_fairness_score"
     col_uncert  = None
     title_point = col_point
     title_unc   = ""
 
 # ─── Handle SHAP Uncertainty ────────────────────────────────────────────────
-col_to_map, title = col_point, title_point
+col_to_map, title, source = col_point, title_point, mode
+constant = None
 if mode=="SHAP" and view=="Uncertainty":
+    std_col = f"std_{feature}"
+    boot_df = load_table(BOOT_ART)
     row = boot_df.loc[boot_df["feature"]==feature.removeprefix("phi_")]
-    if not row.empty:
-        map_df["uncertainty"] = float(row["std_phi"])
-        col_to_map, title = "uncertainty", title_unc
+    if std_col in (artifact_schema(BOOT_CTY_ART) or []):
+        col_to_map, title, source = std_col, title_unc, "SHAP uncertainty"
+    elif not row.empty:
+        st.sidebar.info("Per-county bootstrap stats not found; showing the global std.")
+        constant = float(row["std_phi"].iloc[0])
+        title = title_unc
     else:
         st.sidebar.warning("No bootstrap std available.")
 
+if mode=="Spatial Clustering" and view=="Uncertainty":
+    col_to_map, title = col_uncert, title_unc
+
+if mode=="MGWR/OLS" and view=="Uncertainty":
+    if col_uncert:
+        col_to_map, title = col_uncert, title_unc
+    else:
+        st.sidebar.warning("No standard errors for this column (global OLS run?).")
+
 # ─── Render Map ──────────────────────────────────────────────────────────────
+# The outlines are cached once per level; a mode/column change only rebuilds
+# the small GEOID -> value/colour table joined to them in the browser.
 st.subheader(title)
-plot_df = map_df.copy()
-if mode=="Fairness":
-    plot_df = plot_df.merge(fair_df, on="GEOID", how="left")
+level   = st.sidebar.selectbox("Map detail:", MAP_LEVELS, index=MAP_LEVELS.index(MAP_LEVEL))
+palette = "YlGnBu" if mode not in ("Fairness", "Spatial Clustering", "Explanation Drift") else "RdYlBu_r"
+columns = artifact_schema(SOURCE_ARTIFACTS[source]) or []
 
-if col_to_map not in plot_df.columns:
-    st.error(f"Column '{col_to_map}' not found. Available: {plot_df.columns.tolist()}")
+if constant is not None:
+    geoids = load_table(SHAP_ART, ("GEOID",))["GEOID"].to_numpy()
+    layer  = layer_json(pd.Series(constant, index=geoids), palette, title)
+elif col_to_map not in columns:
+    layer = None
+    st.error(f"Column '{col_to_map}' not found. Available: {columns}")
+elif mode == "Explanation Drift":
+    layer = cached_drift_layer(drift_feat, drift_year, col_to_map, palette, title)
 else:
-    m = folium.Map(location=[37.8,-96], zoom_start=4, tiles="cartodbpositron")
-    chor = folium.Choropleth(
-        geo_data=plot_df,
-        data=plot_df,
-        columns=["GEOID", col_to_map],
-        key_on="feature.properties.GEOID",
-        fill_color=("YlGnBu" if mode!="Fairness" else "RdYlBu_r"),
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name=title,
-        nan_fill_color="white"
-    ).add_to(m)
-
-    chor.geojson.add_child(
-        folium.features.GeoJsonTooltip(
-            fields=["GEOID", col_to_map],
-            aliases=["GEOID", title],
-            localize=True
-        )
-    )
-
-    components.html(m._repr_html_(), height=550)
+    layer = cached_layer(source, col_to_map, palette, title)
+if layer is not None:
+    components.html(render_map(layer, **geometry_layer(level)), height=550)
 
 # ─── SHAP Global Importance ─────────────────────────────────────────────────
 if mode=="SHAP" and view=="Point Estimate":
+    import plotly.express as px
     st.subheader("Global SHAP Importance")
-    imp = boot_df.copy()
+    imp = load_table(BOOT_ART).copy()
     imp["abs_mean"] = imp["mean_phi"].abs()
     top10 = imp.nlargest(10, "abs_mean")
     fig = px.bar(
@@ -157,10 +260,38 @@ if mode=="SHAP" and view=="Point Estimate":
     )
     st.plotly_chart(fig, use_container_width=True)
 
+# ─── Global Importance Over Time ─────────────────────────────────────────────
+if mode=="Explanation Drift":
+    import plotly.express as px
+    st.subheader("Global SHAP Importance by Year")
+    fig = px.bar(
+        drift_global.sort_values(["year", "rank"]), x="feature", y="mean_abs_phi",
+        animation_frame="year", hover_data=["rank", "rank_change", "mean_abs_delta"],
+        range_y=[0, float(drift_global["mean_abs_phi"].max()) * 1.05],
+        labels={"mean_abs_phi":"Mean |SHAP|"},
+        title="Mean |SHAP| per feature (press play to step through the years)"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+# ─── Global Moran's I ───────────────────────────────────────────────────────
+if mode=="Spatial Clustering" and artifact_schema(MORAN_ART):
+    moran_df = load_table(MORAN_ART)
+    st.subheader("Global Moran's I")
+    source, _, column = tested.partition("_")
+    row = moran_df[(moran_df["source"]==source) & (moran_df["column"]==column)]
+    if not row.empty:
+        st.caption(f"{tested}: I = {row['I'].iloc[0]:.3f}, pseudo p = {row['p_sim'].iloc[0]:.3f}")
+    st.dataframe(moran_df.sort_values("I", ascending=False), use_container_width=True)
+
 # ─── Downloads ───────────────────────────────────────────────────────────────
+# Only the current mode's table is loaded for download
 st.markdown("---")
-c1, c2, c3, c4 = st.columns(4)
-c1.download_button("Download SHAP",       shap_df.to_csv(index=False),    "shap_explanations.csv")
-c2.download_button("Download GeoShapley", geoshap_df.to_csv(index=False), "geoshapley_explanations.csv")
-c3.download_button("Download MGWR",       mgwr_df.to_csv(index=False),    "mgwr_coefficients.csv")
-c4.download_button("Download Fairness",   fair_df.to_csv(index=False),    "fairness_metrics.csv")
+download = SOURCE_ARTIFACTS[mode]
+if st.checkbox(f"Prepare {download} for download"):
+    st.download_button(f"Download {mode}", load_table(download).to_csv(index=False), f"{download}.csv")
+
+# ─── Run Telemetry ───────────────────────────────────────────────────────────
+stats = process_stats()
+stats["runs"] += 1
+print(f"[dashboard] {'cold start' if stats['runs'] == 1 else 'rerun'}: mode={mode} view={view} "
+      f"in {time.perf_counter()-RUN_START:.2f}s, RSS {rss_mb():.0f} MB")
@@ -0,0 +1,119 @@
+# dashboard/map_layer.py
+#
+# Leaflet choropleth with a client-side data join: the county outlines are
+# serialised once (GEOID only) and every restyle ships just a GEOID -> value
+# / colour table, joined to the outlines in the browser. With Streamlit's
+# static serving the outlines are a content-addressed file the browser
+# fetches once and then reuses from its HTTP cache; otherwise they are
+# embedded in the page.
+
+import os
+import json
+import hashlib
+import numpy as np
+
+# Six-class ColorBrewer ramps (equal-interval bins, as folium.Choropleth)
+PALETTES = {
+    "YlGnBu":   ["#ffffcc", "#c7e9b4", "#7fcdbb", "#41b6c4", "#2c7fb8", "#253494"],
+    "RdYlBu_r": ["#4575b4", "#91bfdb", "#e0f3f8", "#fee090", "#fc8d59", "#d73027"],
+}
+NAN_COLOR = "#ffffff"
+
+TILES = "https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png"
+ATTRIBUTION = "&copy; OpenStreetMap contributors &copy; CARTO"
+
+
+def geometry_json(gdf):
+    """GeoJSON of the outlines with GEOID as the only property (built once per level)."""
+    return gdf[["GEOID", "geometry"]].to_json(drop_id=True)
+
+
+def geometry_asset(geometry, static_dir, level):
+    """
+    Write the outline JSON to ``static_dir`` under a name that carries a
+    hash of its content (so a cached copy is never stale) and return the
+    URL Streamlit serves it at. An existing file is left alone.
+    """
+    name = f"outlines_{level}_{hashlib.sha256(geometry.encode()).hexdigest()[:16]}.geojson"
+    path = os.path.join(static_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(static_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fh:
+            fh.write(geometry)
+        os.replace(tmp, path)
+    return f"app/static/{name}"
+
+
+def layer_json(values, palette="YlGnBu", title=""):
+    """
+    The data half of a layer: ``values`` (a Series indexed by GEOID) as
+    {GEOID: [value, colour index]}, plus the palette and the bin edges
+    for the legend. A few hundred kB at most, whatever the geometry.
+    """
+    colors = PALETTES[palette]
+    v = values.to_numpy(dtype=float)
+    finite = np.isfinite(v)
+    lo, hi = (np.nanmin(v), np.nanmax(v)) if finite.any() else (0.0, 0.0)
+    edges = np.linspace(lo, hi, len(colors) + 1)
+    idx = np.clip(np.searchsorted(edges, v, side="right") - 1, 0, len(colors) - 1)
+    idx = np.where(finite, idx, -1)
+    table = dict(zip(values.index.astype(str),
+                     zip(np.where(finite, np.round(v, 6), None).tolist(), idx.tolist())))
+    return json.dumps({"values": table, "colors": colors, "edges": edges.round(6).tolist(),
+                       "nan_color": NAN_COLOR, "title": title})
+
+
+TEMPLATE = """<!DOCTYPE html>
+<html><head>
+<meta charset="utf-8"/>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+  html, body, #map {height: 100%; margin: 0;}
+  .legend {background: white; padding: 6px 8px; font: 12px sans-serif; line-height: 18px;}
+  .legend i {width: 14px; height: 14px; float: left; margin-right: 6px; opacity: 0.7;}
+</style>
+</head><body><div id="map"></div>
+<script>
+const layer = __LAYER__;
+const map = L.map("map").setView([37.8, -96], 4);
+L.tileLayer("__TILES__", {attribution: "__ATTRIBUTION__"}).addTo(map);
+const fmt = v => v === null || v === undefined ? "n/a" : v.toLocaleString(undefined, {maximumFractionDigits: 4});
+const draw = geometry => L.geoJSON(geometry, {
+  style: f => {
+    const row = layer.values[f.properties.GEOID];
+    const fill = row && row[1] >= 0 ? layer.colors[row[1]] : layer.nan_color;
+    return {fillColor: fill, fillOpacity: 0.7, color: "#000", weight: 1, opacity: 0.2};
+  },
+  onEachFeature: (f, l) => {
+    const row = layer.values[f.properties.GEOID];
+    l.bindTooltip(`<b>GEOID</b> ${f.properties.GEOID}<br><b>${layer.title}</b> ${fmt(row && row[0])}`);
+  }
+}).addTo(map);
+const url = __GEOMETRY_URL__;
+if (url) {
+  // Content-addressed file: any cached copy is current, so never revalidate
+  fetch(new URL(url, document.baseURI), {cache: "force-cache"}).then(r => r.json()).then(draw);
+} else {
+  draw(__GEOMETRY__);
+}
+const legend = L.control({position: "topright"});
+legend.onAdd = () => {
+  const div = L.DomUtil.create("div", "legend");
+  div.innerHTML = `<b>${layer.title}</b><br>` + layer.colors.map((c, i) =>
+    `<i style="background:${c}"></i>${fmt(layer.edges[i])} – ${fmt(layer.edges[i + 1])}`).join("<br>");
+  return div;
+};
+legend.addTo(map);
+</script></body></html>"""
+
+
+def render_map(layer, geometry_url=None, geometry=None):
+    """
+    Page for ``components.html``: one layer's data, plus the outlines by
+    URL (see ``geometry_asset``) or, without static serving, inline.
+    """
+    return (TEMPLATE.replace("__TILES__", TILES).replace("__ATTRIBUTION__", ATTRIBUTION)
+            .replace("__LAYER__", layer).replace("__GEOMETRY_URL__", json.dumps(geometry_url))
+            .replace("__GEOMETRY__", "null" if geometry_url else geometry))
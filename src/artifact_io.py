@@ -0,0 +1,255 @@
+# src/artifact_io.py
+
+import os
+import sys
+import csv as csv_module
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import PROCESSED_DIR, ARTIFACT_FORMAT, EXPORT_CSV
+
+# File extension per format; reads try them in this order
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+# Census / FIPS code columns: always zero-padded strings, never numbers
+CODE_COLUMNS = {
+    "GEOID": 5, "fips": 5, "county_id": 5,
+    "STATEFP": 2, "COUNTYFP": 3, "COUNTYNS": 8, "LSAD": 2, "AFFGEOID": None,
+}
+
+
+def artifact_path(name, fmt=ARTIFACT_FORMAT, directory=PROCESSED_DIR):
+    return os.path.join(directory, name + FORMATS[fmt])
+
+
+def find_artifact(name, directory=PROCESSED_DIR):
+    """Path of the first existing ``name`` artifact (Parquet, Arrow, then CSV), else None."""
+    for fmt in FORMATS:
+        path = artifact_path(name, fmt, directory)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def artifact_exists(name, directory=PROCESSED_DIR):
+    return find_artifact(name, directory) is not None
+
+
+def fix_codes(df):
+    """Cast code columns to zero-padded strings, in place."""
+    for col, width in CODE_COLUMNS.items():
+        if col in df.columns and df[col].dtype != object:
+            df[col] = df[col].astype(str)
+        if col in df.columns and width:
+            df[col] = df[col].str.zfill(width)
+    return df
+
+
+def schema_for(df):
+    """
+    Explicit Arrow schema for ``df``: code columns are pinned to string,
+    everything else keeps the type pandas holds, so readers never
+    re-infer dtypes.
+    """
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.schema([
+        pa.field(f.name, pa.string()) if f.name in CODE_COLUMNS else f
+        for f in inferred
+    ])
+
+
+def write_frame(df, path):
+    """Write ``df`` to ``path`` in the format given by its extension (atomic)."""
+    df = fix_codes(df.copy())
+    table = pa.Table.from_pandas(df, schema=schema_for(df), preserve_index=False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if path.endswith(FORMATS["parquet"]):
+        pq.write_table(table, tmp)
+    elif path.endswith(FORMATS["arrow"]):
+        feather.write_feather(table, tmp, compression="uncompressed")
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def read_frame(path, columns=None):
+    """
+    Read a Parquet / Arrow IPC / CSV file, projecting onto ``columns``.
+
+    Parquet and Arrow files are memory-mapped, so only the requested
+    columns are paged in; uncompressed Arrow columns are handed to pandas
+    without an intermediate copy where the dtype allows it.
+    """
+    if path.endswith(FORMATS["parquet"]):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    elif path.endswith(FORMATS["arrow"]):
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            return fix_codes(table.to_pandas())
+    else:
+        codes = {col: pa.string() for col in CODE_COLUMNS}
+        table = pacsv.read_csv(
+            path,
+            convert_options=pacsv.ConvertOptions(column_types=codes, include_columns=columns),
+        )
+    return fix_codes(table.to_pandas())
+
+
+def write_artifact(df, name, fmt=ARTIFACT_FORMAT, csv=EXPORT_CSV, directory=PROCESSED_DIR):
+    """
+    Save ``df`` as ``<directory>/<name>.<ext>``; with ``csv`` also export a
+    CSV copy next to it. Copies in formats that ``read_artifact`` would
+    prefer over ``fmt`` are removed so readers never pick up a stale file.
+    """
+    path = write_frame(df, artifact_path(name, fmt, directory))
+    remove_shadowing(name, fmt, directory)
+    if csv and fmt != "csv":
+        write_frame(df, artifact_path(name, "csv", directory))
+    return path
+
+
+def remove_shadowing(name, fmt, directory=PROCESSED_DIR):
+    """Delete copies of ``name`` in formats read_artifact prefers over ``fmt``."""
+    for other in list(FORMATS)[:list(FORMATS).index(fmt)]:
+        stale = artifact_path(name, other, directory)
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def read_artifact(name, columns=None, directory=PROCESSED_DIR):
+    """Read artifact ``name``, preferring columnar files over CSV."""
+    path = find_artifact(name, directory)
+    if path is None:
+        raise FileNotFoundError(f"No artifact '{name}' in {directory}")
+    return read_frame(path, columns=columns)
+
+
+def artifact_columns(name, directory=PROCESSED_DIR):
+    """Column names of artifact ``name`` without reading any rows."""
+    path = find_artifact(name, directory)
+    if path is None:
+        raise FileNotFoundError(f"No artifact '{name}' in {directory}")
+    if path.endswith(FORMATS["parquet"]):
+        return pq.read_schema(path, memory_map=True).names
+    if path.endswith(FORMATS["arrow"]):
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+    with open(path, newline="") as fh:
+        return next(csv_module.reader(fh))
+
+
+def iter_artifact(name, columns=None, batch_rows=65536, directory=PROCESSED_DIR):
+    """
+    Yield artifact ``name`` as DataFrames of at most ``batch_rows`` rows,
+    so only one batch of the requested columns is materialised at a time.
+    """
+    path = find_artifact(name, directory)
+    if path is None:
+        raise FileNotFoundError(f"No artifact '{name}' in {directory}")
+    if path.endswith(FORMATS["parquet"]):
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows,
+                                                                     columns=columns)
+        for batch in batches:
+            yield fix_codes(batch.to_pandas())
+    elif path.endswith(FORMATS["arrow"]):
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for lo in range(0, batch.num_rows, batch_rows):
+                    yield fix_codes(batch.slice(lo, batch_rows).to_pandas())
+    else:
+        codes  = {col: pa.string() for col in CODE_COLUMNS}
+        reader = pacsv.open_csv(
+            path,
+            read_options=pacsv.ReadOptions(block_size=max(1 << 16, batch_rows * 64)),
+            convert_options=pacsv.ConvertOptions(column_types=codes, include_columns=columns),
+        )
+        for batch in reader:
+            yield fix_codes(batch.to_pandas())
+
+
+class ArtifactWriter:
+    """
+    Write artifact ``name`` block by block (``write(df)``), for outputs
+    too large to hold whole. Parquet blocks become row groups, Arrow
+    blocks record batches; the file only replaces the previous artifact
+    when the writer is closed without error.
+    """
+
+    def __init__(self, name, fmt=ARTIFACT_FORMAT, csv=EXPORT_CSV, directory=PROCESSED_DIR):
+        self.name, self.fmt, self.csv, self.directory = name, fmt, csv, directory
+        self.path   = artifact_path(name, fmt, directory)
+        self.tmp    = self.path + ".tmp"
+        self.schema = None
+        self.sink   = None
+        self.csv_writer = None
+        self.rows   = 0
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self
+
+    def write(self, df):
+        df = fix_codes(df.copy())
+        if self.schema is None:
+            self.schema = schema_for(df)
+            if self.fmt == "parquet":
+                self.sink = pq.ParquetWriter(self.tmp, self.schema)
+            elif self.fmt == "arrow":
+                self.sink = pa.ipc.new_file(self.tmp, self.schema)
+            if self.csv or self.fmt == "csv":
+                self.csv_writer = CsvAppender(artifact_path(self.name, "csv", self.directory))
+        if self.sink is not None:
+            self.sink.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        if self.csv_writer is not None:
+            self.csv_writer.write(df)
+        self.rows += len(df)
+
+    def __exit__(self, exc_type, *exc):
+        if self.sink is not None:
+            self.sink.close()
+        if self.csv_writer is not None:
+            self.csv_writer.close(commit=exc_type is None)
+        if exc_type is not None:
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+            return False
+        if self.sink is not None:
+            os.replace(self.tmp, self.path)
+        remove_shadowing(self.name, self.fmt, self.directory)
+        return False
+
+
+class CsvAppender:
+    """Append DataFrames to a CSV (header once), renamed into place on close."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp  = path + ".tmp"
+        self.fh   = open(self.tmp, "w", newline="")
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.fh, index=False, header=self.header)
+        self.header = False
+
+    def close(self, commit=True):
+        self.fh.close()
+        if commit:
+            os.replace(self.tmp, self.path)
+        else:
+            os.remove(self.tmp)
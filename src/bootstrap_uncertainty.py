@@ -2,7 +2,10 @@
 
 import os
 import sys
-import joblib
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 import shap
@@ -15,89 +18,246 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from config import PROCESSED_DATA_PATH
+from config import FEATURES_ARTIFACT
+from model_registry import FEATURE_LIST, TARGET, unwrap, model_params
+from online_stats import RunningMoments, P2Quantile, QuantileSummary
+from artifact_io import read_artifact, write_artifact
 
-# Paths
-FEATURES_PATH       = os.path.join(PROJECT_ROOT, "data", "processed", "voting_features.csv")
-OUTPUT_STATS_PATH   = os.path.join(PROJECT_ROOT, "data", "processed", "bootstrap_shap_stats.csv")
+# Paths / artifacts
+OUTPUT_STATS        = "bootstrap_shap_stats"
+OUTPUT_COUNTY_STATS = "bootstrap_shap_county_stats"
+CHECKPOINT_DIR      = os.path.join(PROJECT_ROOT, "data", "processed", "bootstrap_checkpoints")
 
 # Bootstrap parameters
 B                   = 100    # Number of bootstrap samples
 TEST_SIZE           = 0.2    # Test split fraction
+SEED                = 42     # Base seed; replicate b uses replicate_seed(b, SEED)
+AUTOML_BUDGET       = 60     # Seconds of AutoML search per replicate ("automl" mode)
+N_WORKERS           = max(1, multiprocessing.cpu_count() - 1)
+MODES               = ("automl", "fixed")
+CI_LEVELS           = (0.025, 0.975)
 
 def load_data():
-    df = pd.read_csv(FEATURES_PATH)
-    # **Only** keep numeric columns (int or float)
-    numeric = df.select_dtypes(include=["int64", "float64"])
-    # Ensure target column is in numeric set
-    if "new_pct_dem" not in numeric.columns:
-        numeric["new_pct_dem"] = df["new_pct_dem"]
-    # X: all numeric except target
-    X = numeric.drop(columns=["new_pct_dem"])
-    y = numeric["new_pct_dem"]
-    return X, y
-
-def extract_sklearn_xgb(automl):
-    wrapped = automl.model
-    if hasattr(wrapped, "model") and isinstance(wrapped.model, XGBRegressor):
-        return wrapped.model
-    if hasattr(wrapped, "estimator") and isinstance(wrapped.estimator, XGBRegressor):
-        return wrapped.estimator
-    return wrapped
-
-def bootstrap_shap_stats(X, y, B=100):
+    """
+    The clean model's features (model_registry.FEATURE_LIST, in order) and
+    the target; the spatial lags in the feature table are left out, so
+    replicates fit and explain the same 17 features as the clean model.
+    """
+    df = read_artifact(FEATURES_ARTIFACT, columns=FEATURE_LIST + [TARGET])
+    return df[FEATURE_LIST], df[TARGET]
+
+def load_geoids():
+    return read_artifact(FEATURES_ARTIFACT, columns=["GEOID"])["GEOID"]
+
+def load_fixed_params():
+    """Tuned XGBoost hyperparameters of the clean model (from its manifest), for "fixed" mode."""
+    params = model_params()
+    # Seeding and threading are set per replicate
+    for key in ("random_state", "seed", "n_jobs", "nthread"):
+        params.pop(key, None)
+    return params
+
+def replicate_seed(b, seed=SEED):
+    """Deterministic seed for replicate b, independent of run order."""
+    return int(np.random.SeedSequence([seed, b]).generate_state(1)[0])
+
+def fit_replicate(X_train, y_train, seed, mode="automl", params=None, n_jobs=1):
+    if mode == "fixed":
+        model = XGBRegressor(**params, random_state=seed, n_jobs=n_jobs)
+        model.fit(X_train, y_train)
+        return model
+
+    # AutoML XGB on bootstrap sample
+    automl = AutoML()
+    automl.fit(
+        X_train=X_train,
+        y_train=y_train,
+        task="regression",
+        metric="r2",
+        time_budget=AUTOML_BUDGET,
+        estimator_list=["xgboost"],
+        seed=seed,
+        n_jobs=n_jobs,
+    )
+    return unwrap(automl)
+
+def run_replicate(b, X, y, mode="automl", params=None, seed=SEED, n_jobs=1):
+    """
+    Fit one bootstrap replicate and return its SHAP matrix over the original
+    rows, shape (n_samples, n_features), so replicates align per county.
+    """
+    rng = np.random.default_rng(replicate_seed(b, seed))
+
+    # Sample with replacement
+    idx = rng.choice(len(X), size=len(X), replace=True)
+    Xb, yb = X.iloc[idx], y.iloc[idx]
+
+    # Train/test split for consistency
+    X_train, _, y_train, _ = train_test_split(Xb, yb, test_size=TEST_SIZE, random_state=42)
+
+    xgb_model = fit_replicate(X_train, y_train, replicate_seed(b, seed) % (2**31),
+                              mode=mode, params=params, n_jobs=n_jobs)
+
+    # SHAP TreeExplainer on the original counties
+    explainer = shap.TreeExplainer(xgb_model)
+    return np.asarray(explainer.shap_values(X))
+
+# ── Checkpoints ─────────────────────────────────────────────────────────────
+def checkpoint_path(checkpoint_dir, b):
+    return os.path.join(checkpoint_dir, f"rep_{b:04d}.npy")
+
+def save_checkpoint(checkpoint_dir, b, shap_vals):
+    # Write-then-rename so a crash never leaves a truncated replicate behind
+    path = checkpoint_path(checkpoint_dir, b)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, shap_vals)
+    os.replace(tmp, path)
+
+def _canonical(manifest):
+    return json.dumps(manifest, sort_keys=True, indent=2, default=str)
+
+def check_manifest(checkpoint_dir, manifest):
+    """
+    Pin the run settings to the checkpoint directory, so replicates from a
+    run with a different seed, mode or feature set are never mixed in.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, "manifest.json")
+    if os.path.exists(path):
+        with open(path) as fh:
+            existing = json.load(fh)
+        if _canonical(existing) != _canonical(manifest):
+            raise ValueError(
+                f"Checkpoints in {checkpoint_dir} were written with different "
+                "settings; remove them or pick another checkpoint directory."
+            )
+    else:
+        with open(path, "w") as fh:
+            fh.write(_canonical(manifest))
+
+def bootstrap_shap_stats(X, y, B=100, mode="automl", n_workers=1, seed=SEED,
+                         checkpoint_dir=CHECKPOINT_DIR, params=None, geoids=None):
+    """
+    Bootstrap SHAP statistics, returned as ``(global_df, county_df)``: one
+    row per feature, and one row per county with per-feature mean, std and
+    95% CI columns.
+
+    Every replicate is checkpointed to ``checkpoint_dir`` as soon as it
+    finishes; rerunning with the same settings only fits the missing
+    replicates. In "fixed" mode each replicate refits the clean model's
+    tuned hyperparameters instead of searching with AutoML, which makes
+    the result fully reproducible (AutoML's search depends on its time
+    budget).
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
     feature_names = X.columns.tolist()
-    all_shap = []
+    if mode == "fixed" and params is None:
+        params = load_fixed_params()
+    check_manifest(checkpoint_dir, {
+        "mode": mode, "seed": seed, "n_samples": len(X), "shap_rows": "original",
+        "features": feature_names, "params": params,
+    })
 
-    for b in range(B):
-        # Sample with replacement
-        idx = np.random.choice(len(X), size=len(X), replace=True)
-        Xb, yb = X.iloc[idx], y.iloc[idx]
-
-        # Train/test split for consistency
-        X_train, _, y_train, _ = train_test_split(Xb, yb, test_size=TEST_SIZE, random_state=42)
-
-        # AutoML XGB on bootstrap sample
-        automl = AutoML()
-        automl.fit(
-            X_train=X_train,
-            y_train=y_train,
-            task="regression",
-            metric="r2",
-            time_budget=60,
-            estimator_list=["xgboost"],
-            seed=42,
-        )
-        xgb_model = extract_sklearn_xgb(automl)
-
-        # SHAP TreeExplainer on numeric bootstrap sample
-        explainer = shap.TreeExplainer(xgb_model)
-        shap_vals = explainer.shap_values(Xb)  # shape (n_samples, n_features)
-        all_shap.append(shap_vals)
-
-        print(f"Bootstrap {b+1}/{B} done")
-
-    # Stack to shape (B, n_samples, n_features)
-    arr = np.stack(all_shap, axis=0)
-    stats = []
-    for i, feat in enumerate(feature_names):
-        vals = arr[:, :, i].ravel()
-        stats.append({
-            "feature": feat,
-            "mean_phi": np.mean(vals),
-            "std_phi": np.std(vals),
-            "ci_lower": np.percentile(vals, 2.5),
-            "ci_upper": np.percentile(vals, 97.5),
+    todo = [b for b in range(B) if not os.path.exists(checkpoint_path(checkpoint_dir, b))]
+    print(f"Bootstrap: {B - len(todo)}/{B} replicates restored, {len(todo)} to run "
+          f"(mode={mode}, workers={n_workers})")
+
+    if n_workers > 1 and len(todo) > 1:
+        n_jobs = max(1, multiprocessing.cpu_count() // n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {
+                pool.submit(run_replicate, b, X, y, mode, params, seed, n_jobs): b
+                for b in todo
+            }
+            for done, fut in enumerate(as_completed(futures), 1):
+                b = futures[fut]
+                save_checkpoint(checkpoint_dir, b, fut.result())
+                print(f"Bootstrap {b+1}/{B} done ({done}/{len(todo)} this run)")
+    else:
+        for b in todo:
+            save_checkpoint(checkpoint_dir, b, run_replicate(b, X, y, mode, params, seed))
+            print(f"Bootstrap {b+1}/{B} done")
+
+    if geoids is None:
+        geoids = X.index
+    return summarize_checkpoints(checkpoint_dir, B, feature_names, geoids)
+
+class BootstrapAccumulator:
+    """
+    Online per-(county, feature) bootstrap summary.
+
+    Keeps running moments and P² sketches of the CI bounds for every cell,
+    plus a quantile summary of the pooled per-feature distribution, so
+    memory does not grow with the number of replicates.
+    """
+
+    def __init__(self, n_samples, n_features, levels=CI_LEVELS):
+        self.levels  = levels
+        self.moments = RunningMoments((n_samples, n_features))
+        self.cell_q  = [P2Quantile(p, (n_samples, n_features)) for p in levels]
+        self.pooled  = QuantileSummary(n_features)
+
+    def update(self, shap_vals):
+        self.moments.update(shap_vals)
+        for sketch in self.cell_q:
+            sketch.update(shap_vals)
+        self.pooled.update(shap_vals)
+
+    def global_stats(self, feature_names):
+        # Every cell has the same count, so pooled moments combine exactly
+        mean = self.moments.mean.mean(axis=0)
+        var  = self.moments.var.mean(axis=0) + self.moments.mean.var(axis=0)
+        lower, upper = (self.pooled.quantile(p) for p in self.levels)
+        return pd.DataFrame({
+            "feature": feature_names,
+            "mean_phi": mean,
+            "std_phi": np.sqrt(var),
+            "ci_lower": lower,
+            "ci_upper": upper,
         })
 
-    return pd.DataFrame(stats)
+    def county_stats(self, feature_names, geoids):
+        lower, upper = (sketch.value for sketch in self.cell_q)
+        cols = {"GEOID": np.asarray(geoids)}
+        for i, feat in enumerate(feature_names):
+            cols[f"mean_phi_{feat}"] = self.moments.mean[:, i]
+            cols[f"std_phi_{feat}"]  = self.moments.std[:, i]
+            cols[f"ci_lower_{feat}"] = lower[:, i]
+            cols[f"ci_upper_{feat}"] = upper[:, i]
+        return pd.DataFrame(cols)
+
+def summarize_checkpoints(checkpoint_dir, B, feature_names, geoids):
+    """Fold replicates 0..B-1 into a BootstrapAccumulator, one at a time."""
+    acc = None
+    for b in range(B):
+        shap_vals = np.load(checkpoint_path(checkpoint_dir, b))
+        if acc is None:
+            acc = BootstrapAccumulator(*shap_vals.shape)
+        acc.update(shap_vals)
+    return acc.global_stats(feature_names), acc.county_stats(feature_names, geoids)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bootstrap SHAP uncertainty")
+    parser.add_argument("--replicates", type=int, default=B)
+    parser.add_argument("--mode", choices=MODES, default="automl",
+                        help="'fixed' reuses the clean model's tuned hyperparameters")
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    return parser.parse_args(argv)
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
     X, y = load_data()
-    stats_df = bootstrap_shap_stats(X, y, B=B)
-    os.makedirs(os.path.dirname(OUTPUT_STATS_PATH), exist_ok=True)
-    stats_df.to_csv(OUTPUT_STATS_PATH, index=False)
-    print(f"Bootstrap SHAP stats saved to {OUTPUT_STATS_PATH}")
+    stats_df, county_df = bootstrap_shap_stats(
+        X, y, B=args.replicates, mode=args.mode, n_workers=args.workers,
+        seed=args.seed, checkpoint_dir=args.checkpoint_dir, geoids=load_geoids(),
+    )
+    stats_path  = write_artifact(stats_df, OUTPUT_STATS)
+    county_path = write_artifact(county_df, OUTPUT_COUNTY_STATS)
+    print(f"Bootstrap SHAP stats saved to {stats_path} and {county_path}")
 
 if __name__ == "__main__":
     main()
@@ -4,3 +4,23 @@ import os
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 RAW_DATA_PATH = os.path.join(BASE_DIR, 'data', 'raw', 'voting_2021.csv')
 PROCESSED_DATA_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'voting_clean.csv')
+PROCESSED_DIR = os.path.join(BASE_DIR, 'data', 'processed')
+
+# On-disk format for data/processed tables ("parquet", "arrow" or "csv"),
+# and whether to also export a CSV copy of each
+ARTIFACT_FORMAT = 'parquet'
+EXPORT_CSV = False
+
+# Shared inputs / artifacts, so every stage (and pipeline.py) agrees on them
+SHAPEFILE_PATH = os.path.join(BASE_DIR, 'data', 'raw', 'shapefiles', 'cb_2018_us_county_500k.shp')
+CLEAN_MODEL_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'xgb_automl_model_clean.pkl')
+# Native XGBoost export of the clean model (+ .manifest.json), read by model_registry
+CLEAN_BOOSTER_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'xgb_clean_booster.ubj')
+CLEAN_MANIFEST_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'xgb_clean_booster.manifest.json')
+CLEAN_ARTIFACT = 'voting_clean'
+FEATURES_ARTIFACT = 'voting_features'
+
+# Memory budget (MiB) for "tract-scale" runs; None loads whole tables at once.
+# Stages that stream (features, SHAP, fairness, local regression) size their
+# row blocks from it; each accepts --memory-budget to override.
+MEMORY_BUDGET_MB = None
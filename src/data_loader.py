@@ -7,7 +7,8 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from config import RAW_DATA_PATH, PROCESSED_DATA_PATH
+from config import RAW_DATA_PATH, CLEAN_ARTIFACT
+from artifact_io import write_artifact
 
 def load_raw_data(path: str = RAW_DATA_PATH) -> pd.DataFrame:
     """Load raw voting CSV into a DataFrame."""
@@ -34,14 +35,15 @@ def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
 
     return df_clean
 
-def save_processed_data(df: pd.DataFrame, path: str = PROCESSED_DATA_PATH):
-    """Save the cleaned DataFrame to CSV."""
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    df.to_csv(path, index=False)
+def save_processed_data(df: pd.DataFrame, name: str = CLEAN_ARTIFACT) -> str:
+    """Save the cleaned DataFrame as a data/processed artifact."""
+    return write_artifact(df, name)
 
-if __name__ == '__main__':
-    # Run full pipeline
+def main():
     df_raw = load_raw_data()
     df_clean = preprocess_data(df_raw)
-    save_processed_data(df_clean)
-    print(f"Processed data saved to {PROCESSED_DATA_PATH}.")
+    path = save_processed_data(df_clean)
+    print(f"Processed data saved to {path}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# src/explanation_cache.py
+
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from batched_predictor import row_hashes
+
+# Paths
+CACHE_DIR = os.path.join(PROJECT_ROOT, "data", "processed", "cache")
+
+# Rows kept per stage before least-recently-used entries are evicted
+MAX_ROWS = 250_000
+
+
+def model_fingerprint(model):
+    """sha256 of the booster's JSON serialisation (stable across pickling)."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    return hashlib.sha256(bytes(booster.save_raw("json"))).hexdigest()
+
+
+def row_keys(X):
+    """64-bit content hash of every row of a numeric feature table."""
+    return row_hashes(np.asarray(X, dtype=np.float64))
+
+
+def digest(*parts):
+    """Short hash of arbitrary strings / arrays, for composing fingerprints."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.tobytes() if isinstance(part, np.ndarray) else str(part).encode())
+    return h.hexdigest()[:16]
+
+
+class ExplanationCache:
+    """
+    Per-stage, content-addressed store of per-row outputs.
+
+    Rows are keyed by a hash of their feature values; the whole store is
+    tagged with a fingerprint of everything else the output depends on
+    (model, backend, background sample...). Loading with a different
+    fingerprint or column set drops the stale entries. At most
+    ``max_rows`` rows are kept, evicting the least recently used.
+    """
+
+    def __init__(self, stage, fingerprint, columns, cache_dir=CACHE_DIR, max_rows=MAX_ROWS):
+        self.stage       = stage
+        self.fingerprint = fingerprint
+        self.columns     = list(columns)
+        self.path        = os.path.join(cache_dir, f"{stage}.npz")
+        self.max_rows    = max_rows
+        self.keys      = np.empty(0, dtype=np.uint64)
+        self.values    = np.empty((0, len(self.columns)))
+        self.last_used = np.empty(0, dtype=np.int64)
+        self.tick      = 0
+        self.hits = self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["fingerprint"] != self.fingerprint or meta["columns"] != self.columns:
+                print(f"[cache:{self.stage}] fingerprint changed, dropping {len(data['keys'])} stale rows")
+                return
+            self.keys, self.values = data["keys"], data["values"]
+            self.last_used, self.tick = data["last_used"], int(meta["tick"])
+
+    def lookup(self, keys):
+        """Return (values, hit): cached rows for ``keys``, NaN where ``hit`` is False."""
+        self.tick += 1
+        order = np.argsort(self.keys)
+        pos   = np.searchsorted(self.keys, keys, sorter=order)
+        pos   = np.minimum(pos, max(len(self.keys) - 1, 0))
+        hit   = np.zeros(len(keys), dtype=bool)
+        if len(self.keys):
+            pos = order[pos]
+            hit = self.keys[pos] == keys
+        values = np.full((len(keys), len(self.columns)), np.nan)
+        values[hit] = self.values[pos[hit]]
+        self.last_used[pos[hit]] = self.tick
+        self.hits   += int(hit.sum())
+        self.misses += int((~hit).sum())
+        return values, hit
+
+    def store(self, keys, values):
+        keys, first = np.unique(keys, return_index=True)
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.columns))[first]
+        keep = ~np.isin(self.keys, keys)
+        self.keys      = np.concatenate([self.keys[keep], keys])
+        self.values    = np.concatenate([self.values[keep], values])
+        self.last_used = np.concatenate([self.last_used[keep], np.full(len(keys), self.tick)])
+
+    def save(self):
+        if len(self.keys) > self.max_rows:
+            newest = np.argsort(self.last_used, kind="stable")[-self.max_rows:]
+            self.keys, self.values = self.keys[newest], self.values[newest]
+            self.last_used = self.last_used[newest]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        meta = json.dumps({"stage": self.stage, "fingerprint": self.fingerprint,
+                           "columns": self.columns, "tick": self.tick})
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, keys=self.keys, values=self.values, last_used=self.last_used, meta=meta)
+        os.replace(tmp, self.path)
+
+
+def cached_compute(stage, fingerprint, columns, keys, compute, enabled=True,
+                   cache_dir=CACHE_DIR, max_rows=MAX_ROWS):
+    """
+    Values for every row in ``keys``, computing only rows not in the cache.
+
+    ``compute(rows)`` receives the positions of the rows to recompute and
+    returns an array of shape (len(rows), len(columns)).
+    """
+    if not enabled:
+        return np.asarray(compute(np.arange(len(keys))), dtype=float).reshape(len(keys), -1)
+    cache = ExplanationCache(stage, fingerprint, columns, cache_dir=cache_dir, max_rows=max_rows)
+    values, hit = cache.lookup(keys)
+    todo = np.flatnonzero(~hit)
+    print(f"[cache:{stage}] {int(hit.sum())} rows reused, {len(todo)} to compute")
+    if len(todo):
+        values[todo] = np.asarray(compute(todo), dtype=float).reshape(len(todo), -1)
+        cache.store(keys[todo], values[todo])
+    cache.save()
+    return values
@@ -0,0 +1,186 @@
+# src/explanation_drift.py
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import PROCESSED_DIR
+from artifact_io import write_artifact
+from model_registry import FEATURE_LIST, TARGET, export_model, load_booster, model_params
+from temporal_loader import read_panel, panel_years, PANEL_DIR
+from shap_explainer import native_contribs
+
+# Paths / artifacts
+OUTPUT_ARTIFACT = "explanation_drift"          # long: GEOID x year x feature
+GLOBAL_ARTIFACT = "explanation_drift_global"   # year x feature importance and rank
+MODEL_DIR       = os.path.join(PROCESSED_DIR, "models")
+
+N_WORKERS = max(1, multiprocessing.cpu_count() - 1)   # years explained side by side
+SEED      = 42
+
+
+def year_model_path(year, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, f"xgb_{year}.ubj")
+
+
+def tuned_params():
+    """The clean model's tuned hyper-parameters, or XGBoost defaults when there is no clean model."""
+    try:
+        params = model_params()
+    except FileNotFoundError:
+        print("[drift] no clean model found; training per-year models with XGBoost defaults")
+        return {}
+    return {k: v for k, v in params.items() if k not in ("n_jobs", "nthread", "random_state", "seed")}
+
+
+def explain_year(year, params, retrain=False, n_threads=1, model_dir=MODEL_DIR, panel_dir=PANEL_DIR):
+    """
+    Load (or train and export) the year's model and explain every county
+    of that year's panel partition. Returns (year, GEOIDs, float32 phi
+    (n, p), expected value, seconds).
+    """
+    t0 = time.time()
+    df = read_panel(year, year, columns=FEATURE_LIST + [TARGET], panel_dir=panel_dir).dropna(subset=[TARGET])
+    X = df[FEATURE_LIST].astype(np.float32)
+    path = year_model_path(year, model_dir)
+    if retrain or not os.path.exists(path):
+        model = xgb.XGBRegressor(**params, n_jobs=n_threads, random_state=SEED)
+        model.fit(X, df[TARGET])
+        export_model(model, path, metrics={"year": int(year), "train_r2": float(model.score(X, df[TARGET]))})
+    values, expected_value = native_contribs(load_booster(path), X, n_threads=n_threads)
+    geoids = df["county_id"].astype(str).to_numpy()
+    return year, geoids, values, float(expected_value), time.time() - t0
+
+
+def explain_years(years, n_workers=N_WORKERS, retrain=False, params=None, model_dir=MODEL_DIR,
+                  panel_dir=PANEL_DIR):
+    """
+    Per-year SHAP on a process pool; returns {year: (GEOIDs, phi,
+    expected value)}. New per-year models use ``params`` (default: the
+    clean model's tuned configuration).
+    """
+    params    = tuned_params() if params is None else params
+    n_workers = max(1, min(n_workers, len(years)))
+    n_threads = max(1, multiprocessing.cpu_count() // n_workers)
+    out, t0 = {}, time.time()
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(explain_year, year, params, retrain, n_threads, model_dir, panel_dir)
+                   for year in years]
+        for future in as_completed(futures):
+            year, geoids, values, expected_value, secs = future.result()
+            out[year] = (geoids, values, expected_value)
+            print(f"[drift] {year}: {len(geoids)} counties explained in {secs:.1f}s")
+    print(f"[drift] {len(years)} years on {n_workers} workers in {time.time()-t0:.1f}s")
+    return out
+
+
+def stack_years(explained):
+    """
+    (years, GEOIDs, phi) with phi a (years, counties, features) array over
+    the union of counties; counties missing from a year are NaN there.
+    """
+    years  = np.asarray(sorted(explained))
+    geoids = pd.Index(np.unique(np.concatenate([explained[y][0] for y in years])))
+    phi = np.full((len(years), len(geoids), len(FEATURE_LIST)), np.nan, dtype=np.float32)
+    for t, year in enumerate(years):
+        ids, values, _ = explained[year]
+        phi[t, geoids.get_indexer(ids)] = values
+    return years, geoids, phi
+
+
+def importance_ranks(magnitude):
+    """1 = largest along the last axis; rows that are all NaN get rank 0."""
+    filled = np.where(np.isnan(magnitude), -np.inf, magnitude)
+    order  = np.argsort(-filled, axis=-1, kind="stable")
+    ranks  = np.empty(order.shape, dtype=np.int8)
+    np.put_along_axis(ranks, order, np.arange(1, magnitude.shape[-1] + 1, dtype=np.int8), axis=-1)
+    return np.where(np.isnan(magnitude).all(axis=-1, keepdims=True), 0, ranks).astype(np.int8)
+
+
+def lagged_change(a, rise_when_smaller=False):
+    """
+    ``a[t] - a[t-1]`` along the first axis (``a[t-1] - a[t]`` for ranks,
+    where a smaller number is a rise); NaN for the first year.
+    """
+    a = a.astype(np.float32)
+    out = np.full(a.shape, np.nan, dtype=np.float32)
+    out[1:] = a[:-1] - a[1:] if rise_when_smaller else a[1:] - a[:-1]
+    return out
+
+
+def drift_tables(years, geoids, phi):
+    """
+    Drift between consecutive years, for every county and feature at once:
+    the change in contribution, the county's rank of the feature by |phi|
+    and how many places it moved (positive = more important). Returns the
+    long per-county table and the per-year global importance table.
+    """
+    present = ~np.isnan(phi).all(axis=2)                       # (years, counties)
+    rank    = importance_ranks(np.abs(phi))                    # (years, counties, features)
+    delta   = lagged_change(phi)
+    moved   = lagged_change(np.where(rank == 0, np.nan, rank), rise_when_smaller=True)
+
+    t, c = np.nonzero(present)
+    n_feat = len(FEATURE_LIST)
+    local = pd.DataFrame({
+        "GEOID":       np.repeat(geoids.to_numpy()[c], n_feat),
+        "year":        np.repeat(years[t], n_feat).astype(np.int16),
+        "feature":     pd.Categorical.from_codes(np.tile(np.arange(n_feat), len(t)), FEATURE_LIST),
+        "phi":         phi[t, c].ravel(),
+        "delta_phi":   delta[t, c].ravel(),
+        "rank":        rank[t, c].ravel(),
+        "rank_change": moved[t, c].ravel(),
+    })
+
+    mean_abs = np.nanmean(np.abs(phi), axis=1)                 # (years, features)
+    g_rank   = importance_ranks(mean_abs)
+    mean_abs_delta = np.full(mean_abs.shape, np.nan, dtype=np.float32)
+    mean_abs_delta[1:] = np.nanmean(np.abs(delta[1:]), axis=1)
+    global_df = pd.DataFrame({
+        "year":           np.repeat(years, n_feat).astype(np.int16),
+        "feature":        np.tile(FEATURE_LIST, len(years)),
+        "mean_abs_phi":   mean_abs.ravel().astype(np.float32),
+        "mean_abs_delta": mean_abs_delta.ravel(),
+        "rank":           g_rank.ravel(),
+        "rank_change":    lagged_change(g_rank, rise_when_smaller=True).ravel(),
+        "counties":       np.repeat(present.sum(axis=1), n_feat),
+    })
+    return local, global_df
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-year SHAP and explanation drift across panel years")
+    parser.add_argument("--years", nargs="+", type=int, default=None,
+                        help="panel years to compare (default: all in the panel store)")
+    parser.add_argument("--workers", type=int, default=N_WORKERS, help="years explained in parallel")
+    parser.add_argument("--retrain", action="store_true", help="refit per-year models even if saved")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args  = parse_args(argv)
+    years = sorted(args.years or panel_years())
+    if not years:
+        raise FileNotFoundError("No panel years found; run temporal_loader.py first")
+    explained = explain_years(years, args.workers, args.retrain)
+    local, global_df = drift_tables(*stack_years(explained))
+    print(global_df.pivot(index="feature", columns="year", values="rank").to_string())
+    path = write_artifact(local, OUTPUT_ARTIFACT)
+    print(f"Explanation drift saved to {path} ({len(local)} rows)")
+    path = write_artifact(global_df, GLOBAL_ARTIFACT)
+    print(f"Global importance by year saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# src/fairness_engine.py
+
+import numpy as np
+import pandas as pd
+
+# Quantile strata per attribute (4 = quartiles)
+N_QUANTILES = 4
+
+
+def quantile_edges(values, n_quantiles=N_QUANTILES):
+    """Quantile-based stratum boundaries."""
+    return np.nanquantile(np.asarray(values, dtype=float), np.linspace(0, 1, n_quantiles + 1))
+
+
+def quantile_codes(values, edges):
+    """
+    Integer stratum of each value, -1 where missing. Strata are
+    right-closed with the lowest edge included (as ``pd.cut(...,
+    include_lowest=True)``); repeated edges just leave a stratum empty.
+    """
+    values = np.asarray(values, dtype=float)
+    codes  = np.searchsorted(edges, values, side="left") - 1
+    codes  = np.clip(codes, 0, len(edges) - 2)
+    codes[np.isnan(values)] = -1
+    return codes
+
+
+def grouping_name(grouping):
+    return "_x_".join(grouping)
+
+
+class FairnessEngine:
+    """
+    Residual statistics over quantile strata of any set of attributes
+    and their intersections.
+
+    Every row gets one integer cell per grouping (a single attribute or
+    a tuple of attributes, whose cell is the mixed-radix combination of
+    their quantile codes), offset so that all cells of all groupings
+    share one index. Counts, means and variances for every cell, and
+    for any number of residual vectors (models, resamples), then come
+    from a single ``bincount`` over ``vector * n_cells + cell``.
+    """
+
+    def __init__(self, attrs, groupings=None, n_quantiles=N_QUANTILES):
+        self.attrs       = {name: np.asarray(values, dtype=float) for name, values in attrs.items()}
+        self.n_quantiles = n_quantiles
+        self.groupings   = [tuple([g]) if isinstance(g, str) else tuple(g)
+                            for g in (groupings or list(self.attrs))]
+        self.edges = {name: quantile_edges(values, n_quantiles) for name, values in self.attrs.items()}
+        codes = {name: quantile_codes(self.attrs[name], self.edges[name]) for name in self.attrs}
+        self.n = len(next(iter(self.attrs.values())))
+
+        cells, offsets, labels = [], [0], []
+        for grouping in self.groupings:
+            cell    = np.zeros(self.n, dtype=np.int64)
+            missing = np.zeros(self.n, dtype=bool)
+            for name in grouping:
+                cell = cell * n_quantiles + codes[name]
+                missing |= codes[name] < 0
+            size = n_quantiles ** len(grouping)
+            cells.append(np.where(missing, -1, cell + offsets[-1]))
+            offsets.append(offsets[-1] + size)
+            local = np.indices((n_quantiles,) * len(grouping)).reshape(len(grouping), -1).T
+            labels += [(grouping_name(grouping), i, " & ".join(f"{a}=Q{q + 1}" for a, q in zip(grouping, qs)))
+                       for i, qs in enumerate(local)]
+        self.cells   = np.stack(cells, axis=1)     # (n, n_groupings), -1 = missing
+        self.offsets = np.asarray(offsets)
+        self.n_cells = offsets[-1]
+        self.labels  = pd.DataFrame(labels, columns=["grouping", "cell", "label"])
+
+    def stats(self, residuals, rows=None):
+        """
+        (counts, sums, sums of squares), each (n_vectors, n_cells), for
+        the rows of ``residuals`` ((n,) or (n_vectors, n)). ``rows``
+        ((n_vectors, n) positions) resamples rows per vector.
+        """
+        R = np.atleast_2d(np.asarray(residuals, dtype=float))
+        cells = np.broadcast_to(self.cells, (len(R),) + self.cells.shape)
+        if rows is not None:
+            cells = self.cells[rows]
+        valid = cells >= 0
+        flat  = (np.arange(len(R))[:, None, None] * self.n_cells + cells)[valid]
+        w     = np.broadcast_to(R[..., None], cells.shape)[valid]
+        size  = len(R) * self.n_cells
+        shape = (len(R), self.n_cells)
+        counts = np.bincount(flat, minlength=size).reshape(shape)
+        sums   = np.bincount(flat, weights=w, minlength=size).reshape(shape)
+        sumsq  = np.bincount(flat, weights=w * w, minlength=size).reshape(shape)
+        return counts, sums, sumsq
+
+    def means(self, residuals, rows=None, min_count=1):
+        counts, sums, _ = self.stats(residuals, rows)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts >= min_count, sums / counts, np.nan)
+
+    def gaps(self, residuals, rows=None, min_count=1):
+        """(n_vectors, n_groupings) gap: max - min cell mean within each grouping."""
+        means = self.means(residuals, rows, min_count)
+        out = np.full((len(means), len(self.groupings)), np.nan)
+        for g in range(len(self.groupings)):
+            block = means[:, self.offsets[g]:self.offsets[g + 1]]
+            seen  = ~np.isnan(block).all(axis=1)
+            out[seen, g] = np.nanmax(block[seen], axis=1) - np.nanmin(block[seen], axis=1)
+        return out
+
+    def group_table(self, residuals, models=None, min_count=1):
+        """Long table of (model, grouping, cell, label, count, mean_residual, std_residual)."""
+        counts, sums, sumsq = self.stats(residuals)
+        models = models or [f"model_{m}" for m in range(len(counts))]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / counts
+            std  = np.sqrt(np.maximum(sumsq / counts - mean ** 2, 0) * counts / (counts - 1))
+        keep = counts >= min_count
+        m, c = np.nonzero(keep)
+        table = self.labels.iloc[c].reset_index(drop=True)
+        table.insert(0, "model", np.asarray(models, dtype=object)[m])
+        table["count"] = counts[keep]
+        table["mean_residual"] = mean[keep]
+        table["std_residual"] = std[keep]
+        return table
+
+    def gap_table(self, residuals, models=None, min_count=1):
+        gaps = self.gaps(residuals, min_count=min_count)
+        models = models or [f"model_{m}" for m in range(len(gaps))]
+        return pd.DataFrame(gaps, index=pd.Index(models, name="model"),
+                            columns=[grouping_name(g) for g in self.groupings])
+
+    def row_columns(self, residual, rows=slice(None), means=None):
+        """
+        Per-row ``<grouping>_stratum``, ``_mean_residual`` and
+        ``_fairness_score`` columns for ``rows``, as a dict of arrays.
+        ``means`` (from ``means(residual_all)``) lets callers pass in
+        means computed over all rows when ``residual`` is one block.
+        """
+        residual = np.asarray(residual, dtype=float)
+        if means is None:
+            means = self.means(residual)
+        means = np.asarray(means).ravel()
+        cells = self.cells[rows]
+        out = {}
+        for g, grouping in enumerate(self.groupings):
+            name  = grouping_name(grouping)
+            cell  = cells[:, g]
+            valid = cell >= 0
+            mean  = np.where(valid, means[np.where(valid, cell, 0)], np.nan)
+            out[f"{name}_stratum"]        = np.where(valid, cell - self.offsets[g], np.nan)
+            out[f"{name}_mean_residual"]  = mean
+            out[f"{name}_fairness_score"] = np.abs(residual - mean)
+        return out
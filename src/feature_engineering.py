@@ -5,36 +5,35 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+import argparse
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import fiona
-from libpysal.weights import KNN
-import libpysal
 
-from config import PROCESSED_DATA_PATH
+from config import (SHAPEFILE_PATH, CLEAN_ARTIFACT, FEATURES_ARTIFACT as OUTPUT_ARTIFACT,
+                    PROCESSED_DIR, MEMORY_BUDGET_MB)
+from artifact_io import read_artifact, write_artifact, iter_artifact, artifact_columns, ArtifactWriter
+from spatial_weights import spatial_lags, stacked_weights, apply_lags
+from geometry_cache import load_geometry, DERIVED_COLUMNS
+from memory_budget import rows_per_block
 
-SHAPEFILE_PATH = os.path.join(
-    PROJECT_ROOT, "data", "raw", "shapefiles", "cb_2018_us_county_500k.shp"
-)
-OUTPUT_PATH = os.path.join(PROJECT_ROOT, "data", "processed", "voting_features.csv")
+# Demographic covariates that get spatially lagged, and the neighbour counts used
+LAG_FEATURES = [
+    "total_pop", "sex_ratio", "pct_black", "pct_hisp", "pct_bach",
+    "median_income", "pct_65_over", "pct_age_18_29", "gini", "pct_manuf",
+    "ln_pop_den", "pct_3rd_party", "turn_out", "pct_fb", "pct_uninsured",
+]
+LAG_KS = (5, 10, 20)
 
 
-def load_clean_data(path: str = PROCESSED_DATA_PATH) -> pd.DataFrame:
-    return pd.read_csv(path, dtype={"county_id": str})
+def load_clean_data(name: str = CLEAN_ARTIFACT) -> pd.DataFrame:
+    return read_artifact(name)
 
 
 def load_county_shapefile(path: str = SHAPEFILE_PATH) -> gpd.GeoDataFrame:
-    # Auto-rebuild .shx if missing
-    with fiona.Env(SHAPE_RESTORE_SHX="YES"):
-        gdf = gpd.read_file(path)
-
-    # Ensure CRS is projected for accurate distance/centroid
-    # Albers Equal Area for CONUS: EPSG 5070
-    if gdf.crs != "EPSG:5070":
-        gdf = gdf.to_crs("EPSG:5070")
-
-    gdf["GEOID"] = gdf["GEOID"].astype(str).str.zfill(5)
-    return gdf
+    # Projected (Albers Equal Area for CONUS, EPSG 5070) for accurate
+    # distance/centroid; centroids come precomputed from the geometry cache
+    return load_geometry("EPSG:5070", path=path)
 
 
 def merge_voting_with_geometries(
@@ -48,34 +47,108 @@ def merge_voting_with_geometries(
     return merged
 
 
-def add_spatial_lag(
-    gdf: gpd.GeoDataFrame, var: str, k: int = 5
-) -> gpd.GeoDataFrame:
+def centroid_coords(gdf: gpd.GeoDataFrame) -> np.ndarray:
     # Use projected centroids for neighbor distances
-    centroids = gdf.geometry.centroid
-    coords = [(pt.x, pt.y) for pt in centroids]
+    if {"centroid_x", "centroid_y"} <= set(gdf.columns):
+        return gdf[["centroid_x", "centroid_y"]].to_numpy()
+    return gdf.geometry.centroid.get_coordinates().to_numpy()
 
-    # Build k-NN weights
-    w = KNN.from_array(coords, k=k)
-    # Properly row-standardize
-    w.transform='R'
 
-    # Compute spatial lag
-    lag_vals = libpysal.weights.lag_spatial(w, gdf[var].values)
-    gdf[f"{var}_lag{k}"] = lag_vals
+def add_spatial_lags(
+    gdf: gpd.GeoDataFrame, variables, ks=(5,), kernel: str = "knn", **kwargs
+) -> gpd.GeoDataFrame:
+    """Row-standardised spatial lags of ``variables`` for every k (see spatial_weights)."""
+    lags = spatial_lags(gdf[list(variables)], centroid_coords(gdf), ks=ks, kernel=kernel, **kwargs)
+    gdf[lags.columns] = lags
     return gdf
 
 
-def save_features(gdf: gpd.GeoDataFrame, output_path: str = OUTPUT_PATH) -> None:
-    df = gdf.drop(columns="geometry")
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df.to_csv(output_path, index=False)
-    print(f"Features saved to {output_path}")
-
-
-if __name__ == "__main__":
+def add_spatial_lag(
+    gdf: gpd.GeoDataFrame, var: str, k: int = 5
+) -> gpd.GeoDataFrame:
+    return add_spatial_lags(gdf, [var], ks=(k,))
+
+
+def save_features(gdf: gpd.GeoDataFrame, name: str = OUTPUT_ARTIFACT) -> None:
+    df = pd.DataFrame(gdf.drop(columns=["geometry"] + DERIVED_COLUMNS, errors="ignore"))
+    path = write_artifact(df, name)
+    print(f"Features saved to {path}")
+
+
+def stream_features(memory_budget_mb, geometry=None, source=CLEAN_ARTIFACT,
+                    name=OUTPUT_ARTIFACT, directory=PROCESSED_DIR):
+    """
+    ``main`` for tables too large to hold whole (e.g. tracts).
+
+    The first pass keeps only the lagged variables of every matched row;
+    the second merges each block of the clean table with its geometry
+    attributes (centroids only, polygons are never decoded), adds that
+    block's rows of the sparse lags and appends it to the output. Rows
+    come out in the clean table's order.
+    """
+    if geometry is None:
+        geometry = load_geometry("EPSG:5070", geometry=False)
+    geometry = geometry.drop(columns=[c for c in DERIVED_COLUMNS if c not in ("centroid_x", "centroid_y")],
+                             errors="ignore")
+    lagged = ["new_pct_dem"] + LAG_FEATURES
+    n_cols = len(artifact_columns(source, directory)) + geometry.shape[1] + len(LAG_FEATURES) * len(LAG_KS) + 1
+    # ~4 live copies of a block while it is converted, merged and written
+    block_rows = rows_per_block(8 * n_cols * 4, memory_budget_mb)
+
+    # 1) Lagged variables and coordinates of every matched row
+    geoids = pd.Index(geometry["GEOID"])
+    positions, parts = [], []
+    for block in iter_artifact(source, columns=["county_id"] + lagged, batch_rows=block_rows,
+                               directory=directory):
+        pos  = geoids.get_indexer(block["county_id"].str.zfill(5))
+        keep = pos >= 0
+        positions.append(pos[keep])
+        parts.append(block.loc[keep, lagged].to_numpy(dtype=np.float64))
+    positions = np.concatenate(positions)
+    values = pd.DataFrame(np.concatenate(parts), columns=lagged)
+    del parts
+    coords = geometry[["centroid_x", "centroid_y"]].to_numpy()[positions]
+    cache_dir = os.path.join(directory, "weights")
+    target_lag = stacked_weights(coords, ks=(5,), cache_dir=cache_dir)
+    demo_lags  = stacked_weights(coords, ks=LAG_KS, cache_dir=cache_dir)
+
+    # 2) Merge, lag and write block by block
+    attrs  = geometry.drop(columns=["centroid_x", "centroid_y"])
+    offset = 0
+    with ArtifactWriter(name, directory=directory) as writer:
+        for block in iter_artifact(source, batch_rows=block_rows, directory=directory):
+            block = block.rename(columns={"county_id": "fips"})
+            block["fips"] = block["fips"].str.zfill(5)
+            merged = block.merge(attrs, left_on="fips", right_on="GEOID", how="inner")
+            merged = merged[list(attrs.columns) + list(block.columns)]
+            rows = slice(offset, offset + len(merged))
+            offset += len(merged)
+            lags = pd.concat([apply_lags(*target_lag, values[["new_pct_dem"]], rows=rows),
+                              apply_lags(*demo_lags, values[LAG_FEATURES], rows=rows)], axis=1)
+            merged[list(lags.columns)] = lags.to_numpy()
+            writer.write(merged)
+    print(f"Features saved to {writer.path} ({writer.rows} rows in blocks of {block_rows})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Merge clean data with geometry and add spatial lags")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="stream over row blocks sized to this budget")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.memory_budget:
+        stream_features(args.memory_budget)
+        return
     voting_df = load_clean_data()
     counties_gdf = load_county_shapefile()
     geo_df = merge_voting_with_geometries(voting_df, counties_gdf)
     geo_df = add_spatial_lag(geo_df, var="new_pct_dem", k=5)
+    geo_df = add_spatial_lags(geo_df, LAG_FEATURES, ks=LAG_KS)
     save_features(geo_df)
+
+
+if __name__ == "__main__":
+    main()
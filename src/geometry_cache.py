@@ -0,0 +1,217 @@
+# src/geometry_cache.py
+
+import os
+import sys
+import glob
+import hashlib
+import argparse
+import shapely
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import PROCESSED_DIR, SHAPEFILE_PATH
+
+# One GeoParquet file per (source shapefile hash, CRS)
+GEOMETRY_DIR = os.path.join(PROCESSED_DIR, "geometry")
+
+# Centroids and areas are always measured in this equal-area projection
+PROJECTED_CRS = "EPSG:5070"
+
+# Web-map copies: coverage-simplification tolerance (metres, in
+# PROJECTED_CRS) and decimal places of the EPSG:4326 coordinates kept
+SIMPLIFY_LEVELS = {
+    "national": (5000, 3),
+    "state":    (1000, 4),
+    "county":   (200, 5),
+}
+MAP_CRS = "EPSG:4326"
+
+# Columns added to the shapefile's own attributes
+DERIVED_COLUMNS = ["centroid_x", "centroid_y", "area_km2", "minx", "miny", "maxx", "maxy"]
+
+# Persisted spatial index: rows are stored in Hilbert-curve order of their
+# bounding boxes, in row groups of ROW_GROUP_ROWS, so each row group covers
+# a compact area and its footer min/max of minx..maxy is a bounding box a
+# bbox read is pruned on. SOURCE_ROW restores the shapefile's row order.
+ROW_GROUP_ROWS = 128
+SOURCE_ROW     = "source_row"
+LAYOUT         = "h1"    # part of the cache key; bump when the on-disk layout changes
+
+
+def source_hash(path=SHAPEFILE_PATH):
+    """Short hash of every component file (.shp, .shx, .dbf, .prj, ...) of a shapefile."""
+    h = hashlib.sha256()
+    for part in sorted(glob.glob(os.path.splitext(path)[0] + ".*")):
+        if part.endswith(".xml"):
+            continue
+        h.update(os.path.basename(part).encode())
+        with open(part, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def cache_path(crs, key, directory=GEOMETRY_DIR):
+    return os.path.join(directory, f"counties_{crs.replace(':', '').lower()}_{key}.parquet")
+
+
+def write_indexed(gdf, target, row_group_rows=ROW_GROUP_ROWS):
+    """Write ``gdf`` in the spatially indexed layout (see ROW_GROUP_ROWS)."""
+    gdf = gdf.assign(**{SOURCE_ROW: range(len(gdf))})
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort(kind="stable")]
+    gdf.to_parquet(target + ".tmp", index=False, row_group_size=row_group_rows)
+    os.replace(target + ".tmp", target)
+
+
+def source_order(df):
+    """Rows back in shapefile order, without the SOURCE_ROW column."""
+    return df.sort_values(SOURCE_ROW, kind="stable").drop(columns=SOURCE_ROW).reset_index(drop=True)
+
+
+def read_shapefile(path=SHAPEFILE_PATH):
+    # Let GDAL rebuild a missing .shx instead of failing
+    os.environ.setdefault("SHAPE_RESTORE_SHX", "YES")
+    gdf = gpd.read_file(path)
+    gdf["GEOID"] = gdf["GEOID"].astype(str).str.zfill(5)
+    return gdf
+
+
+def build_geometry(crs, path=SHAPEFILE_PATH):
+    """
+    County polygons in ``crs`` plus centroids (x, y) and area in
+    PROJECTED_CRS, and each polygon's bounding box in ``crs``.
+    """
+    gdf = read_shapefile(path)
+    projected = gdf.to_crs(PROJECTED_CRS)
+    centroids = projected.geometry.centroid
+    gdf = projected if crs == PROJECTED_CRS else gdf.to_crs(crs)
+    gdf["centroid_x"] = centroids.x.to_numpy()
+    gdf["centroid_y"] = centroids.y.to_numpy()
+    gdf["area_km2"]   = projected.geometry.area.to_numpy() / 1e6
+    gdf[["minx", "miny", "maxx", "maxy"]] = gdf.geometry.bounds.to_numpy()
+    return gdf
+
+
+def load_geometry(crs=PROJECTED_CRS, columns=None, bbox=None, sindex=False,
+                  geometry=True, path=SHAPEFILE_PATH, directory=GEOMETRY_DIR):
+    """
+    County geometries in ``crs``, from the GeoParquet cache when it was
+    built from the current shapefile (otherwise rebuilt and cached).
+
+    ``columns`` restricts the attributes read (GEOID and geometry are
+    always included); ``bbox`` = (minx, miny, maxx, maxy) in ``crs``
+    keeps only counties whose bounding box intersects it. That query
+    runs on the index persisted in the file (Hilbert-ordered row groups
+    whose footer statistics bound their boxes): row groups away from
+    ``bbox`` are never read, and the stored bbox columns filter the rest
+    before geometries are decoded. Rows come back in shapefile order.
+
+    With ``sindex`` the in-memory STR-tree for predicate queries is
+    built before returning; shapely cannot save one, but it is bulk
+    loaded from rows that are already spatially sorted. With
+    ``geometry=False`` the polygons are not decoded at all and a plain
+    DataFrame of the attributes comes back.
+    """
+    key    = f"{source_hash(path)}_{LAYOUT}"
+    target = cache_path(crs, key, directory)
+    if not os.path.exists(target):
+        gdf = build_geometry(crs, path)
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(cache_path(crs, "*", directory)):
+            os.remove(stale)
+        write_indexed(gdf, target)
+        print(f"[geometry] cached {len(gdf)} counties in {crs} to {target} "
+              f"(Hilbert-ordered, {ROW_GROUP_ROWS}-row groups)")
+
+    if columns is not None:
+        columns = list(dict.fromkeys(["GEOID"] + list(columns) + [SOURCE_ROW, "geometry"]))
+    filters = None
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        filters = [("maxx", ">=", minx), ("minx", "<=", maxx),
+                   ("maxy", ">=", miny), ("miny", "<=", maxy)]
+    if not geometry:
+        names = columns or pq.read_schema(target).names
+        names = [c for c in names if c != "geometry"]
+        return source_order(pq.read_table(target, columns=names, filters=filters, memory_map=True).to_pandas())
+    gdf = source_order(gpd.read_parquet(target, columns=columns, filters=filters, memory_map=True))
+    if sindex:
+        gdf.sindex
+    return gdf
+
+
+def simplified_path(level, key, directory=GEOMETRY_DIR):
+    return os.path.join(directory, f"counties_simplified_{level}_{key}.parquet")
+
+
+def simplify_counties(gdf, level):
+    """
+    GEOID + polygons simplified for ``level`` and reprojected to MAP_CRS.
+
+    ``coverage_simplify`` simplifies each shared border once, so
+    neighbouring counties keep meeting exactly (no slivers or gaps);
+    coordinates are then snapped to the level's decimal grid, which maps
+    shared vertices to the same point.
+    """
+    tolerance, decimals = SIMPLIFY_LEVELS[level]
+    projected = gdf[["GEOID", "geometry"]].to_crs(PROJECTED_CRS)
+    simplified = shapely.coverage_simplify(projected.geometry.values, tolerance)
+    out = gpd.GeoDataFrame({"GEOID": projected["GEOID"].to_numpy()},
+                           geometry=gpd.GeoSeries(simplified, crs=PROJECTED_CRS)).to_crs(MAP_CRS)
+    out["geometry"] = shapely.set_precision(out.geometry.values, 10.0 ** -decimals, mode="pointwise")
+    return out
+
+
+def load_simplified(level="national", path=SHAPEFILE_PATH, directory=GEOMETRY_DIR):
+    """
+    County outlines for web maps at ``level`` (see SIMPLIFY_LEVELS), in
+    MAP_CRS with GEOID only, from the GeoParquet cache when it was built
+    from the current shapefile (otherwise rebuilt and cached).
+    """
+    if level not in SIMPLIFY_LEVELS:
+        raise ValueError(f"Unknown level '{level}'; expected one of {list(SIMPLIFY_LEVELS)}")
+    key    = source_hash(path)
+    target = simplified_path(level, key, directory)
+    if not os.path.exists(target):
+        gdf = simplify_counties(read_shapefile(path), level)
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(simplified_path(level, "*", directory)):
+            os.remove(stale)
+        gdf.to_parquet(target + ".tmp", index=False)
+        os.replace(target + ".tmp", target)
+        print(f"[geometry] cached {level} outlines of {len(gdf)} counties to {target}")
+    return gpd.read_parquet(target, memory_map=True)
+
+
+def payload_report(levels=tuple(SIMPLIFY_LEVELS), path=SHAPEFILE_PATH):
+    """Vertex count and GeoJSON size of the full-resolution outlines and of each level."""
+    full = load_geometry(MAP_CRS, columns=[], path=path)
+    rows = [("full", shapely.get_num_coordinates(full.geometry.values).sum(), len(full.to_json()))]
+    for level in levels:
+        gdf = load_simplified(level, path)
+        rows.append((level, shapely.get_num_coordinates(gdf.geometry.values).sum(), len(gdf.to_json())))
+    print(f"{'level':<10} {'vertices':>10} {'GeoJSON MB':>11}")
+    for level, vertices, size in rows:
+        print(f"{level:<10} {vertices:>10} {size / 2**20:>11.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the county geometry caches")
+    parser.add_argument("--levels", nargs="+", choices=list(SIMPLIFY_LEVELS), default=list(SIMPLIFY_LEVELS),
+                        help="simplified web-map levels to build")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_geometry(PROJECTED_CRS)
+    load_geometry(MAP_CRS, columns=[])
+    payload_report(args.levels)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
 # src/geoshapley_explainer.py
 
-import os, sys, time, math, joblib, multiprocessing, pandas as pd
+import os, sys, time, math, json, shutil, argparse, multiprocessing
+import numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from geoshapley import GeoShapleyExplainer
 
 # ── Project root setup ───────────────────────────────────────────────────────
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.insert(0, PROJECT_ROOT)
 
-# ── Paths ────────────────────────────────────────────────────────────────────
-FEATURES_CSV = os.path.join(PROJECT_ROOT, "data/processed/voting_features.csv")
-MODEL_PATH   = os.path.join(PROJECT_ROOT, "data/processed/xgb_automl_model_clean.pkl")
-OUTPUT_CSV   = os.path.join(PROJECT_ROOT, "data/processed/geoshapley_explanations.csv")
+from config import FEATURES_ARTIFACT
+import model_registry
+from batched_predictor import BatchedPredictor
+from tree_geoshapley import explain_tree, compare_engines, CHUNK_ROWS
+from explanation_cache import cached_compute, model_fingerprint, row_keys, digest
+from artifact_io import read_artifact, write_artifact, read_frame, write_frame
+
+# ── Paths / artifacts ────────────────────────────────────────────────────────
+OUTPUT_ARTIFACT    = "geoshapley_explanations"
+CHUNK_DIR          = os.path.join(PROJECT_ROOT, "data/processed/geoshapley_chunks")
+AGREEMENT_ARTIFACT = "geoshapley_engine_agreement"
 
 # ── Define features ──────────────────────────────────────────────────────────
 geo_features = ["proj_x", "proj_y"]
@@ -19,78 +28,275 @@ feat_list    = [
     "median_income","pct_65_over","pct_age_18_29","gini","pct_manuf",
     "ln_pop_den","pct_3rd_party","turn_out","pct_fb","pct_uninsured"
 ]
-ALL_FEATURES = geo_features + feat_list
+ALL_FEATURES = geo_features + feat_list          # model (training) order
+EXPLAIN_ORDER = feat_list + geo_features         # GeoShapley wants location columns last
+MODEL_COLUMNS = [EXPLAIN_ORDER.index(f) for f in ALL_FEATURES]
+OUTPUT_COLUMNS = ["phi_base", "phi_GEO"] + [
+    c for feat in feat_list for c in (f"phi_{feat}", f"phi_int_{feat}")
+]
 
 # ── Tuning params ────────────────────────────────────────────────────────────
-BG_SIZE  = 20
-N_JOBS   = max(1, multiprocessing.cpu_count() - 1)
-CHUNK_SZ = 500
+BG_SIZE   = 20
+N_JOBS    = max(1, multiprocessing.cpu_count() - 1)   # joblib processes inside explainer.explain
+N_WORKERS = 1                                         # chunks explained side by side
+CHUNK_SZ  = 500
+MAX_BATCH_ROWS = 1 << 18                              # rows per inplace_predict call
+ENGINES   = ("sampling", "tree")
+
+# Per-process state, filled by init_worker
+_STATE = {}
+
+
+def load_features():
+    df = read_artifact(FEATURES_ARTIFACT, columns=["GEOID"] + EXPLAIN_ORDER)
+    return df["GEOID"], df[EXPLAIN_ORDER]
+
+
+def load_model():
+    return model_registry.load_model(features=ALL_FEATURES)
+
+
+def chunk_bounds(n, chunk_size):
+    return [(i*chunk_size, min((i+1)*chunk_size, n)) for i in range(math.ceil(n / chunk_size))]
+
+
+def chunk_path(chunk_dir, i):
+    return os.path.join(chunk_dir, f"chunk_{i:05d}.parquet")
+
+
+def init_worker(bg_size=BG_SIZE, max_batch_rows=MAX_BATCH_ROWS):
+    """
+    Load data and explainer once per process. The predictor loads the
+    model on first use, in whichever process (or joblib worker) calls it.
+    """
+    geoids, X_geo = load_features()
+    predictor     = BatchedPredictor(load_model, max_batch_rows=max_batch_rows,
+                                     column_order=MODEL_COLUMNS)
+    background    = X_geo.sample(n=bg_size, random_state=42).values
+    _STATE.update(
+        geoids=geoids,
+        X_geo=X_geo,
+        explainer=GeoShapleyExplainer(predictor, background),
+    )
+
+
+def results_to_frame(res, ids):
+    # Unpack correct attrs
+    phi_base    = res.base_value         # φ₀
+    phi_geo     = res.geo                # intrinsic location
+    phi_primary = res.primary            # shape (m, 15)
+    phi_int     = res.geo_intera         # shape (m, 15)
+
+    chunk_df = pd.DataFrame({
+        "GEOID":    ids,
+        "phi_base": phi_base,
+        "phi_GEO":  phi_geo
+    })
+    # only loop feat_list!
+    for j, feat in enumerate(feat_list):
+        chunk_df[f"phi_{feat}"]     = phi_primary[:, j]
+        chunk_df[f"phi_int_{feat}"] = phi_int[:, j]
+    return chunk_df
+
+
+def explain_chunk(i, rows, n_jobs, chunk_dir):
+    """
+    Explain the rows at positions ``rows`` and write them to the chunk's
+    own file. Returns (i, seconds).
+    """
+    explainer = _STATE["explainer"]
+    Xc  = _STATE["X_geo"].iloc[rows]
+    ids = _STATE["geoids"].iloc[rows].reset_index(drop=True)
+
+    t0 = time.time()
+    try:
+        res = explainer.explain(Xc, n_jobs=n_jobs)
+    except Exception as e:
+        print(f"  chunk {i}: parallel failed: {e}; retry single-thread")
+        res = explainer.explain(Xc, n_jobs=1)
 
-def main():
-    # 1) Load data
-    df     = pd.read_csv(FEATURES_CSV, dtype={"GEOID": str})
-    geoids = df["GEOID"]
-    X_geo  = df[ALL_FEATURES]
+    # write_frame writes then renames, so a crash never leaves a partial chunk behind
+    path = chunk_path(chunk_dir, i)
+    write_frame(results_to_frame(res, ids), path)
+    return i, time.time() - t0
 
-    # 2) Load model
-    automl   = joblib.load(MODEL_PATH)
-    wrapped  = automl.model
-    xgb_model = wrapped.model if hasattr(wrapped, "model") else wrapped
 
-    # 3) Background sample
-    background = X_geo.sample(n=BG_SIZE, random_state=42).values
+def check_manifest(chunk_dir, manifest):
+    """Refuse to mix chunks written with a different layout, model or background."""
+    os.makedirs(chunk_dir, exist_ok=True)
+    path = os.path.join(chunk_dir, "manifest.json")
+    if os.path.exists(path):
+        with open(path) as fh:
+            if json.load(fh) != manifest:
+                raise ValueError(
+                    f"Chunks in {chunk_dir} were written with different settings; "
+                    "remove them or pick another chunk directory."
+                )
+    else:
+        with open(path, "w") as fh:
+            json.dump(manifest, fh, indent=2)
 
-    # 4) Init explainer
-    explainer = GeoShapleyExplainer(xgb_model.predict, background)
 
-    # 5) Chunked explain
-    n      = len(X_geo)
-    chunks = math.ceil(n / CHUNK_SZ)
-    all_chunks = []
+def run_chunks(chunk_size=CHUNK_SZ, n_workers=N_WORKERS, n_jobs=N_JOBS,
+               bg_size=BG_SIZE, chunk_dir=CHUNK_DIR, max_batch_rows=MAX_BATCH_ROWS,
+               rows=None, fingerprint=""):
+    """
+    Explain the rows at positions ``rows`` (default: all) in chunks.
 
-    print(f"GeoShapley: {n} pts in {chunks} chunks (BG={BG_SIZE}, jobs={N_JOBS})")
+    ``n_workers`` processes explain chunks side by side, each passing
+    ``n_jobs`` to ``explainer.explain``. Each finished chunk is written
+    under a run directory named after the settings and the rows' content,
+    so it survives a crash and a rerun of the same job skips it.
+    """
+    geoids, X_geo = load_features()
+    rows   = np.arange(len(geoids)) if rows is None else np.asarray(rows)
+    bounds = chunk_bounds(len(rows), chunk_size)
+    manifest = {
+        "chunk_size": chunk_size, "bg_size": bg_size, "features": EXPLAIN_ORDER,
+        "fingerprint": fingerprint, "rows": digest(row_keys(X_geo.iloc[rows])),
+    }
+    run_dir = os.path.join(chunk_dir, digest(json.dumps(manifest, sort_keys=True)))
+    check_manifest(run_dir, manifest)
+
+    todo = [i for i in range(len(bounds)) if not os.path.exists(chunk_path(run_dir, i))]
+    print(f"GeoShapley: {len(rows)} pts in {len(bounds)} chunks, {len(bounds)-len(todo)} already done "
+          f"(BG={bg_size}, workers={n_workers}, jobs={n_jobs})")
     t0_all = time.time()
 
-    for i in range(chunks):
-        lo, hi = i*CHUNK_SZ, min((i+1)*CHUNK_SZ, n)
-        Xc = X_geo.iloc[lo:hi]
-        ids= geoids.iloc[lo:hi].reset_index(drop=True)
-
-        print(f" Chunk {i+1}/{chunks} [{lo}:{hi}]")
-        t0 = time.time()
-        try:
-            res = explainer.explain(Xc, n_jobs=N_JOBS)
-        except Exception as e:
-            print("  parallel failed:", e, "; retry single-thread")
-            res = explainer.explain(Xc, n_jobs=1)
-        print(f"  done in {time.time()-t0:.1f}s")
-
-        # 6) Unpack correct attrs
-        phi_base    = res.base_value         # φ₀
-        phi_geo     = res.geo                # intrinsic location
-        phi_primary = res.primary            # shape (m, 15)
-        phi_int     = res.geo_intera         # shape (m, 15)
-
-        # 7) Build chunk DataFrame
-        chunk_df = pd.DataFrame({
-            "GEOID":    ids,
-            "phi_base": phi_base,
-            "phi_GEO":  phi_geo
-        })
-        # only loop feat_list!
-        for j, feat in enumerate(feat_list):
-            chunk_df[f"phi_{feat}"]     = phi_primary[:, j]
-            chunk_df[f"phi_int_{feat}"] = phi_int[:, j]
-
-        all_chunks.append(chunk_df)
+    if n_workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                 initargs=(bg_size, max_batch_rows)) as pool:
+            futures = [pool.submit(explain_chunk, i, rows[slice(*bounds[i])], n_jobs, run_dir)
+                       for i in todo]
+            for fut in as_completed(futures):
+                i, secs = fut.result()
+                print(f" Chunk {i+1}/{len(bounds)} {list(bounds[i])} done in {secs:.1f}s")
+    elif todo:
+        init_worker(bg_size, max_batch_rows)
+        for i in todo:
+            _, secs = explain_chunk(i, rows[slice(*bounds[i])], n_jobs, run_dir)
+            print(f" Chunk {i+1}/{len(bounds)} {list(bounds[i])} done in {secs:.1f}s")
 
     print(f"All chunks done in {time.time()-t0_all:.1f}s")
+    final_df = merge_chunks(run_dir, geoids.iloc[rows], chunk_size)
+    final_df.attrs["run_dir"] = run_dir
+    return final_df
+
+
+def merge_chunks(chunk_dir, geoids, chunk_size=CHUNK_SZ):
+    """Concatenate chunk files, checking that every chunk is present and complete."""
+    bounds  = chunk_bounds(len(geoids), chunk_size)
+    missing = [i for i in range(len(bounds)) if not os.path.exists(chunk_path(chunk_dir, i))]
+    if missing:
+        raise RuntimeError(f"{len(missing)} GeoShapley chunks missing from {chunk_dir}: {missing}")
+
+    final_df = pd.concat(
+        [read_frame(chunk_path(chunk_dir, i)) for i in range(len(bounds))],
+        ignore_index=True,
+    )
+    if not final_df["GEOID"].equals(geoids.reset_index(drop=True)):
+        raise RuntimeError(f"GeoShapley chunks in {chunk_dir} do not line up with {FEATURES_ARTIFACT}")
+    return final_df
+
+
+def run_sampling(chunk_size=CHUNK_SZ, n_workers=N_WORKERS, n_jobs=N_JOBS, bg_size=BG_SIZE,
+                 chunk_dir=CHUNK_DIR, max_batch_rows=MAX_BATCH_ROWS, use_cache=True):
+    """
+    Sampling engine over all rows. With ``use_cache`` only counties whose
+    features changed (for the same model and background) are explained;
+    their chunk directory is removed once the results are cached.
+    """
+    geoids, X_geo = load_features()
+    background  = X_geo.sample(n=bg_size, random_state=42).values
+    fingerprint = digest(model_fingerprint(load_model()), "sampling", EXPLAIN_ORDER,
+                         row_keys(background))
+
+    run_dirs = []
+
+    def compute(rows):
+        run_df = run_chunks(chunk_size, n_workers, n_jobs, bg_size, chunk_dir, max_batch_rows,
+                            rows=rows, fingerprint=fingerprint)
+        run_dirs.append(run_df.attrs["run_dir"])
+        return run_df[OUTPUT_COLUMNS].to_numpy()
+
+    values = cached_compute("geoshapley_sampling", fingerprint, OUTPUT_COLUMNS,
+                            row_keys(X_geo), compute, enabled=use_cache)
+    if use_cache:
+        for run_dir in run_dirs:
+            shutil.rmtree(run_dir, ignore_errors=True)
+    out = pd.DataFrame(values, columns=OUTPUT_COLUMNS)
+    out.insert(0, "GEOID", geoids.values)
+    return out
+
+
+def run_tree(n_jobs=N_JOBS, chunk_rows=CHUNK_ROWS, use_cache=True):
+    """Exact TreeSHAP-interaction engine over all rows (see tree_geoshapley)."""
+    df        = read_artifact(FEATURES_ARTIFACT, columns=["GEOID"] + ALL_FEATURES)
+    X         = df[ALL_FEATURES]
+    xgb_model = load_model()
+    t0        = time.time()
+
+    def compute(rows):
+        tree_df = explain_tree(xgb_model.get_booster(), X.iloc[rows], geo_features, feat_list,
+                               chunk_rows=chunk_rows, nthread=n_jobs)
+        return tree_df[OUTPUT_COLUMNS].to_numpy()
+
+    fingerprint = digest(model_fingerprint(xgb_model), "tree", ALL_FEATURES)
+    values = cached_compute("geoshapley_tree", fingerprint, OUTPUT_COLUMNS,
+                            row_keys(X), compute, enabled=use_cache)
+    print(f"GeoShapley (tree): {len(df)} pts in {time.time()-t0:.1f}s")
+    out = pd.DataFrame(values, columns=OUTPUT_COLUMNS)
+    out.insert(0, "GEOID", df["GEOID"].values)
+    return out
+
+
+def check_agreement(tree_df, n_rows, bg_size=BG_SIZE, n_jobs=N_JOBS):
+    """Run the sampling engine on a random subset of rows and compare it with the tree engine."""
+    init_worker(bg_size)
+    X_geo = _STATE["X_geo"]
+    rows  = X_geo.sample(n=min(n_rows, len(X_geo)), random_state=0).index
+    res   = _STATE["explainer"].explain(X_geo.loc[rows], n_jobs=n_jobs)
+    ref   = results_to_frame(res, _STATE["geoids"].loc[rows].reset_index(drop=True))
+    return compare_engines(ref, tree_df.loc[rows].reset_index(drop=True))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chunked, resumable GeoShapley")
+    parser.add_argument("--engine", choices=ENGINES, default="sampling",
+                        help="'tree' computes GeoShapley from exact TreeSHAP interaction values")
+    parser.add_argument("--check", type=int, default=0, metavar="N",
+                        help="with --engine tree, compare against the sampling engine on N rows")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SZ)
+    parser.add_argument("--workers", type=int, default=N_WORKERS,
+                        help="chunks explained in parallel processes")
+    parser.add_argument("--jobs", type=int, default=N_JOBS,
+                        help="n_jobs passed to explainer.explain within each chunk")
+    parser.add_argument("--bg-size", type=int, default=BG_SIZE)
+    parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS,
+                        help="row budget per model prediction call")
+    parser.add_argument("--chunk-dir", default=CHUNK_DIR)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompute every county instead of reusing cached explanations")
+    return parser.parse_args(argv)
+
 
-    # 8) Concat & save
-    final_df = pd.concat(all_chunks, ignore_index=True)
-    os.makedirs(os.path.dirname(OUTPUT_CSV), exist_ok=True)
-    final_df.to_csv(OUTPUT_CSV, index=False)
-    print("Saved geoshapley_explanations.csv")
+def main(argv=None):
+    args = parse_args(argv)
+    if args.engine == "tree":
+        final_df = run_tree(n_jobs=args.jobs, use_cache=not args.no_cache)
+        if args.check:
+            agreement = check_agreement(final_df, args.check, bg_size=args.bg_size, n_jobs=args.jobs)
+            print(agreement.to_string(index=False))
+            path = write_artifact(agreement, AGREEMENT_ARTIFACT)
+            print(f"Engine agreement saved to {path}")
+    else:
+        final_df = run_sampling(
+            chunk_size=args.chunk_size, n_workers=args.workers, n_jobs=args.jobs,
+            bg_size=args.bg_size, chunk_dir=args.chunk_dir, max_batch_rows=args.max_batch_rows,
+            use_cache=not args.no_cache,
+        )
+    path = write_artifact(final_df, OUTPUT_ARTIFACT)
+    print(f"Saved {path}")
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,10 @@
 # scripts/inspect_columns.py
-import pandas as pd
+import os
+import sys
 
-df = pd.read_csv("data/processed/voting_clean.csv")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from artifact_io import read_artifact
+
+df = read_artifact("voting_clean")
 print(df.columns.tolist())
@@ -0,0 +1,163 @@
+# src/memory_budget.py
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import MEMORY_BUDGET_MB
+
+# Share of the budget one row block may use; the rest covers whole-table
+# state that streaming cannot avoid (coordinates, the sparse neighbour
+# graph, a few float columns per row) and interpreter overhead.
+BLOCK_SHARE = 0.25
+MIN_BLOCK_ROWS = 256
+
+# Row count of the synthetic check: roughly the number of US census tracts
+TRACT_ROWS = 85_000
+
+
+def rows_per_block(bytes_per_row, budget_mb=MEMORY_BUDGET_MB, share=BLOCK_SHARE):
+    """
+    Rows per block such that one block of ``bytes_per_row`` fits in
+    ``share`` of the budget, or None (process everything at once) when
+    there is no budget.
+    """
+    if not budget_mb:
+        return None
+    return max(MIN_BLOCK_ROWS, int(budget_mb * 2**20 * share // max(1, bytes_per_row)))
+
+
+class PeakMemory:
+    """
+    Peak memory allocated inside the ``with`` block: Python and NumPy
+    allocations (tracemalloc) plus Arrow's memory pool, in MiB.
+    """
+
+    def __init__(self, label=""):
+        self.label = label
+        self.peak_mb = 0.0
+
+    def __enter__(self):
+        self._pool = pa.default_memory_pool()
+        self._arrow_base = self._pool.bytes_allocated()
+        self._arrow_max0 = self._pool.max_memory() or 0
+        tracemalloc.start()
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # max_memory is process-wide, so it only counts when it rose here
+        arrow_max = self._pool.max_memory() or 0
+        arrow_peak = max(0, arrow_max - self._arrow_base) if arrow_max > self._arrow_max0 else 0
+        self.peak_mb = (py_peak + arrow_peak) / 2**20
+        self.seconds = time.time() - self._t0
+        return False
+
+
+# ── Synthetic tract-scale check ──────────────────────────────────────────────
+
+def synthetic_tracts(n, seed=0):
+    """
+    A clean voting table and centroid table shaped like the county ones,
+    with ``n`` rows on a jittered grid and spatially smooth covariates.
+    """
+    from feature_engineering import LAG_FEATURES
+    rng  = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    grid = np.stack(np.divmod(np.arange(n), side), axis=1).astype(float)
+    xy   = (grid + rng.uniform(-0.3, 0.3, grid.shape)) * 5000.0
+    geoid = np.char.zfill(np.arange(n).astype(str), 11)
+
+    clean = pd.DataFrame({"county_id": geoid})
+    for j, var in enumerate(LAG_FEATURES):
+        clean[var] = np.sin(xy[:, 0] / (40000 + 3000 * j)) + rng.normal(0, 0.3, n)
+    clean["proj_x"], clean["proj_y"] = xy[:, 0], xy[:, 1]
+    clean["new_pct_dem"] = (0.5 + 0.1 * clean["pct_bach"] - 0.05 * clean["pct_black"]
+                            + rng.normal(0, 0.05, n))
+    geometry = pd.DataFrame({"GEOID": geoid, "centroid_x": xy[:, 0], "centroid_y": xy[:, 1]})
+    return clean, geometry
+
+
+def synthetic_model(df, features, rounds=50):
+    import xgboost as xgb
+    model = xgb.XGBRegressor(n_estimators=rounds, max_depth=6, n_jobs=1)
+    sample = df.sample(min(len(df), 20000), random_state=0)
+    model.fit(sample[features], sample["new_pct_dem"])
+    return model
+
+
+def check_budget(n=TRACT_ROWS, budget_mb=256, gwr_bandwidth=100):
+    """
+    Run the streaming feature, SHAP, fairness and GWR code paths on a
+    synthetic ``n``-row table under ``budget_mb`` and report each stage's
+    peak. Returns the list of (stage, peak MiB, seconds).
+    """
+    import feature_engineering, shap_explainer, spatial_fairness, mgwr_comparison
+    from artifact_io import write_artifact, read_artifact
+
+    clean, geometry = synthetic_tracts(n)
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        write_artifact(clean, "synthetic_clean", directory=tmp)
+        del clean
+
+        with PeakMemory("features") as peak:
+            feature_engineering.stream_features(budget_mb, geometry=geometry, source="synthetic_clean",
+                                                name="synthetic_features", directory=tmp)
+        report.append(("features", peak.peak_mb, peak.seconds))
+
+        sample = read_artifact("synthetic_features", columns=shap_explainer.FEATURE_LIST + ["new_pct_dem"],
+                               directory=tmp).iloc[:20000]
+        model = synthetic_model(sample, shap_explainer.FEATURE_LIST)
+        del sample
+
+        with PeakMemory("shap") as peak:
+            shap_explainer.stream_explanations(budget_mb, xgb_model=model, source="synthetic_features",
+                                               name="synthetic_shap", directory=tmp)
+        report.append(("shap", peak.peak_mb, peak.seconds))
+
+        with PeakMemory("fairness") as peak:
+            spatial_fairness.stream_fairness(budget_mb, xgb_model=model, source="synthetic_features",
+                                             name="synthetic_fairness", directory=tmp)
+        report.append(("fairness", peak.peak_mb, peak.seconds))
+
+        with PeakMemory("gwr") as peak:
+            mgwr_comparison.stream_gwr(budget_mb, bandwidth=gwr_bandwidth, geometry=geometry,
+                                       source="synthetic_features", name="synthetic_gwr", directory=tmp)
+        report.append(("gwr", peak.peak_mb, peak.seconds))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that streaming stages stay under a memory budget")
+    parser.add_argument("--rows", type=int, default=TRACT_ROWS)
+    parser.add_argument("--budget-mb", type=float, default=MEMORY_BUDGET_MB or 256)
+    parser.add_argument("--bandwidth", type=int, default=100, help="fixed GWR bandwidth")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = check_budget(args.rows, args.budget_mb, args.bandwidth)
+    print(f"{'stage':<10} {'peak MiB':>9} {'seconds':>8}   budget {args.budget_mb:g} MiB, {args.rows} rows")
+    for stage, peak_mb, seconds in report:
+        flag = "" if peak_mb <= args.budget_mb else "  OVER BUDGET"
+        print(f"{stage:<10} {peak_mb:>9.1f} {seconds:>8.1f}{flag}")
+    if any(peak_mb > args.budget_mb for _, peak_mb, _ in report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,13 @@
 
 import os
 import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+from scipy.spatial import cKDTree
 from sklearn.linear_model import LinearRegression
 
 # Make project root importable
@@ -11,62 +16,462 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from config import PROCESSED_DATA_PATH
+from config import FEATURES_ARTIFACT, PROCESSED_DIR, MEMORY_BUDGET_MB
+from artifact_io import read_artifact, write_artifact, iter_artifact, ArtifactWriter
+from geometry_cache import load_geometry
+from memory_budget import BLOCK_SHARE
 
-# Paths
-FEATURES_PATH = os.path.join(PROJECT_ROOT, "data", "processed", "voting_features.csv")
-SHAPE_PATH    = os.path.join(
-    PROJECT_ROOT, "data", "raw", "shapefiles", "cb_2018_us_county_500k.shp"
-)
-OUTPUT_PATH   = os.path.join(PROJECT_ROOT, "data", "processed", "mgwr_coefficients.csv")
+# Paths / artifacts
+OUTPUT_ARTIFACT    = "mgwr_coefficients"
+BANDWIDTH_ARTIFACT = "mgwr_bandwidths"
+
+# Covariates of the local models (location enters through the kernel)
+FEATURE_LIST = [
+    "total_pop", "sex_ratio", "pct_black", "pct_hisp", "pct_bach",
+    "median_income", "pct_65_over", "pct_age_18_29", "gini", "pct_manuf",
+    "ln_pop_den", "pct_3rd_party", "turn_out", "pct_fb", "pct_uninsured",
+]
+TARGET = "new_pct_dem"
+
+METHODS     = ("mgwr", "gwr", "ols")
+N_WORKERS   = max(1, multiprocessing.cpu_count() - 1)
+BLOCK_ELEMS = 1 << 21    # neighbour-rows x columns gathered per local-fit task
+NN_CACHE_MB = 128        # sorted neighbour lists kept per worker (every neighbour at county scale)
+MAX_ITER    = 50         # MGWR backfitting iterations
+TOL         = 1e-5       # MGWR convergence (change in the additive terms)
+BW_TOL      = 0.01       # backfitting searches stop at 1% of the bandwidth (AICc is flat there)
+BW_WINDOW   = 0.1        # later backfitting searches stay within ±10% of the last bandwidth
+BW_STABLE   = 3          # searches in a row within BW_TOL after which a bandwidth is kept fixed
+
+# Per-process state, filled by init_worker
+_STATE = {}
 
 
 def load_data():
-    # Load features
-    df = pd.read_csv(FEATURES_PATH, dtype={"fips": str, "GEOID": str})
-    # Load geometries for GEOID merge (centroids not needed for global OLS)
-    gdf = gpd.read_file(SHAPE_PATH).to_crs("EPSG:5070")
-    gdf["GEOID"] = gdf["GEOID"].str.zfill(5)
+    # Load features and the cached projected centroids (EPSG:5070)
+    df  = read_artifact(FEATURES_ARTIFACT, columns=["GEOID", TARGET] + FEATURE_LIST)
+    gdf = load_geometry("EPSG:5070", columns=["centroid_x", "centroid_y"])
     merged = gdf.merge(df, on="GEOID", how="inner")
     return merged
 
 
-def run_global_ols(merged, target="new_pct_dem"):
+def run_global_ols(merged, target=TARGET):
     """
-    Fit a global OLS regression using all numeric covariates,
+    Fit a global OLS regression on FEATURE_LIST,
     then assign the same global coefficients to every county.
+
+    Covariates and target are standardised as for GWR / MGWR, so the
+    coefficients share their scale in the dashboard.
     """
-    # Drop geometry
-    df = merged.drop(columns="geometry")
-    # Select numeric features
-    numeric = df.select_dtypes(include=["int64", "float64"])
-    y = numeric[target].values
-    X = numeric.drop(columns=[target]).values
-    feature_names = list(numeric.drop(columns=[target]).columns)
-
-    # Fit global linear model
-    lr = LinearRegression()
-    lr.fit(X, y)
-    coefs = lr.coef_
-    intercept = lr.intercept_
+    X, y = standardise(merged[FEATURE_LIST].to_numpy(dtype=float), merged[target].to_numpy(dtype=float))
 
-    # Build DataFrame with identical coefficients for each GEOID
-    rows = []
-    for geoid in merged["GEOID"]:
-        row = {"GEOID": geoid, "intercept": intercept}
-        row.update({f: coef for f, coef in zip(feature_names, coefs)})
-        rows.append(row)
+    # Fit global linear model (X already holds the intercept column)
+    lr = LinearRegression(fit_intercept=False)
+    lr.fit(X, y)
 
-    df_coeff = pd.DataFrame(rows)
+    # Same coefficients for each GEOID
+    df_coeff = pd.DataFrame(
+        np.tile(lr.coef_, (len(merged), 1)),
+        columns=["intercept"] + FEATURE_LIST,
+    )
+    df_coeff.insert(0, "GEOID", merged["GEOID"].to_numpy())
     return df_coeff
 
 
-def main():
+# ── Local fits (run in worker processes) ─────────────────────────────────────
+
+def cache_neighbours(n, cache_mb=NN_CACHE_MB):
+    """Neighbours per point that fit ``cache_mb`` (float32 distance + int32 index each)."""
+    return int(min(n, cache_mb * 2**20 // (8 * n)))
+
+
+def init_worker(coords, nn_cache_k, block_elems=BLOCK_ELEMS):
+    _STATE["coords"] = coords
+    _STATE["tree"]   = cKDTree(coords)
+    _STATE["nn"]     = None
+    _STATE["nn_k"]   = nn_cache_k
+    _STATE["block_elems"] = block_elems
+
+
+def nearest(rows, bw):
+    """
+    Distances and indices of the ``bw`` nearest neighbours of ``rows``.
+
+    Bandwidths up to the worker's cache size (every point at county
+    scale, see ``cache_neighbours``) are served from one sorted (n, k)
+    KD-tree query kept per worker, so the many AICc evaluations of the
+    bandwidth searches only slice it. Bandwidths that are a small
+    fraction of n (tract scale) get a KD-tree query per row block; the
+    rest select neighbours with ``argpartition`` over sub-blocks of at
+    most ``block_elems`` distances. The kernel does not need them sorted.
+    """
+    coords = _STATE["coords"]
+    k_max  = min(_STATE["nn_k"], len(coords))
+    if bw <= k_max:
+        if _STATE["nn"] is None:
+            dist, idx = _STATE["tree"].query(coords, k=k_max)
+            _STATE["nn"] = dist.astype(np.float32), idx.astype(np.int32)
+        dist, idx = _STATE["nn"]
+        return dist[rows, :bw], idx[rows, :bw]
+    if bw * 8 < len(coords):
+        return _STATE["tree"].query(coords[rows], k=bw)
+    dist = np.empty((len(rows), bw))
+    idx  = np.empty((len(rows), bw), dtype=np.intp)
+    step = max(1, _STATE["block_elems"] // len(coords))
+    for lo in range(0, len(rows), step):
+        sub = rows[lo:lo + step]
+        d = np.hypot(*(coords[sub, None, :] - coords[None, :, :]).transpose(2, 0, 1))
+        part = np.argpartition(d, bw - 1, axis=1)[:, :bw]
+        idx[lo:lo + step]  = part
+        dist[lo:lo + step] = np.take_along_axis(d, part, axis=1)
+    return dist, idx
+
+
+def bisquare_neighbours(rows, bw):
+    """Indices and adaptive bisquare weights of the ``bw`` nearest neighbours of ``rows``."""
+    dist, idx = nearest(rows, bw)
+    h = dist.max(axis=1, keepdims=True) * 1.0000001
+    return idx, (1 - (dist / h) ** 2) ** 2
+
+
+def local_fit(rows, bw, X, y, full=False):
+    """
+    Weighted least squares at each of ``rows`` over its ``bw`` nearest
+    neighbours only. Returns fitted values and hat-matrix diagonal, plus
+    coefficients and the diagonal of C C' (for standard errors) when
+    ``full``.
+    """
+    idx, w = bisquare_neighbours(rows, bw)
+    Xn   = X[idx]                                  # (b, bw, p)
+    XtW  = Xn * w[..., None]
+    XtWX = np.einsum("bkp,bkq->bpq", XtW, Xn)
+    XtWy = np.einsum("bkp,bk->bp", XtW, y[idx])
+    try:
+        inv = np.linalg.inv(XtWX)
+    except np.linalg.LinAlgError:
+        inv = np.linalg.pinv(XtWX)
+    beta = np.einsum("bpq,bq->bp", inv, XtWy)
+    xi   = X[rows]
+    yhat = np.einsum("bp,bp->b", xi, beta)
+    hat  = np.einsum("bp,bpq,bq->b", xi, inv, xi)  # self-weight is 1
+    if not full:
+        return yhat, hat
+    XtW2X = np.einsum("bkp,bkq->bpq", XtW * w[..., None], Xn)
+    cct   = np.einsum("bpq,bqr,brp->bp", inv, XtW2X, inv)
+    return yhat, hat, beta, cct
+
+
+def local_r2(rows, bw, y, yhat):
+    """Geographically weighted R² of the fitted values around each of ``rows``."""
+    idx, w = bisquare_neighbours(rows, bw)
+    yn   = y[idx]
+    ybar = (w * yn).sum(axis=1) / w.sum(axis=1)
+    tss  = (w * (yn - ybar[:, None]) ** 2).sum(axis=1)
+    rss  = (w * (yn - yhat[idx]) ** 2).sum(axis=1)
+    return 1 - rss / tss
+
+
+# ── Parent-side driver ───────────────────────────────────────────────────────
+
+class LocalRegression:
+    """
+    Adaptive bisquare GWR / MGWR over point coordinates.
+
+    Every local fit touches only its ``bw`` nearest neighbours (KD-tree
+    queries per row block), never a dense n x n weight matrix. Row
+    blocks are spread over a process pool, which serves every AICc
+    evaluation of the golden-section bandwidth search and the final fits.
+    """
+
+    def __init__(self, coords, n_workers=N_WORKERS, block_elems=BLOCK_ELEMS, nn_cache_k=None):
+        self.coords      = np.ascontiguousarray(coords, dtype=float)
+        self.n           = len(self.coords)
+        self.n_workers   = n_workers
+        self.block_elems = block_elems
+        self.nn_cache_k  = cache_neighbours(self.n) if nn_cache_k is None else nn_cache_k
+        self.pool        = None
+
+    def __enter__(self):
+        initargs = (self.coords, self.nn_cache_k, self.block_elems)
+        if self.n_workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.n_workers, initializer=init_worker,
+                                            initargs=initargs)
+        else:
+            init_worker(*initargs)
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def _blocks(self, bw, p):
+        size = max(1, self.block_elems // (bw * p))
+        return [np.arange(lo, min(lo + size, self.n)) for lo in range(0, self.n, size)]
+
+    def _map(self, fn, blocks, *args):
+        if self.pool is None:
+            return [fn(rows, *args) for rows in blocks]
+        return list(self.pool.map(fn, blocks, *[[a] * len(blocks) for a in args]))
+
+    def fit(self, X, y, bw, full=False):
+        parts = self._map(local_fit, self._blocks(bw, X.shape[1]), bw, X, y, full)
+        return [np.concatenate(col) for col in zip(*parts)]
+
+    def aicc(self, X, y, bw):
+        yhat, hat = self.fit(X, y, bw)
+        rss, tr_s = ((y - yhat) ** 2).sum(), hat.sum()
+        if tr_s >= self.n - 2:
+            return np.inf
+        sigma2 = rss / self.n
+        return self.n * np.log(2 * np.pi * sigma2) + self.n + 2 * self.n * (tr_s + 1) / (self.n - tr_s - 2)
+
+    def search(self, X, y, lo=None, hi=None, max_iter=200, rel_tol=0.0):
+        """
+        Golden-section search for the integer bandwidth minimising AICc,
+        to within one neighbour or ``rel_tol`` of the bandwidth.
+        """
+        lo = max(lo or 0, X.shape[1] + 2)
+        hi = min(hi or self.n, self.n)
+        scores = {}
+
+        def score(bw):
+            bw = int(round(bw))
+            if bw not in scores:
+                scores[bw] = self.aicc(X, y, bw)
+            return scores[bw]
+
+        delta = 0.38197
+        a, c = lo, hi
+        b, d = a + delta * (c - a), c - delta * (c - a)
+        fb, fd = score(b), score(d)
+        for _ in range(max_iter):
+            if abs(round(b) - round(d)) <= max(1, rel_tol * b):
+                break
+            if fb <= fd:
+                c, d, fd = d, b, fb
+                b = a + delta * (c - a)
+                fb = score(b)
+            else:
+                a, b, fb = b, d, fd
+                d = c - delta * (c - a)
+                fd = score(d)
+        return min(scores, key=scores.get)
+
+    def results(self, X, y, bw, yhat=None, r2_bw=None):
+        """Coefficients, standard errors and local R² of a GWR fit at bandwidth ``bw``."""
+        fitted, hat, beta, cct = self.fit(X, y, bw, full=True)
+        yhat = fitted if yhat is None else yhat
+        sigma2 = ((y - fitted) ** 2).sum() / (self.n - hat.sum())
+        r2 = np.concatenate(self._map(local_r2, self._blocks(r2_bw or bw, 1), r2_bw or bw, y, yhat))
+        return beta, np.sqrt(sigma2 * cct), r2
+
+    def iter_results(self, X, y, bw):
+        """
+        ``results`` block by block: yields (rows, beta, se, local R²) so
+        each block can be written out before the next is fitted. The
+        global sigma² comes from a first, fitted-values-only pass.
+        """
+        fitted, hat = self.fit(X, y, bw)
+        sigma2 = ((y - fitted) ** 2).sum() / (self.n - hat.sum())
+        blocks = self._blocks(bw, X.shape[1])
+        step = max(1, self.n_workers)
+        for i in range(0, len(blocks), step):
+            group = blocks[i:i + step]
+            fits  = self._map(local_fit, group, bw, X, y, True)
+            r2s   = self._map(local_r2, group, bw, y, fitted)
+            for rows, (_, _, beta, cct), r2 in zip(group, fits, r2s):
+                yield rows, beta, np.sqrt(sigma2 * cct), r2
+
+    def gwr(self, X, y):
+        bw = self.search(X, y)
+        beta, se, r2 = self.results(X, y, bw)
+        return beta, se, r2, [bw] * X.shape[1]
+
+    def search_near(self, X, y, bw, window=BW_WINDOW, rel_tol=BW_TOL):
+        """
+        ``search`` within ``window`` of a previous bandwidth ``bw``, falling
+        back to the full range when the optimum lands on the window's edge.
+        """
+        lo = max(int(bw / (1 + window)), X.shape[1] + 2)
+        hi = min(int(np.ceil(bw * (1 + window))), self.n)
+        best = self.search(X, y, lo, hi, rel_tol=rel_tol)
+        margin = max(1, rel_tol * best)
+        edge = (best <= lo + margin and lo > X.shape[1] + 2) or (best >= hi - margin and hi < self.n)
+        return self.search(X, y, rel_tol=rel_tol) if edge else best
+
+    def mgwr(self, X, y, max_iter=MAX_ITER, tol=TOL, stable=BW_STABLE, rel_tol=BW_TOL):
+        """
+        MGWR by backfitting: starting from GWR, each covariate's surface
+        is refit to its partial residual with its own bandwidth until the
+        additive terms stop changing.
+
+        Bandwidths are searched to ``rel_tol``: over the full range in the
+        first pass, near the previous one afterwards (``search_near``). A
+        bandwidth that moved less than ``rel_tol`` in ``stable`` passes in
+        a row is kept without searching again.
+
+        Standard errors come from each covariate's final univariate fit
+        (conditional on the other terms), an approximation to MGWR's full
+        projection-matrix covariance that avoids n x n operators; local
+        R² uses the GWR starting bandwidth.
+        """
+        bw0 = self.search(X, y)
+        beta, _, _ = self.results(X, y, bw0)
+        terms = X * beta
+        bws = [bw0] * X.shape[1]
+        repeats = [0] * X.shape[1]
+        for it in range(max_iter):
+            t0 = time.time()
+            new_terms = terms.copy()
+            for j in range(X.shape[1]):
+                partial = y - new_terms.sum(axis=1) + new_terms[:, j]
+                Xj = X[:, [j]]
+                if it == 0:
+                    bws[j] = self.search(Xj, partial, rel_tol=rel_tol)
+                elif repeats[j] < stable:
+                    bw = self.search_near(Xj, partial, bws[j], rel_tol=rel_tol)
+                    if abs(bw - bws[j]) <= max(1, rel_tol * bws[j]):
+                        repeats[j] += 1
+                    else:
+                        bws[j], repeats[j] = bw, 0
+                new_terms[:, j] = self.fit(Xj, partial, bws[j])[0]
+            change = np.sqrt(((new_terms - terms) ** 2).sum() / (new_terms ** 2).sum())
+            terms = new_terms
+            print(f"  backfitting iteration {it + 1} ({time.time() - t0:.1f}s): change {change:.2e}, "
+                  f"bandwidths {bws}")
+            if change < tol:
+                break
+
+        yhat = terms.sum(axis=1)
+        se = np.empty_like(beta)
+        for j in range(X.shape[1]):
+            partial = y - yhat + terms[:, j]
+            b, s, _ = self.results(X[:, [j]], partial, bws[j])
+            beta[:, j], se[:, j] = b[:, 0], s[:, 0]
+        r2 = np.concatenate(self._map(local_r2, self._blocks(bw0, 1), bw0, y, yhat))
+        return beta, se, r2, bws
+
+
+def budget_limits(memory_budget_mb, n):
+    """
+    (block_elems, nn_cache_k) keeping one local-fit block (about four
+    float64 copies of block_elems) and the per-worker neighbour cache
+    (8 bytes per entry, 16 while it is queried) within BLOCK_SHARE of the
+    budget each.
+    """
+    if not memory_budget_mb:
+        return BLOCK_ELEMS, cache_neighbours(n)
+    share = memory_budget_mb * 2**20 * BLOCK_SHARE
+    return min(BLOCK_ELEMS, max(1 << 12, int(share // 32))), min(cache_neighbours(n), int(share // (16 * n)))
+
+
+def standardise(Xraw, yraw):
+    X = np.column_stack([np.ones(len(Xraw)), (Xraw - Xraw.mean(0)) / Xraw.std(0)])
+    y = (yraw - yraw.mean()) / yraw.std()
+    return X, y
+
+
+def run_local(merged, method="mgwr", n_workers=N_WORKERS, target=TARGET, memory_budget_mb=None):
+    """
+    GWR or MGWR on standardised covariates and target (so bandwidths and
+    coefficients are comparable across covariates). Returns per-county
+    coefficients, ``se_<term>`` standard errors and ``local_r2``, plus
+    the bandwidth chosen for each term.
+    """
+    X, y = standardise(merged[FEATURE_LIST].to_numpy(dtype=float), merged[target].to_numpy(dtype=float))
+    coords = merged[["centroid_x", "centroid_y"]].to_numpy()
+    terms  = ["intercept"] + FEATURE_LIST
+    block_elems, nn_cache_k = budget_limits(memory_budget_mb, len(merged))
+
+    t0 = time.time()
+    with LocalRegression(coords, n_workers=n_workers, block_elems=block_elems, nn_cache_k=nn_cache_k) as model:
+        beta, se, r2, bws = model.mgwr(X, y) if method == "mgwr" else model.gwr(X, y)
+    print(f"{method.upper()}: {len(merged)} counties in {time.time()-t0:.1f}s")
+
+    df_coeff = pd.DataFrame(beta, columns=terms)
+    df_coeff[[f"se_{t}" for t in terms]] = se
+    df_coeff["local_r2"] = r2
+    df_coeff.insert(0, "GEOID", merged["GEOID"].to_numpy())
+    bandwidths = pd.DataFrame({"method": method, "term": terms, "bandwidth": bws})
+    return df_coeff, bandwidths
+
+
+def stream_gwr(memory_budget_mb, bandwidth=None, geometry=None, n_workers=N_WORKERS,
+               source=FEATURES_ARTIFACT, name=OUTPUT_ARTIFACT, directory=PROCESSED_DIR):
+    """
+    GWR for tables too large to hold whole (e.g. tracts).
+
+    Features are read block by block into float arrays (no full frame),
+    neighbour searches and fits run on budget-sized row blocks, and each
+    block's coefficients, standard errors and local R² are appended to
+    the output as soon as they are fitted. ``bandwidth`` skips the AICc
+    search.
+    """
+    if geometry is None:
+        geometry = load_geometry("EPSG:5070", columns=["centroid_x", "centroid_y"], geometry=False)
+    geoids = pd.Index(geometry["GEOID"])
+    xy = geometry[["centroid_x", "centroid_y"]].to_numpy()
+
+    keys, Xs, ys, coords = [], [], [], []
+    for block in iter_artifact(source, columns=["GEOID", TARGET] + FEATURE_LIST, batch_rows=1 << 16,
+                               directory=directory):
+        pos  = geoids.get_indexer(block["GEOID"])
+        keep = pos >= 0
+        keys.append(block["GEOID"].to_numpy()[keep])
+        Xs.append(block.loc[keep, FEATURE_LIST].to_numpy(dtype=float))
+        ys.append(block.loc[keep, TARGET].to_numpy(dtype=float))
+        coords.append(xy[pos[keep]])
+    keys = np.concatenate(keys)
+    X, y = standardise(np.concatenate(Xs), np.concatenate(ys))
+    del Xs, ys
+    terms = ["intercept"] + FEATURE_LIST
+    block_elems, nn_cache_k = budget_limits(memory_budget_mb, len(keys))
+
+    t0 = time.time()
+    with LocalRegression(np.concatenate(coords), n_workers=n_workers, block_elems=block_elems,
+                         nn_cache_k=nn_cache_k) as model:
+        bw = bandwidth or model.search(X, y)
+        with ArtifactWriter(name, directory=directory) as writer:
+            for rows, beta, se, r2 in model.iter_results(X, y, bw):
+                out = pd.DataFrame(beta, columns=terms)
+                out[[f"se_{t}" for t in terms]] = se
+                out["local_r2"] = r2
+                out.insert(0, "GEOID", keys[rows])
+                writer.write(out)
+    print(f"GWR: {len(keys)} rows in {time.time()-t0:.1f}s, bandwidth {bw}; saved to {writer.path}")
+    return pd.DataFrame({"method": "gwr", "term": terms, "bandwidth": [bw] * len(terms)})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local regression baseline (MGWR / GWR / OLS)")
+    parser.add_argument("--method", choices=METHODS, default="mgwr")
+    parser.add_argument("--workers", type=int, default=N_WORKERS,
+                        help="processes sharing each bandwidth evaluation")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="size neighbour caches and fit blocks to this budget; GWR then "
+                             "streams its output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.memory_budget and args.method == "gwr":
+        bandwidths = stream_gwr(args.memory_budget, n_workers=args.workers)
+        print(bandwidths.to_string(index=False))
+        write_artifact(bandwidths, BANDWIDTH_ARTIFACT)
+        return
     merged = load_data()
-    df_coeff = run_global_ols(merged)
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    df_coeff.to_csv(OUTPUT_PATH, index=False)
-    print(f"Global OLS coefficients saved to {OUTPUT_PATH}")
+    if args.method == "ols":
+        df_coeff = run_global_ols(merged)
+        label = "Global OLS coefficients"
+    else:
+        df_coeff, bandwidths = run_local(merged, args.method, n_workers=args.workers,
+                                         memory_budget_mb=args.memory_budget)
+        print(bandwidths.to_string(index=False))
+        write_artifact(bandwidths, BANDWIDTH_ARTIFACT)
+        label = f"{args.method.upper()} coefficients"
+    path = write_artifact(df_coeff, OUTPUT_ARTIFACT)
+    print(f"{label} saved to {path}")
 
 if __name__ == "__main__":
     main()
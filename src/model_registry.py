@@ -0,0 +1,207 @@
+# src/model_registry.py
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import xgboost as xgb
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import CLEAN_MODEL_PATH, CLEAN_BOOSTER_PATH
+
+# The exact features (and order) the clean model is trained on
+FEATURE_LIST = [
+    "proj_x", "proj_y", "total_pop", "sex_ratio",
+    "pct_black", "pct_hisp", "pct_bach", "median_income",
+    "pct_65_over", "pct_age_18_29", "gini", "pct_manuf",
+    "ln_pop_den", "pct_3rd_party", "turn_out", "pct_fb",
+    "pct_uninsured"
+]
+TARGET = "new_pct_dem"
+
+# Loaded models, keyed by path and guarded by one lock
+_CACHE = {}
+_LOCK  = threading.Lock()
+
+
+def manifest_path(booster_path):
+    """``model.ubj`` -> ``model.manifest.json``."""
+    return os.path.splitext(booster_path)[0] + ".manifest.json"
+
+
+def feature_hash(features):
+    """Hash of the feature names in order, so any reordering changes it."""
+    return hashlib.sha256(json.dumps(list(features)).encode()).hexdigest()[:16]
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def unwrap(model):
+    """The XGBRegressor inside a FLAML AutoML (or its estimator wrapper); anything else as is."""
+    wrapped = getattr(model, "model", model)
+    for attr in ("model", "estimator"):
+        if isinstance(getattr(wrapped, attr, None), xgb.XGBModel):
+            return getattr(wrapped, attr)
+    return wrapped
+
+
+def check_features(features, expected=FEATURE_LIST, what="feature list"):
+    """ValueError unless ``features`` is exactly ``expected``, in the same order."""
+    if list(features) != list(expected):
+        missing = [f for f in expected if f not in features]
+        extra   = [f for f in features if f not in expected]
+        detail  = f"missing {missing}, extra {extra}" if missing or extra else "same names, different order"
+        raise ValueError(f"{what} differs from the expected features ({detail})")
+
+
+def export_model(model, path=CLEAN_BOOSTER_PATH, features=FEATURE_LIST, source=None, metrics=None):
+    """
+    Save the booster of ``model`` (AutoML, XGBRegressor or Booster) in
+    XGBoost's own format (UBJ, or JSON for a ``.json`` path) plus a
+    manifest with the feature list, its hash, the booster's content hash
+    and the tuned hyper-parameters (plus any training ``metrics``, e.g.
+    the validation R² the next tuning run aims for). Both files are
+    written atomically.
+    Returns the manifest.
+    """
+    model   = unwrap(model)
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    if booster.feature_names:
+        check_features(booster.feature_names, features, "Booster feature names")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ext = os.path.splitext(path)[1]
+    tmp = path + ".tmp" + ext                      # XGBoost picks the format from the extension
+    booster.save_model(tmp)
+    os.replace(tmp, path)
+
+    params = model.get_params() if hasattr(model, "get_params") else {}
+    manifest = {
+        "booster": os.path.basename(path),
+        "format": "json" if ext == ".json" else "ubj",
+        "sha256": file_sha256(path),
+        "features": list(features),
+        "feature_hash": feature_hash(features),
+        "target": TARGET,
+        "n_trees": booster.num_boosted_rounds(),
+        "xgboost_version": xgb.__version__,
+        "params": {k: v for k, v in params.items() if isinstance(v, (int, float, str, bool)) or v is None},
+        "source": os.path.basename(source) if source else None,
+        "metrics": metrics or {},
+        "exported": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    tmp = manifest_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path(path))
+    return manifest
+
+
+def read_manifest(path=CLEAN_BOOSTER_PATH):
+    with open(manifest_path(path)) as f:
+        return json.load(f)
+
+
+def ensure_exported(path=CLEAN_BOOSTER_PATH, pickle_path=CLEAN_MODEL_PATH):
+    """
+    Export the native booster from the AutoML pickle when it is missing
+    or older than the pickle (models trained before the registry existed).
+    """
+    if os.path.exists(path) and os.path.exists(manifest_path(path)) and (
+            not os.path.exists(pickle_path) or os.path.getmtime(path) >= os.path.getmtime(pickle_path)):
+        return
+    if not os.path.exists(pickle_path):
+        raise FileNotFoundError(f"Neither {path} nor {pickle_path} exists; run train_clean_model.py first")
+    import joblib
+    print(f"[registry] exporting native booster from {os.path.basename(pickle_path)}")
+    export_model(joblib.load(pickle_path), path, source=pickle_path)
+
+
+def _load(path, features):
+    """Read and verify one native booster; returns (XGBRegressor, manifest)."""
+    manifest = read_manifest(path)
+    if file_sha256(path) != manifest["sha256"]:
+        raise ValueError(f"{path} does not match its manifest (re-run the export)")
+    check_features(manifest["features"], features, f"Manifest of {os.path.basename(path)}")
+    model = xgb.XGBRegressor()
+    model.load_model(path)
+    booster = model.get_booster()
+    if booster.feature_names is None:
+        booster.feature_names = manifest["features"]
+    return model, manifest
+
+
+def load_model(path=CLEAN_BOOSTER_PATH, features=FEATURE_LIST):
+    """
+    The clean model as an XGBRegressor, loaded from the native booster
+    once per process and shared by every caller and thread. XGBoost's
+    prediction calls are thread-safe; treat the object as read-only
+    (``set_param`` on a ``get_booster().copy()``).
+
+    The file is re-read when it changes on disk; its manifest must list
+    exactly ``features``. A ``.pkl`` path loads and unwraps a pickled
+    AutoML model instead (e.g. bootstrap refits passed to fairness).
+    """
+    if path.endswith(".pkl"):
+        import joblib
+        return unwrap(joblib.load(path))
+    if path == CLEAN_BOOSTER_PATH:
+        ensure_exported(path)
+    stamp = os.stat(path)
+    stamp = (stamp.st_mtime_ns, stamp.st_size)
+    with _LOCK:
+        cached = _CACHE.get(path)
+        if cached is None or cached[0] != stamp:
+            model, manifest = _load(path, features)
+            _CACHE[path] = cached = (stamp, model, manifest)
+        elif cached[2]["features"] != list(features):
+            check_features(cached[2]["features"], features, f"Manifest of {os.path.basename(path)}")
+    return cached[1]
+
+
+def load_booster(path=CLEAN_BOOSTER_PATH, features=FEATURE_LIST):
+    """The shared Booster of ``load_model``."""
+    return load_model(path, features).get_booster()
+
+
+def model_params(path=CLEAN_BOOSTER_PATH):
+    """Tuned XGBRegressor hyper-parameters recorded at export."""
+    if path == CLEAN_BOOSTER_PATH:
+        ensure_exported(path)
+    return dict(read_manifest(path)["params"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export / inspect the native clean-model booster")
+    parser.add_argument("--pickle", default=CLEAN_MODEL_PATH, help="AutoML pickle to export from")
+    parser.add_argument("--out", default=CLEAN_BOOSTER_PATH, help="booster path (.ubj or .json)")
+    parser.add_argument("--check", action="store_true", help="only verify the existing export")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.check:
+        import joblib
+        export_model(joblib.load(args.pickle), args.out, source=args.pickle)
+    t0 = time.time()
+    load_model(args.out)
+    manifest = read_manifest(args.out)
+    print(f"[registry] {args.out}: {manifest['n_trees']} trees, {len(manifest['features'])} features "
+          f"(hash {manifest['feature_hash']}), loaded in {time.time()-t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
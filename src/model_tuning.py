@@ -0,0 +1,229 @@
+# src/model_tuning.py
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from sklearn.model_selection import train_test_split
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import CLEAN_BOOSTER_PATH
+
+# Paths / artifacts
+REPORT_ARTIFACT   = "tuning_report"
+BASELINE_ARTIFACT = "tuning_baseline"   # FLAML-from-scratch history of the last --benchmark run
+
+# Search settings
+TIME_BUDGET  = 300                                   # seconds, as the FLAML run it replaces
+N_JOBS       = os.cpu_count() or 1                   # cores shared by all concurrent trials
+N_CONCURRENT = max(1, N_JOBS // 2)                   # trials trained side by side
+MAX_ROUNDS   = 4000                                  # boosting rounds cap; early stopping picks the count
+EARLY_STOP   = 50                                    # rounds without validation improvement
+MAX_BIN      = 256                                   # histogram bins of the quantised matrix
+VALID_SIZE   = 0.2
+SEED         = 42
+TARGET_TOL   = 0.002                                 # R² short of the previous model that counts as "reached"
+
+# Fixed booster settings (those of FLAML's xgboost learner)
+BASE_PARAMS = {"objective": "reg:squarederror", "tree_method": "hist", "grow_policy": "lossguide",
+               "max_depth": 0, "max_bin": MAX_BIN, "verbosity": 0}
+
+# Starting point when there is no previous model: FLAML's low-cost initial config
+DEFAULT_CONFIG = {"max_leaves": 4, "min_child_weight": 1.0, "learning_rate": 0.1, "subsample": 1.0,
+                  "colsample_bylevel": 1.0, "colsample_bytree": 1.0, "reg_alpha": 1 / 1024,
+                  "reg_lambda": 1.0}
+
+
+def search_space(n_rows):
+    """FLAML's xgboost search space, minus n_estimators (set by early stopping)."""
+    from flaml import tune
+    return {
+        "max_leaves":        tune.lograndint(4, max(5, min(32768, n_rows))),
+        "min_child_weight":  tune.loguniform(0.001, 128),
+        "learning_rate":     tune.loguniform(1 / 1024, 1.0),
+        "subsample":         tune.uniform(0.1, 1.0),
+        "colsample_bylevel": tune.uniform(0.01, 1.0),
+        "colsample_bytree":  tune.uniform(0.01, 1.0),
+        "reg_alpha":         tune.loguniform(1 / 1024, 1024),
+        "reg_lambda":        tune.loguniform(1 / 1024, 1024),
+    }
+
+
+def warm_config(path=CLEAN_BOOSTER_PATH):
+    """
+    The previous clean model's tuned configuration (from its registry
+    manifest), clipped into the search space, or None when there is none.
+    """
+    from model_registry import read_manifest
+    try:
+        params = read_manifest(path)["params"]
+    except (FileNotFoundError, KeyError):
+        return None
+    config = {k: params[k] for k in DEFAULT_CONFIG if params.get(k) is not None}
+    if not config:
+        return None
+    config = {**DEFAULT_CONFIG, **config}
+    config["max_leaves"] = max(4, int(config["max_leaves"]))
+    return config
+
+
+def holdout_split(X, y, valid_size=VALID_SIZE, seed=SEED):
+    """The validation split every tuner scores on: (X_train, X_valid, y_train, y_valid)."""
+    return train_test_split(X, y, test_size=valid_size, random_state=seed)
+
+
+def split_id(X_valid, y_valid):
+    """Content hash of a validation split; R² values are comparable only when it matches."""
+    h = hashlib.sha256(np.ascontiguousarray(np.asarray(X_valid, dtype=float)).tobytes())
+    h.update(np.ascontiguousarray(np.asarray(y_valid, dtype=float)).tobytes())
+    return h.hexdigest()[:16]
+
+
+class TrainingData:
+    """
+    One holdout split, quantised once: the training rows become a
+    ``QuantileDMatrix`` (histogram bins computed a single time) and the
+    validation rows reuse its bin edges. Every trial, in every thread,
+    trains on these same two matrices. ``split_id`` hashes the
+    validation rows.
+    """
+
+    def __init__(self, X, y, valid_size=VALID_SIZE, seed=SEED, max_bin=MAX_BIN, n_jobs=N_JOBS):
+        self.X, self.y = X, y
+        X_tr, X_va, y_tr, y_va = holdout_split(X, y, valid_size, seed)
+        self.X_valid, self.y_valid = X_va, np.asarray(y_va, dtype=float)
+        self.split_id = split_id(X_va, y_va)
+        t0 = time.time()
+        self.dtrain = xgb.QuantileDMatrix(X_tr, y_tr, max_bin=max_bin, nthread=n_jobs)
+        self.dvalid = xgb.QuantileDMatrix(X_va, y_va, ref=self.dtrain, nthread=n_jobs)
+        self.build_seconds = time.time() - t0
+        self._ss_tot = float(((self.y_valid - self.y_valid.mean()) ** 2).sum())
+
+    def r2(self, pred):
+        return 1 - float(((self.y_valid - pred) ** 2).sum()) / self._ss_tot
+
+
+def run_trial(data, config, nthread=1, max_rounds=MAX_ROUNDS, early_stop=EARLY_STOP, seed=SEED):
+    """Train one configuration with early stopping; returns (validation R², rounds used)."""
+    params = {**BASE_PARAMS, **config, "max_leaves": int(config["max_leaves"]), "nthread": nthread,
+              "seed": seed}
+    booster = xgb.train(params, data.dtrain, num_boost_round=max_rounds, evals=[(data.dvalid, "valid")],
+                        early_stopping_rounds=early_stop, verbose_eval=False)
+    rounds = booster.best_iteration + 1
+    pred = booster.predict(data.dvalid, iteration_range=(0, rounds))
+    return data.r2(pred), rounds
+
+
+def tune(data, time_budget=TIME_BUDGET, n_jobs=N_JOBS, n_concurrent=N_CONCURRENT, start=None,
+         target=None, stop_at_target=False, seed=SEED):
+    """
+    FLAML's CFO local search over ``search_space``, starting from
+    ``start`` (the previous best config) and asking for ``n_concurrent``
+    trials at a time, each trained with ``n_jobs // n_concurrent``
+    threads. Runs until ``time_budget`` seconds have passed (or, with
+    ``stop_at_target``, until ``target`` R² is reached). Returns (best
+    config, its rounds, per-trial history DataFrame).
+    """
+    from flaml import CFO
+    start = start or DEFAULT_CONFIG
+    searcher = CFO(space=search_space(len(data.y)), metric="r2", mode="max",
+                   points_to_evaluate=[dict(start)], low_cost_partial_config={"max_leaves": 4}, seed=seed)
+    nthread = max(1, n_jobs // n_concurrent)
+    history, running, best = [], {}, (-np.inf, None, None)
+    t0, trial = time.time(), 0
+
+    with ThreadPoolExecutor(max_workers=n_concurrent) as pool:
+        while True:
+            out_of_time = time.time() - t0 >= time_budget
+            reached = stop_at_target and target is not None and best[0] >= target
+            while not (out_of_time or reached) and len(running) < n_concurrent:
+                config = searcher.suggest(str(trial))   # the searcher only runs on this thread
+                if config is None:   # CFO waits for a result before proposing more
+                    break
+                running[pool.submit(run_trial, data, config, nthread)] = (str(trial), config)
+                trial += 1
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial_id, config = running.pop(future)
+                r2, rounds = future.result()
+                searcher.on_trial_complete(trial_id, {"r2": r2, "config": config})
+                if r2 > best[0]:
+                    best = (r2, config, rounds)
+                history.append({"trial": int(trial_id), "elapsed_s": time.time() - t0, "r2": r2,
+                                "best_r2": best[0], "rounds": rounds,
+                                "config": json.dumps({k: float(v) for k, v in config.items()})})
+    return best[1], best[2], pd.DataFrame(history)
+
+
+def flaml_baseline(data, time_budget=TIME_BUDGET, n_jobs=N_JOBS, seed=SEED):
+    """
+    The current behaviour for comparison: FLAML from scratch, one trial
+    at a time, scored on the same holdout. Returns its per-trial history.
+    """
+    from flaml import AutoML
+    from flaml.automl.data import get_output_from_log
+    n_valid = len(data.y_valid)
+    X_train = data.X.drop(data.X_valid.index)
+    y_train = data.y.drop(data.X_valid.index)
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, "flaml.log")
+        automl = AutoML()
+        automl.fit(X_train=X_train, y_train=y_train, X_val=data.X_valid, y_val=data.y_valid,
+                   task="regression", metric="r2", estimator_list=["xgboost"], time_budget=time_budget,
+                   n_jobs=n_jobs, seed=seed, log_file_name=log, verbose=0)
+        times, best_loss, loss, _, _ = get_output_from_log(log, time_budget)
+    print(f"[tune] FLAML baseline: {len(times)} trials, {len(X_train)} train / {n_valid} validation rows")
+    return pd.DataFrame({"trial": range(len(times)), "elapsed_s": times, "r2": 1 - np.asarray(loss),
+                         "best_r2": 1 - np.asarray(best_loss)})
+
+
+def time_to_target(history, target):
+    """Seconds until the run's best R² first reached ``target`` (None if it never did)."""
+    hit = history.loc[history["best_r2"] >= target, "elapsed_s"]
+    return float(hit.iloc[0]) if len(hit) else None
+
+
+def fit_final(X, y, config, rounds, n_jobs=N_JOBS, seed=SEED):
+    """Refit the chosen configuration on all rows as an XGBRegressor (what the registry exports)."""
+    params = {k: v for k, v in BASE_PARAMS.items() if k not in ("objective", "verbosity")}
+    model = xgb.XGBRegressor(**params, **{k: float(v) for k, v in config.items()},
+                             n_estimators=rounds, n_jobs=n_jobs, random_state=seed)
+    model.set_params(max_leaves=int(config["max_leaves"]))
+    model.fit(X, y)
+    return model
+
+
+def run_metrics(history, target):
+    """What the registry manifest records about a tuning run, for the next run to compare against."""
+    return {"trials": len(history), "target_r2": float(target), "time_to_target_s": time_to_target(history, target),
+            "wall_s": float(history["elapsed_s"].max())}
+
+
+def summarise(runs, target, previous=None):
+    """
+    One line per run: trials, best R², time to ``target``. ``previous``
+    (the manifest metrics of the model being replaced) adds that run's
+    recorded line; its time is to its own target.
+    """
+    rows = []
+    for name, history in runs.items():
+        rows.append({"run": name, "trials": len(history), "best_r2": history["best_r2"].max(),
+                     "target_r2": target, "time_to_target_s": time_to_target(history, target),
+                     "wall_s": history["elapsed_s"].max()})
+    if previous and previous.get("time_to_target_s") is not None:
+        rows.append({"run": f"previous ({previous.get('tuner', '?')})", "trials": previous.get("trials"),
+                     "best_r2": previous.get("valid_r2"), "target_r2": previous.get("target_r2"),
+                     "time_to_target_s": previous["time_to_target_s"], "wall_s": previous.get("wall_s")})
+    return pd.DataFrame(rows)
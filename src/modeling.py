@@ -12,28 +12,26 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from config import PROCESSED_DATA_PATH
+from config import FEATURES_ARTIFACT
+from artifact_io import read_artifact
+from model_registry import FEATURE_LIST
 
 # FLAML AutoML
 from flaml import AutoML
-
-# Path to features CSV
-FEATURES_PATH = os.path.join(
-    PROJECT_ROOT, "data", "processed", "voting_features.csv"
-)
 # Where to dump the trained model
 MODEL_OUTPUT_PATH = os.path.join(
     PROJECT_ROOT, "data", "processed", "xgb_automl_model.pkl"
 )
 
-def load_features(path: str = FEATURES_PATH) -> pd.DataFrame:
-    """Load the feature set (no geometry)."""
-    return pd.read_csv(path)
+def load_features(name: str = FEATURES_ARTIFACT, target: str = "new_pct_dem") -> pd.DataFrame:
+    """Load the model features and the target (no geometry, no spatial lags)."""
+    return read_artifact(name, columns=FEATURE_LIST + [target])
 
 def train_model(df: pd.DataFrame, target: str = "new_pct_dem"):
     """Train an XGBoost model via FLAML AutoML."""
-    # Separate X and y
-    X = df.drop(columns=[target, "fips", "GEOID"])
+    # Separate X and y: exactly the registry's features, in order, so new
+    # columns in the feature table (e.g. spatial lags) never leak in
+    X = df[FEATURE_LIST]
     y = df[target]
 
     # Train/test split
@@ -0,0 +1,145 @@
+# src/online_stats.py
+
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Welford running mean / variance, elementwise over an array of cells.
+
+    Memory is two float64 arrays of ``shape`` no matter how many
+    observations are pushed.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean  = np.zeros(shape)
+        self.m2    = np.zeros(shape)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def var(self):
+        # Population variance (ddof=0), matching np.std defaults
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class P2Quantile:
+    """
+    Streaming quantile sketch (Jain & Chlamtac P² algorithm), vectorised
+    over an array of cells.
+
+    Each cell keeps five markers, so memory is fixed at ``10 * prod(shape)``
+    floats. Until five observations have arrived the exact quantile of the
+    buffered values is returned.
+    """
+
+    def __init__(self, p, shape):
+        self.p       = p
+        self.count   = 0
+        self.q       = np.zeros((5,) + tuple(shape))
+        self.n       = np.broadcast_to(
+            np.arange(5.0).reshape((5,) + (1,) * len(shape)), self.q.shape
+        ).copy()
+        self.desired = np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4])
+        self.dn      = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        if self.count < 5:
+            self.q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.q.sort(axis=0)
+            return
+        self.count += 1
+        q, n = self.q, self.n
+
+        # Extend the extremes and find the cell each observation falls in
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        for j in range(1, 5):
+            n[j] += k < j
+        self.desired += self.dn
+
+        # Nudge the three middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            up   = (d >= 1) & (n[i + 1] - n[i] > 1)
+            down = (d <= -1) & (n[i - 1] - n[i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            s = np.where(up, 1.0, -1.0)
+            parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+            )
+            q_nb = np.where(up, q[i + 1], q[i - 1])
+            n_nb = np.where(up, n[i + 1], n[i - 1])
+            linear = q[i] + s * (q_nb - q[i]) / (n_nb - n[i])
+            ok = (q[i - 1] < parabolic) & (parabolic < q[i + 1])
+            q[i] = np.where(move, np.where(ok, parabolic, linear), q[i])
+            n[i] = np.where(move, n[i] + s, n[i])
+
+    @property
+    def value(self):
+        if self.count == 0:
+            return np.full(self.q.shape[1:], np.nan)
+        if self.count < 5:
+            return np.quantile(self.q[:self.count], self.p, axis=0)
+        return self.q[2].copy()
+
+
+class QuantileSummary:
+    """
+    Mergeable quantile summary for batches of observations per column.
+
+    Each column is summarised by ``size`` weighted points; a new batch is
+    reduced to the same grid and merged by weighted interpolation, so
+    memory stays at ``size * n_columns`` however many batches arrive.
+    Suited to pooling whole arrays at once, where feeding P² one row at a
+    time would be slow and order-sensitive.
+    """
+
+    def __init__(self, n_columns, size=1001):
+        self.n_columns = n_columns
+        self.size      = size
+        self.probs     = (np.arange(size) + 0.5) / size
+        self.points    = None
+        self.weight    = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1, self.n_columns)
+        batch = np.quantile(values, self.probs, axis=0)
+        if self.points is None:
+            self.points, self.weight = batch, float(len(values))
+            return
+        w_old = np.full(self.size, self.weight / self.size)
+        w_new = np.full(self.size, len(values) / self.size)
+        self.weight += len(values)
+        merged = np.empty_like(self.points)
+        for j in range(self.n_columns):
+            pts = np.concatenate([self.points[:, j], batch[:, j]])
+            wts = np.concatenate([w_old, w_new])
+            order = np.argsort(pts, kind="stable")
+            cum = (np.cumsum(wts[order]) - wts[order] / 2) / self.weight
+            merged[:, j] = np.interp(self.probs, cum, pts[order])
+        self.points = merged
+
+    def quantile(self, p):
+        if self.points is None:
+            return np.full(self.n_columns, np.nan)
+        return np.array([
+            np.interp(p, self.probs, self.points[:, j]) for j in range(self.n_columns)
+        ])
@@ -0,0 +1,378 @@
+# src/pipeline.py
+
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import ast
+import hashlib
+import argparse
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import (RAW_DATA_PATH, PROCESSED_DIR, SHAPEFILE_PATH,
+                    CLEAN_MODEL_PATH, CLEAN_BOOSTER_PATH, CLEAN_MANIFEST_PATH,
+                    CLEAN_ARTIFACT, FEATURES_ARTIFACT, MEMORY_BUDGET_MB)
+from artifact_io import find_artifact
+
+SRC_DIR    = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(PROCESSED_DIR, "pipeline_state.json")
+LOG_DIR    = os.path.join(PROCESSED_DIR, "pipeline_logs")
+
+# Stages run side by side once their dependencies are done
+MAX_PARALLEL = 4
+
+# Stages that accept --memory-budget (see memory_budget.py)
+BUDGETED_STAGES = ("feature_engineering", "shap", "fairness", "mgwr")
+
+# Every shapefile component (.shp, .shx, .dbf, .prj, ...) is an input
+SHAPEFILE_PARTS = os.path.splitext(SHAPEFILE_PATH)[0] + ".*"
+
+# Multi-year raw files and the year-partitioned panel built from them (temporal_loader.py)
+RAW_YEAR_FILES = [os.path.join(PROJECT_ROOT, "data", "raw", f"{kind}_*.csv") for kind in ("voting", "acs")]
+PANEL_FILES    = os.path.join(PROCESSED_DIR, "voting_panel", "year=*", "part.parquet")
+
+# The DAG. ``inputs`` / ``outputs`` are artifact names in data/processed,
+# absolute paths, or glob patterns. The stage's code is its script plus
+# every src module it imports, directly or not (see ``code_closure``).
+STAGES = {
+    "data_loader": {
+        "script": "data_loader.py", "deps": [],
+        "inputs": [RAW_DATA_PATH], "outputs": [CLEAN_ARTIFACT],
+    },
+    "map_geometry": {
+        "script": "geometry_cache.py", "deps": [],
+        "inputs": [SHAPEFILE_PARTS],
+        "outputs": [os.path.join(PROCESSED_DIR, "geometry", "counties_simplified_*.parquet")],
+    },
+    "feature_engineering": {
+        "script": "feature_engineering.py", "deps": ["data_loader"],
+        "inputs": [CLEAN_ARTIFACT, SHAPEFILE_PARTS], "outputs": [FEATURES_ARTIFACT],
+    },
+    "train_clean_model": {
+        "script": "train_clean_model.py", "deps": ["feature_engineering"],
+        "inputs": [FEATURES_ARTIFACT], "outputs": [CLEAN_MODEL_PATH, CLEAN_BOOSTER_PATH, CLEAN_MANIFEST_PATH],
+    },
+    "shap": {
+        "script": "shap_explainer.py", "deps": ["train_clean_model"],
+        "inputs": [FEATURES_ARTIFACT, CLEAN_BOOSTER_PATH], "outputs": ["shap_explanations"],
+    },
+    "geoshapley": {
+        "script": "geoshapley_explainer.py", "deps": ["train_clean_model"],
+        "inputs": [FEATURES_ARTIFACT, CLEAN_BOOSTER_PATH], "outputs": ["geoshapley_explanations"],
+    },
+    "fairness": {
+        "script": "spatial_fairness.py", "deps": ["train_clean_model"],
+        "inputs": [FEATURES_ARTIFACT, CLEAN_BOOSTER_PATH], "outputs": ["fairness_metrics"],
+    },
+    "spatial_cv": {
+        "script": "spatial_cv.py", "deps": ["train_clean_model"],
+        "inputs": [FEATURES_ARTIFACT, CLEAN_MANIFEST_PATH],
+        "outputs": ["spatial_cv_residuals", "spatial_cv_folds", "spatial_cv_regions"],
+    },
+    "panel": {
+        "script": "temporal_loader.py", "deps": [],
+        "inputs": RAW_YEAR_FILES, "outputs": [PANEL_FILES],
+    },
+    "drift": {
+        "script": "explanation_drift.py", "deps": ["panel", "train_clean_model"],
+        "inputs": [PANEL_FILES, CLEAN_MANIFEST_PATH],
+        "outputs": ["explanation_drift", "explanation_drift_global"],
+    },
+    "mgwr": {
+        "script": "mgwr_comparison.py", "deps": ["feature_engineering"],
+        "inputs": [FEATURES_ARTIFACT, SHAPEFILE_PARTS], "outputs": ["mgwr_coefficients"],
+    },
+    "autocorrelation": {
+        "script": "spatial_autocorrelation.py", "deps": ["shap", "geoshapley", "fairness"],
+        "inputs": ["shap_explanations", "geoshapley_explanations", "fairness_metrics", SHAPEFILE_PARTS],
+        "outputs": ["moran_global", "lisa_local"],
+    },
+    "bootstrap": {
+        "script": "bootstrap_uncertainty.py", "deps": ["train_clean_model"],
+        "inputs": [FEATURES_ARTIFACT, CLEAN_BOOSTER_PATH],
+        "outputs": ["bootstrap_shap_stats", "bootstrap_shap_county_stats"],
+    },
+}
+
+
+def resolve(entry):
+    """Files behind an input/output entry (artifact name, path or glob)."""
+    if os.path.isabs(entry):
+        return sorted(glob.glob(entry)) if glob.has_magic(entry) else [entry]
+    path = find_artifact(entry)
+    return [path] if path else []
+
+
+def file_hash(path, memo):
+    """sha256 of a file, reusing ``memo`` while its size and mtime are unchanged."""
+    st   = os.stat(path)
+    key  = [st.st_size, st.st_mtime_ns]
+    name = os.path.relpath(path, PROJECT_ROOT)
+    if memo.get(name, {}).get("key") == key:
+        return memo[name]["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    memo[name] = {"key": key, "sha256": h.hexdigest()}
+    return memo[name]["sha256"]
+
+
+def code_closure(script):
+    """
+    ``script`` plus every module in src/ it imports, directly or through
+    other src modules. Imports made inside functions count too, even
+    when the stage never calls them, so a stage may rerun needlessly but
+    never runs stale code.
+    """
+    seen, todo = set(), [script]
+    while todo:
+        module = todo.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        with open(os.path.join(SRC_DIR, module)) as fh:
+            tree = ast.parse(fh.read(), filename=module)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for imported in names:
+                path = imported.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(SRC_DIR, path)):
+                    todo.append(path)
+    return sorted(seen)
+
+
+def stage_hash(name, args, memo):
+    """Hash of everything a stage reads: its code, its arguments and its input files."""
+    stage = STAGES[name]
+    h = hashlib.sha256(json.dumps(args).encode())
+    for code in code_closure(stage["script"]):
+        h.update(code.encode())
+        h.update(file_hash(os.path.join(SRC_DIR, code), memo).encode())
+    for entry in stage["inputs"]:
+        files = resolve(entry)
+        if not files:
+            raise FileNotFoundError(f"Stage '{name}' input {entry} does not exist")
+        for path in files:
+            h.update(os.path.relpath(path, PROJECT_ROOT).encode())
+            h.update(file_hash(path, memo).encode())
+    return h.hexdigest()[:16]
+
+
+def outputs_exist(name):
+    return all(resolve(entry) for entry in STAGES[name]["outputs"])
+
+
+def plan(targets):
+    """``targets`` plus everything upstream of them, in dependency order."""
+    order, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for dep in STAGES[name]["deps"]:
+            visit(dep)
+        order.append(name)
+
+    for name in targets:
+        visit(name)
+    return order
+
+
+def load_state(path=STATE_PATH):
+    if os.path.exists(path):
+        with open(path) as fh:
+            return json.load(fh)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def run_stage(name, args):
+    """Run one stage's script in its own interpreter, logging to LOG_DIR/<name>.log."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{name}.log")
+    cmd = [sys.executable, os.path.join(SRC_DIR, STAGES[name]["script"])] + args
+    t0 = time.time()
+    with open(log_path, "w") as log:
+        code = subprocess.run(cmd, cwd=PROJECT_ROOT, stdout=log, stderr=subprocess.STDOUT).returncode
+    return code, time.time() - t0, log_path
+
+
+def run(targets=None, force=(), stage_args=None, max_parallel=MAX_PARALLEL, dry_run=False):
+    """
+    Bring ``targets`` (default: every stage) up to date.
+
+    A stage is skipped when the hash of its code, arguments and input
+    files matches its last successful run and its outputs exist. Hashes
+    are taken only once a stage's dependencies have finished, so a
+    rebuilt upstream artifact with unchanged content does not cascade.
+    Stages whose dependencies are satisfied run concurrently, up to
+    ``max_parallel`` at a time. Returns the per-stage records written to
+    the state file.
+    """
+    order      = plan(targets or list(STAGES))
+    stage_args = stage_args or {}
+    state      = load_state()
+    memo       = state.setdefault("files", {})
+    records    = {}
+    pending    = list(order)
+    running    = {}
+
+    def dep_status(name):
+        return [records.get(dep, {}).get("status") for dep in STAGES[name]["deps"] if dep in order]
+
+    def ready(name):
+        return all(s in ("ok", "skipped", "stale") for s in dep_status(name))
+
+    def blocked(name):
+        return any(s in ("failed", "blocked") for s in dep_status(name))
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while pending or running:
+            for name in list(pending):
+                if blocked(name):
+                    pending.remove(name)
+                    records[name] = {"status": "blocked"}
+                    print(f"[pipeline] {name}: blocked by a failed dependency")
+                    continue
+                if not ready(name) or len(running) >= max_parallel:
+                    continue
+                pending.remove(name)
+                args = stage_args.get(name, [])
+                if dry_run and "stale" in dep_status(name):
+                    records[name] = {"status": "stale"}
+                    print(f"[pipeline] {name}: would run after its upstream")
+                    continue
+                try:
+                    h = stage_hash(name, args, memo)
+                except FileNotFoundError as e:
+                    records[name] = {"status": "failed", "error": str(e)}
+                    print(f"[pipeline] {name}: {e}")
+                    continue
+                last  = state["stages"].get(name, {})
+                fresh = (last.get("status") == "ok" and last.get("hash") == h
+                         and outputs_exist(name))
+                if fresh and name not in force:
+                    records[name] = dict(last, status="skipped")
+                    print(f"[pipeline] {name}: up to date ({h})")
+                elif dry_run:
+                    records[name] = {"status": "stale", "hash": h}
+                    print(f"[pipeline] {name}: would run ({h})")
+                else:
+                    print(f"[pipeline] {name}: running {STAGES[name]['script']} {' '.join(args)}")
+                    running[pool.submit(run_stage, name, args)] = (name, h)
+            if not running:
+                if pending and not any(ready(n) or blocked(n) for n in pending):
+                    raise RuntimeError(f"Pipeline stalled with {pending} pending")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, h = running.pop(fut)
+                code, secs, log_path = fut.result()
+                records[name] = {
+                    "status": "ok" if code == 0 else "failed",
+                    "hash": h,
+                    "seconds": round(secs, 2),
+                    "finished": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "log": os.path.relpath(log_path, PROJECT_ROOT),
+                }
+                print(f"[pipeline] {name}: {records[name]['status']} in {secs:.1f}s "
+                      f"(log: {records[name]['log']})")
+                if code == 0:
+                    state["stages"][name] = records[name]
+                else:
+                    with open(log_path) as log:
+                        print("".join(log.readlines()[-5:]), end="")
+                save_state(state)
+
+    if not dry_run:
+        save_state(state)
+    return records
+
+
+def timing_report(records):
+    lines = [f"{'stage':<22}{'status':<10}{'seconds':>10}"]
+    for name, rec in records.items():
+        secs = f"{rec['seconds']:.1f}" if "seconds" in rec and rec["status"] != "skipped" else "-"
+        lines.append(f"{name:<22}{rec['status']:<10}{secs:>10}")
+    return "\n".join(lines)
+
+
+def parse_stage_args(items):
+    """``--args shap='--backend shap'`` → {"shap": ["--backend", "shap"]}."""
+    out = {}
+    for item in items:
+        name, _, args = item.partition("=")
+        if name not in STAGES:
+            raise SystemExit(f"--args: unknown stage '{name}'")
+        out[name] = shlex.split(args)
+    return out
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental GeoAI pipeline")
+    parser.add_argument("stages", nargs="*", metavar="STAGE",
+                        help=f"stages to bring up to date, with their upstream "
+                             f"(default: all of {', '.join(STAGES)})")
+    parser.add_argument("--force", nargs="*", default=None, metavar="STAGE",
+                        help="rerun these stages (all planned stages if none given)")
+    parser.add_argument("--args", action="append", default=[], metavar="STAGE=ARGS",
+                        help="extra command-line arguments for a stage, e.g. geoshapley='--engine tree'")
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL,
+                        help="stages run at the same time")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help=f"stream {', '.join(BUDGETED_STAGES)} over row blocks within this "
+                             f"budget; stages then run one at a time")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report which stages are out of date without running them")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args    = parse_args(argv)
+    targets = args.stages or list(STAGES)
+    unknown = [name for name in targets + (args.force or []) if name not in STAGES]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}")
+    force   = set()
+    if args.force is not None:
+        force = set(args.force) or set(plan(targets))
+    stage_args   = parse_stage_args(args.args)
+    max_parallel = args.parallel
+    if args.memory_budget:
+        # The budget holds for each stage, so stages must not overlap
+        for name in BUDGETED_STAGES:
+            stage_args.setdefault(name, []).extend(["--memory-budget", f"{args.memory_budget:g}"])
+        max_parallel = 1
+    t0 = time.time()
+    records = run(targets, force=force, stage_args=stage_args,
+                  max_parallel=max_parallel, dry_run=args.dry_run)
+    print(timing_report(records))
+    print(f"Pipeline finished in {time.time()-t0:.1f}s")
+    if any(rec["status"] in ("failed", "blocked") for rec in records.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# src/prediction_service.py
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import numbers
+import threading
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import xgboost as xgb
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import FEATURES_ARTIFACT
+from artifact_io import read_artifact
+from model_registry import FEATURE_LIST, load_model
+
+HOST, PORT   = "127.0.0.1", 8765
+MAX_BATCH    = 256     # rows scored together
+MAX_WAIT_MS  = 2.0     # how long the first queued request waits for company
+N_THREADS    = None    # booster threads (None = XGBoost default, all cores)
+CACHE_ROWS   = 8192    # explained rows kept; analysts revisit the same edits
+LATENCY_KEEP = 10000   # recent request latencies kept for percentiles
+
+
+class PredictionService:
+    """
+    What-if predictions and SHAP contributions from a booster loaded once.
+
+    ``predict(edits)`` takes ``{GEOID: {feature: value, ...}, ...}``: each
+    county's row from the feature table with the edits applied (an empty
+    dict scores it as is). Calls from any number of threads are queued
+    and a single worker combines them into micro-batches: a batch closes
+    at ``max_batch`` rows or ``max_wait_ms`` after its first request,
+    whichever comes first, and is scored with one ``inplace_predict`` and
+    one ``pred_contribs`` call.
+
+    TreeSHAP costs about the same per row however rows are batched, so
+    contributions are also kept for the last ``cache_rows`` distinct
+    feature rows and only rows not seen before are explained.
+    """
+
+    def __init__(self, model=None, features=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 n_threads=N_THREADS, cache_rows=CACHE_ROWS):
+        model = load_model() if model is None else model
+        self.booster = model.get_booster() if hasattr(model, "get_booster") else model
+        if n_threads:   # the registry's booster is shared, so tune a private copy
+            self.booster = self.booster.copy()
+            self.booster.set_param({"nthread": n_threads})
+        if features is None:
+            features = read_artifact(FEATURES_ARTIFACT, columns=["GEOID"] + FEATURE_LIST)
+        self.geoids  = {g: i for i, g in enumerate(features["GEOID"])}
+        self.X       = np.ascontiguousarray(features[FEATURE_LIST].to_numpy(dtype=np.float32))
+        self.columns = {f: j for j, f in enumerate(FEATURE_LIST)}
+        self.baseline = self.booster.inplace_predict(self.X)
+
+        self.max_batch   = max_batch
+        self.max_wait    = max_wait_ms / 1000
+        self.cache_rows  = cache_rows
+        self.contribs    = OrderedDict()   # row bytes -> contributions, LRU
+        self.cache_hits  = 0
+        self.queue       = queue.Queue()
+        self.latencies   = deque(maxlen=LATENCY_KEEP)
+        self.batch_sizes = deque(maxlen=LATENCY_KEEP)
+        self.stats_lock  = threading.Lock()   # the worker appends while /stats reads
+        self.worker = threading.Thread(target=self._serve, name="prediction-batcher", daemon=True)
+        self.worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    # ── Request side ─────────────────────────────────────────────────────────
+
+    def rows_for(self, edits):
+        """
+        Feature rows for ``{GEOID: {feature: value}}``; ValueError on
+        malformed edits, non-numeric values and unknown GEOIDs / features.
+        """
+        if not isinstance(edits, Mapping):
+            raise ValueError(f"edits must map GEOID -> {{feature: value}}, got {type(edits).__name__}")
+        for g, changes in edits.items():
+            if changes is not None and not isinstance(changes, Mapping):
+                raise ValueError(f"Edits for {g} must be a {{feature: value}} mapping, "
+                                 f"got {type(changes).__name__}")
+        unknown = [g for g in edits if g not in self.geoids]
+        if unknown:
+            raise ValueError(f"Unknown GEOID(s): {', '.join(map(str, unknown[:5]))}")
+        geoids = list(edits)
+        rows = self.X[[self.geoids[g] for g in geoids]].copy()
+        for i, changes in enumerate(edits.values()):
+            for feat, value in (changes or {}).items():
+                if feat not in self.columns:
+                    raise ValueError(f"Unknown feature '{feat}'; expected one of {FEATURE_LIST}")
+                if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                    raise ValueError(f"Edit {geoids[i]}.{feat} must be a number, got {value!r}")
+                rows[i, self.columns[feat]] = value
+        return geoids, rows
+
+    def submit(self, edits, explain=True):
+        """Queue a what-if request; returns a Future of the result list."""
+        geoids, rows = self.rows_for(edits)
+        future = Future()
+        self.queue.put((geoids, rows, explain, future, time.perf_counter()))
+        return future
+
+    def predict(self, edits, explain=True, timeout=None):
+        """
+        One result per county: GEOID, prediction, baseline (unedited)
+        prediction and, with ``explain``, the expected value and the
+        ``phi_<feature>`` contributions.
+        """
+        return self.submit(edits, explain).result(timeout)
+
+    # ── Batching worker ──────────────────────────────────────────────────────
+
+    def _serve(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch, n = [item], len(item[1])
+            deadline = item[4] + self.max_wait
+            while n < self.max_batch:
+                try:
+                    nxt = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self.queue.put(None)
+                    break
+                batch.append(nxt)
+                n += len(nxt[1])
+            try:
+                self._run(batch)
+            except Exception as exc:   # hand the failure to every caller still waiting
+                for *_, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _run(self, batch):
+        X = np.concatenate([rows for _, rows, *_ in batch])
+        preds = self.booster.inplace_predict(X)
+        explain_rows = np.concatenate([np.full(len(rows), explain) for _, rows, explain, *_ in batch])
+        contribs = self._explain(X, explain_rows)
+
+        lo, latencies = 0, []
+        for geoids, rows, explain, future, t0 in batch:
+            out = []
+            for i, g in enumerate(geoids):
+                res = {"GEOID": g, "prediction": float(preds[lo + i]),
+                       "baseline": float(self.baseline[self.geoids[g]])}
+                if explain:
+                    phi = contribs[lo + i]
+                    res["expected_value"] = float(phi[-1])
+                    res.update({f"phi_{f}": float(v) for f, v in zip(FEATURE_LIST, phi[:-1])})
+                out.append(res)
+            lo += len(rows)
+            future.set_result(out)
+            latencies.append(time.perf_counter() - t0)
+        with self.stats_lock:
+            self.batch_sizes.append(len(X))
+            self.latencies.extend(latencies)
+
+    def _explain(self, X, explain_rows):
+        """Contributions of the flagged rows of ``X``, by position: cached rows looked up, the rest in one call."""
+        keys, new = {i: X[i].tobytes() for i in np.flatnonzero(explain_rows)}, {}
+        for i, key in keys.items():
+            if key in self.contribs:
+                self.contribs.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                new.setdefault(key, i)
+        fresh = {}
+        if new:
+            phi = self.booster.predict(xgb.DMatrix(X[list(new.values())], feature_names=FEATURE_LIST),
+                                       pred_contribs=True)
+            fresh = dict(zip(new, phi))
+        out = {i: fresh[key] if key in fresh else self.contribs[key] for i, key in keys.items()}
+        self.contribs.update(fresh)
+        while len(self.contribs) > self.cache_rows:
+            self.contribs.popitem(last=False)
+        return out
+
+    def stats(self):
+        with self.stats_lock:
+            lat, sizes = list(self.latencies), list(self.batch_sizes)
+        lat, sizes = np.asarray(lat) * 1000, np.asarray(sizes)
+        pct = np.percentile(lat, (50, 95, 99)).tolist() if len(lat) else [None] * 3
+        return {"requests": len(lat), "batches": len(sizes),
+                "mean_batch_rows": float(sizes.mean()) if len(sizes) else None,
+                "cache_hits": self.cache_hits,
+                "p50_ms": pct[0], "p95_ms": pct[1], "p99_ms": pct[2]}
+
+
+# ── HTTP front end ───────────────────────────────────────────────────────────
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        """POST /predict {"edits": {GEOID: {feature: value}}, "explain": true}; GET /health, /stats."""
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "counties": len(service.geoids)})
+            elif self.path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": f"no route {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": f"no route {self.path}"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                edits = request["edits"]
+                if isinstance(edits, list):   # [GEOID, ...] scores counties as they are
+                    edits = {g: {} for g in edits}
+                results = service.predict(edits, explain=request.get("explain", True))
+            except (ValueError, KeyError, TypeError) as exc:
+                self._send(400, {"error": str(exc)})
+                return
+            except Exception as exc:   # answer rather than drop the connection
+                self._send(500, {"error": f"{type(exc).__name__}: {exc}"})
+                return
+            self._send(200, {"results": results})
+
+        def log_message(self, *args):
+            pass   # keep the request log off the latency path
+
+    return Handler
+
+
+def serve(service, host=HOST, port=PORT):
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"[service] {len(service.geoids)} counties, listening on http://{host}:{port} "
+          f"(batches of <= {service.max_batch} rows, {service.max_wait * 1000:g} ms wait)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[service] {service.stats()}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="What-if prediction + SHAP service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="rows per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="latency budget for filling a batch")
+    parser.add_argument("--threads", type=int, default=N_THREADS, help="booster threads")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with PredictionService(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                           n_threads=args.threads) as service:
+        serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
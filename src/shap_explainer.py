@@ -2,60 +2,151 @@
 
 import os
 import sys
-import joblib
+import argparse
+import numpy as np
 import pandas as pd
-import shap
+import xgboost as xgb
 
 # Make project root importable
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-# Paths
-FEATURES_CSV     = os.path.join(PROJECT_ROOT, "data", "processed", "voting_features.csv")
-CLEAN_MODEL_PATH = os.path.join(PROJECT_ROOT, "data", "processed", "xgb_automl_model_clean.pkl")
-OUTPUT_CSV       = os.path.join(PROJECT_ROOT, "data", "processed", "shap_explanations.csv")
-
-# The exact features used by the clean model
-FEATURE_LIST = [
-    "proj_x", "proj_y", "total_pop", "sex_ratio",
-    "pct_black", "pct_hisp", "pct_bach", "median_income",
-    "pct_65_over", "pct_age_18_29", "gini", "pct_manuf",
-    "ln_pop_den", "pct_3rd_party", "turn_out", "pct_fb",
-    "pct_uninsured"
-]
-
-def main():
-    # 1) Load the tabular features + GEOID
-    df = pd.read_csv(FEATURES_CSV, dtype={"GEOID": str})
-    geoids = df["GEOID"].copy()
-    
-    # 2) Build X for SHAP
-    X = df[FEATURE_LIST]
-    
-    # 3) Load clean model and extract XGBRegressor
-    automl = joblib.load(CLEAN_MODEL_PATH)
-    wrapped = automl.model
-    xgb_model = wrapped.model if hasattr(wrapped, "model") else wrapped
-    
-    # 4) Initialize TreeExplainer
+from config import FEATURES_ARTIFACT, PROCESSED_DIR, MEMORY_BUDGET_MB
+from explanation_cache import cached_compute, model_fingerprint, row_keys, digest
+from artifact_io import read_artifact, write_artifact, iter_artifact, ArtifactWriter
+from memory_budget import rows_per_block
+from model_registry import FEATURE_LIST, load_model
+
+# Paths / artifacts
+OUTPUT_ARTIFACT   = "shap_explanations"
+
+# Backends: "native" = XGBoost pred_contribs on the booster, "shap" = shap.TreeExplainer
+BACKENDS   = ("native", "shap")
+CHUNK_ROWS = 16384   # rows per pred_contribs call
+N_THREADS  = 0       # 0 = all cores
+
+
+def native_contribs(booster, X, chunk_rows=CHUNK_ROWS, n_threads=N_THREADS, dtype=np.float32):
+    """
+    SHAP values from XGBoost's own TreeSHAP (``pred_contribs``).
+
+    Rows are converted and scored ``chunk_rows`` at a time into one
+    preallocated ``dtype`` array, so only a chunk-sized float32 copy of
+    the features exists at any point. Returns (values, expected_value).
+    """
+    if n_threads:
+        # the registry's booster is shared: tune a private copy
+        booster = booster.copy()
+        booster.set_param({"nthread": n_threads})
+    names  = list(X.columns)
+    values = np.empty((len(X), len(names)), dtype=dtype)
+    expected_value = np.nan
+    for lo in range(0, len(X), chunk_rows):
+        hi = min(lo + chunk_rows, len(X))
+        dm = xgb.DMatrix(X.iloc[lo:hi].to_numpy(dtype=np.float32), feature_names=names,
+                         nthread=n_threads or -1)
+        contribs = booster.predict(dm, pred_contribs=True)
+        values[lo:hi] = contribs[:, :-1]
+        expected_value = contribs[0, -1]
+    return values, expected_value
+
+
+def shap_contribs(xgb_model, X, dtype=np.float32):
+    import shap
     explainer = shap.TreeExplainer(xgb_model)
-    
-    # 5) Compute SHAP values
-    shap_vals = explainer.shap_values(X)  # returns (n_samples, n_features)
-    expected_value = explainer.expected_value
-    
-    # 6) Build output DataFrame
-    out = pd.DataFrame(
-        shap_vals,
-        columns=[f"phi_{feat}" for feat in FEATURE_LIST]
-    )
-    out.insert(0, "expected_value", expected_value)
-    out.insert(0, "GEOID", geoids.values)
-    
-    # 7) Save to the processed folder
-    out.to_csv(OUTPUT_CSV, index=False)
-    print(f"SHAP explanations saved to {OUTPUT_CSV}")
+    values = explainer.shap_values(X)  # returns (n_samples, n_features)
+    return np.asarray(values, dtype=dtype), explainer.expected_value
+
+
+def explain(df, xgb_model=None, backend="native", chunk_rows=CHUNK_ROWS,
+            n_threads=N_THREADS, dtype=np.float32, use_cache=False):
+    """
+    County-level SHAP table (GEOID, expected_value, phi_<feature>) for the
+    rows of ``df``. Loads the clean model when ``xgb_model`` is not given.
+
+    With ``use_cache`` only rows whose features (or the model) changed
+    since the last run are recomputed; see explanation_cache.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    if xgb_model is None:
+        xgb_model = load_model()
+
+    X = df[FEATURE_LIST]
+    phi_cols = [f"phi_{feat}" for feat in FEATURE_LIST]
+
+    def compute(rows):
+        Xr = X.iloc[rows]
+        if backend == "native":
+            values, expected_value = native_contribs(
+                xgb_model.get_booster(), Xr, chunk_rows=chunk_rows, n_threads=n_threads, dtype=dtype
+            )
+        else:
+            values, expected_value = shap_contribs(xgb_model, Xr, dtype=dtype)
+        return np.column_stack([values, np.full(len(Xr), expected_value, dtype=dtype)])
+
+    if use_cache:
+        fingerprint = digest(model_fingerprint(xgb_model), backend, FEATURE_LIST)
+        values = cached_compute("shap", fingerprint, phi_cols + ["expected_value"],
+                                row_keys(X), compute).astype(dtype)
+    else:
+        values = compute(np.arange(len(X)))
+
+    out = pd.DataFrame(values[:, :-1], columns=phi_cols, copy=False)
+    out.insert(0, "expected_value", values[:, -1])
+    out.insert(0, "GEOID", df["GEOID"].values)
+    return out
+
+
+def stream_explanations(memory_budget_mb, xgb_model=None, backend="native", n_threads=N_THREADS,
+                        source=FEATURES_ARTIFACT, name=OUTPUT_ARTIFACT, directory=PROCESSED_DIR):
+    """
+    ``explain`` over row blocks of the feature table, appending each
+    block's explanations to the output, so neither the features nor the
+    SHAP values are ever held for every row. The explanation cache is
+    skipped: its store is loaded whole.
+    """
+    if xgb_model is None:
+        xgb_model = load_model()
+    # GEOID + float64 features in, float32 contributions and the float64 frame out
+    block_rows = rows_per_block(64 + len(FEATURE_LIST) * (8 + 4 + 4 + 8) * 2, memory_budget_mb)
+    with ArtifactWriter(name, directory=directory) as writer:
+        for block in iter_artifact(source, columns=["GEOID"] + FEATURE_LIST, batch_rows=block_rows,
+                                   directory=directory):
+            writer.write(explain(block, xgb_model, backend=backend, chunk_rows=min(block_rows, CHUNK_ROWS),
+                                 n_threads=n_threads))
+    print(f"SHAP explanations saved to {writer.path} ({writer.rows} rows in blocks of {block_rows})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="County-level SHAP explanations")
+    parser.add_argument("--backend", choices=BACKENDS, default="native")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--threads", type=int, default=N_THREADS, help="0 = all cores")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompute every row instead of reusing cached explanations")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="stream over row blocks sized to this budget")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.memory_budget:
+        stream_explanations(args.memory_budget, backend=args.backend, n_threads=args.threads)
+        return
+
+    # 1) Load the tabular features + GEOID
+    df = read_artifact(FEATURES_ARTIFACT, columns=["GEOID"] + FEATURE_LIST)
+
+    # 2) Compute SHAP values
+    out = explain(df, backend=args.backend, chunk_rows=args.chunk_rows, n_threads=args.threads,
+                  use_cache=not args.no_cache)
+
+    # 3) Save to the processed folder
+    path = write_artifact(out, OUTPUT_ARTIFACT)
+    print(f"SHAP explanations saved to {path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+# src/spatial_autocorrelation.py
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from artifact_io import read_artifact, write_artifact, artifact_exists, artifact_columns
+from geometry_cache import load_geometry
+from spatial_weights import load_weights
+
+# Paths / artifacts
+GLOBAL_ARTIFACT = "moran_global"
+LOCAL_ARTIFACT  = "lisa_local"
+
+# Columns tested per source artifact: an explicit list or a name prefix
+SOURCES = {
+    "fairness":   ("fairness_metrics", ["residual"]),
+    "shap":       ("shap_explanations", "phi_"),
+    "geoshapley": ("geoshapley_explanations", "phi_"),
+}
+
+WEIGHTS_K      = 8          # k-NN neighbours (row-standardised)
+N_PERMUTATIONS = 999
+ALPHA          = 0.05       # LISA significance for the cluster labels
+PERM_ELEMS     = 1 << 22    # (row x permutation x neighbour x column) values gathered per batch
+
+# LISA quadrants (0 = not significant)
+QUADRANTS = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
+
+
+def load_source(source):
+    """(GEOID, values) of a source's tested columns; constant columns are dropped."""
+    name, cols = SOURCES[source]
+    if isinstance(cols, str):
+        cols = [c for c in artifact_columns(name) if c.startswith(cols)]
+    df = read_artifact(name, columns=["GEOID"] + cols).dropna()
+    values = df[cols].astype(float)
+    values = values.loc[:, values.std() > 0]
+    return df["GEOID"].to_numpy(), values
+
+
+def pseudo_p(sims, observed, axis=0):
+    """Folded pseudo p-value: the smaller tail of ``sims`` around ``observed``."""
+    P = sims.shape[axis]
+    larger = (sims >= np.expand_dims(observed, axis)).sum(axis=axis)
+    larger = np.minimum(larger, P - larger)
+    return (larger + 1) / (P + 1)
+
+
+def moran_global(W, Z, n_permutations=N_PERMUTATIONS, seed=42, max_elems=PERM_ELEMS):
+    """
+    Global Moran's I of every column of the standardised (n, m) ``Z``
+    with permutation inference. A batch of permutations is stacked into
+    one (n, batch * m) block, so each batch is a single sparse multiply.
+    Returns (I, z_sim, p_sim), each of length m.
+    """
+    rng = np.random.default_rng(seed)
+    n, m = Z.shape
+    scale = n / W.sum() / (Z * Z).sum(axis=0)   # z'z is permutation-invariant
+    observed = scale * (Z * (W @ Z)).sum(axis=0)
+
+    sims  = np.empty((n_permutations, m))
+    batch = max(1, max_elems // (n * m))
+    for lo in range(0, n_permutations, batch):
+        b  = min(batch, n_permutations - lo)
+        Zp = Z[rng.permuted(np.broadcast_to(np.arange(n), (b, n)), axis=1)]   # (b, n, m)
+        WZ = (W @ Zp.transpose(1, 0, 2).reshape(n, b * m)).reshape(n, b, m).transpose(1, 0, 2)
+        sims[lo:lo + b] = scale * (Zp * WZ).sum(axis=1)
+    z_sim = (observed - sims.mean(axis=0)) / sims.std(axis=0)
+    return observed, z_sim, pseudo_p(sims, observed)
+
+
+def local_moran(W, Z, n_permutations=N_PERMUTATIONS, seed=42, max_elems=PERM_ELEMS):
+    """
+    Local Moran's I_i of every column of ``Z`` with conditional
+    permutation inference: each observation keeps its value and its
+    neighbours are redrawn from the other n - 1 observations.
+
+    As in PySAL's ``crand``, one set of ``n_permutations`` draws of
+    k_max indices is shared by all observations (shifted past i so i
+    never neighbours itself); observations are processed in row blocks,
+    all permutations and columns at once. Returns (I, p_sim, quadrant),
+    each (n, m).
+    """
+    rng = np.random.default_rng(seed)
+    n, m = Z.shape
+    W = W.tocsr()
+    m2 = (Z * Z).sum(axis=0) / n
+    lag = W @ Z
+    observed = Z * lag / m2
+
+    # Row weights padded to the largest neighbour count
+    counts = np.diff(W.indptr)
+    k_max  = int(counts.max())
+    weights = np.zeros((n, k_max))
+    weights[np.repeat(np.arange(n), counts), np.arange(W.nnz) - np.repeat(W.indptr[:-1], counts)] = W.data
+    draws = np.argpartition(rng.random((n_permutations, n - 1)), k_max - 1, axis=1)[:, :k_max]
+
+    p_sim = np.empty((n, m))
+    block = max(1, max_elems // (n_permutations * k_max * m))
+    for lo in range(0, n, block):
+        rows = np.arange(lo, min(lo + block, n))
+        ids  = draws[None, :, :] + (draws[None, :, :] >= rows[:, None, None])   # (b, P, k)
+        lag_sim = np.einsum("bpkm,bk->bpm", Z[ids], weights[rows])
+        sims = Z[rows, None, :] * lag_sim / m2
+        p_sim[rows] = pseudo_p(sims, observed[rows], axis=1)
+
+    quadrant = np.select([(Z > 0) & (lag > 0), (Z < 0) & (lag > 0), (Z < 0) & (lag < 0), (Z > 0) & (lag < 0)],
+                         [1, 2, 3, 4], 0)
+    return observed, p_sim, quadrant
+
+
+def analyse_source(source, coords_by_geoid, k=WEIGHTS_K, n_permutations=N_PERMUTATIONS,
+                   alpha=ALPHA, seed=42):
+    """Global and local Moran's I for every tested column of one source."""
+    geoids, values = load_source(source)
+    pos  = coords_by_geoid.index.get_indexer(geoids)
+    keep = pos >= 0
+    geoids, values = geoids[keep], values[keep]
+    coords = coords_by_geoid.to_numpy()[pos[keep]]
+    W = load_weights(coords, "knn", k=k)
+
+    X = values.to_numpy()
+    Z = (X - X.mean(axis=0)) / X.std(axis=0)
+    names = [f"{source}_{c}" for c in values.columns]
+
+    I, z_sim, p_global = moran_global(W, Z, n_permutations, seed)
+    Ii, p_local, quadrant = local_moran(W, Z, n_permutations, seed)
+
+    global_df = pd.DataFrame({
+        "source": source, "column": list(values.columns), "I": I,
+        "expected_I": -1 / (len(Z) - 1), "z_sim": z_sim, "p_sim": p_global, "n": len(Z),
+    })
+    local = {"GEOID": geoids}
+    for j, name in enumerate(names):
+        local[f"lisa_{name}"]   = Ii[:, j]
+        local[f"lisa_p_{name}"] = p_local[:, j]
+        local[f"lisa_q_{name}"] = np.where(p_local[:, j] <= alpha, quadrant[:, j], 0)
+    return global_df, pd.DataFrame(local)
+
+
+def run(sources=tuple(SOURCES), k=WEIGHTS_K, n_permutations=N_PERMUTATIONS, alpha=ALPHA, seed=42):
+    geometry = load_geometry("EPSG:5070", columns=["centroid_x", "centroid_y"], geometry=False)
+    coords_by_geoid = geometry.set_index("GEOID")[["centroid_x", "centroid_y"]]
+    globals_, local = [], None
+    for source in sources:
+        if not artifact_exists(SOURCES[source][0]):
+            print(f"[moran] {SOURCES[source][0]} not found, skipping {source}")
+            continue
+        t0 = time.time()
+        global_df, local_df = analyse_source(source, coords_by_geoid, k, n_permutations, alpha, seed)
+        print(f"[moran] {source}: {len(global_df)} columns x {len(local_df)} counties, "
+              f"{n_permutations} permutations in {time.time()-t0:.1f}s")
+        globals_.append(global_df)
+        local = local_df if local is None else local.merge(local_df, on="GEOID", how="outer")
+    if not globals_:
+        raise FileNotFoundError("None of the source artifacts exist; run SHAP / fairness first")
+    return pd.concat(globals_, ignore_index=True), local
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Moran's I and LISA for residuals and explanations")
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES), default=list(SOURCES))
+    parser.add_argument("--k", type=int, default=WEIGHTS_K, help="k-NN neighbours")
+    parser.add_argument("--permutations", type=int, default=N_PERMUTATIONS)
+    parser.add_argument("--alpha", type=float, default=ALPHA, help="LISA cluster significance")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    global_df, local_df = run(args.sources, args.k, args.permutations, args.alpha, args.seed)
+    print(global_df.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    path = write_artifact(global_df, GLOBAL_ARTIFACT)
+    print(f"Global Moran's I saved to {path}")
+    path = write_artifact(local_df, LOCAL_ARTIFACT)
+    print(f"LISA statistics saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
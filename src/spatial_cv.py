@@ -0,0 +1,200 @@
+# src/spatial_cv.py
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+# Make project root importable
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import FEATURES_ARTIFACT
+from artifact_io import read_artifact, write_artifact
+from model_registry import FEATURE_LIST, TARGET, model_params
+
+# Paths / artifacts
+OUTPUT_ARTIFACT  = "spatial_cv_residuals"   # out-of-fold residual per county (read by spatial_fairness)
+FOLDS_ARTIFACT   = "spatial_cv_folds"
+REGIONS_ARTIFACT = "spatial_cv_regions"
+
+# Blocking: whole states, k-means clusters of the projected centroids, or
+# plain random folds (the optimistic baseline)
+BLOCKINGS  = ("state", "kmeans", "random")
+N_FOLDS    = 5
+N_CLUSTERS = 50         # k-means blocks, roughly one per state
+N_WORKERS  = max(1, min(N_FOLDS, multiprocessing.cpu_count() - 1))
+SEED       = 42
+
+# Per-process state, filled by init_worker
+_STATE = {}
+
+
+def kmeans_blocks(xy, k=N_CLUSTERS, seed=SEED, n_iter=50):
+    """Lloyd's k-means on (n, 2) coordinates; returns the cluster of each row."""
+    from scipy.cluster.vq import kmeans2
+    xy = (xy - xy.mean(axis=0)) / xy.std(axis=0)
+    _, labels = kmeans2(xy, k, iter=n_iter, minit="++", seed=seed)
+    return labels
+
+
+def assign_folds(blocks, n_folds=N_FOLDS):
+    """
+    Whole blocks to folds, largest first onto the currently smallest
+    fold, so fold sizes stay close even with very uneven blocks.
+    """
+    _, codes = np.unique(blocks, return_inverse=True)
+    sizes = np.bincount(codes)
+    fold_of_block = np.empty(len(sizes), dtype=np.int64)
+    load = np.zeros(n_folds, dtype=np.int64)
+    for b in np.argsort(-sizes, kind="stable"):
+        f = int(np.argmin(load))
+        fold_of_block[b] = f
+        load[f] += sizes[b]
+    return fold_of_block[codes]
+
+
+def make_folds(df, blocking="state", n_folds=N_FOLDS, n_clusters=N_CLUSTERS, seed=SEED):
+    """(fold, region) per row for the chosen blocking; regions are what errors are reported by."""
+    if blocking == "state":
+        regions = df["STATEFP"].astype(str).to_numpy()
+    elif blocking == "kmeans":
+        clusters = kmeans_blocks(df[["proj_x", "proj_y"]].to_numpy(dtype=float), n_clusters, seed)
+        regions  = np.char.add("k", np.char.zfill(clusters.astype(str), 2))
+    elif blocking == "random":
+        rng = np.random.default_rng(seed)
+        return rng.permutation(np.arange(len(df)) % n_folds), df["STATEFP"].astype(str).to_numpy()
+    else:
+        raise ValueError(f"blocking must be one of {BLOCKINGS}, got '{blocking}'")
+    return assign_folds(regions, n_folds), regions
+
+
+# ── Shared feature matrix ────────────────────────────────────────────────────
+
+def share_array(a):
+    """Copy ``a`` into a new shared-memory block; returns (block, descriptor for workers)."""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+    np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+    return shm, (shm.name, a.shape, a.dtype.str)
+
+
+def attach_array(descriptor):
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def init_worker(X_desc, y_desc, folds, params, n_threads):
+    """Map the shared feature matrix and target once per process (no copy)."""
+    shm_X, X = attach_array(X_desc)
+    shm_y, y = attach_array(y_desc)
+    _STATE.update(shm=(shm_X, shm_y), X=X, y=y, folds=folds, params=params, n_threads=n_threads)
+
+
+def fit_fold(k):
+    """Train on every fold but ``k``; returns (k, held-out rows, predictions, seconds)."""
+    t0 = time.time()
+    X, y, folds = _STATE["X"], _STATE["y"], _STATE["folds"]
+    test = np.flatnonzero(folds == k)
+    train = np.flatnonzero(folds != k)
+    model = xgb.XGBRegressor(**_STATE["params"], n_jobs=_STATE["n_threads"], random_state=SEED)
+    model.fit(X[train], y[train])
+    return k, test, model.predict(X[test]), time.time() - t0
+
+
+# ── Metrics ──────────────────────────────────────────────────────────────────
+
+def error_table(frame, by):
+    """n, RMSE, MAE, bias (mean residual) and R² of ``frame`` grouped by ``by``."""
+    g = frame.assign(sq=frame["residual"] ** 2, abs=frame["residual"].abs()).groupby(by, sort=True)
+    out = pd.DataFrame({
+        "n": g.size(), "rmse": np.sqrt(g["sq"].mean()), "mae": g["abs"].mean(),
+        "bias": g["residual"].mean(),
+    })
+    ss_tot = g[TARGET].agg(lambda s: ((s - s.mean()) ** 2).sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["r2"] = 1 - g["sq"].sum() / ss_tot
+    return out.reset_index()
+
+
+def run(blocking="state", n_folds=N_FOLDS, n_workers=N_WORKERS, n_clusters=N_CLUSTERS, seed=SEED,
+        params=None):
+    """
+    Spatially blocked CV of the clean model's tuned configuration. Folds
+    train side by side on a process pool whose workers map one shared
+    copy of the feature matrix. Returns (residuals, per-fold, per-region).
+    """
+    df = read_artifact(FEATURES_ARTIFACT, columns=["GEOID", "STATEFP", TARGET] + FEATURE_LIST)
+    df = df.dropna(subset=[TARGET]).reset_index(drop=True)
+    folds, regions = make_folds(df, blocking, n_folds, n_clusters, seed)
+    params = model_params() if params is None else params
+    params = {k: v for k, v in params.items() if k not in ("n_jobs", "nthread", "random_state", "seed")}
+
+    X = np.ascontiguousarray(df[FEATURE_LIST].to_numpy(dtype=np.float32))
+    y = df[TARGET].to_numpy(dtype=np.float32)
+    n_workers = max(1, min(n_workers, n_folds))
+    n_threads = max(1, multiprocessing.cpu_count() // n_workers)
+
+    pred, seconds = np.full(len(df), np.nan), {}
+    shm_X, X_desc = share_array(X)
+    shm_y, y_desc = share_array(y)
+    t0 = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                 initargs=(X_desc, y_desc, folds, params, n_threads)) as pool:
+            for future in as_completed([pool.submit(fit_fold, k) for k in range(n_folds)]):
+                k, test, p, secs = future.result()
+                pred[test], seconds[k] = p, secs
+                print(f"[cv] fold {k}: {len(test)} held out, {secs:.1f}s")
+    finally:
+        for shm in (shm_X, shm_y):
+            shm.close()
+            shm.unlink()
+    print(f"[cv] {n_folds} {blocking} folds on {n_workers} workers in {time.time()-t0:.1f}s "
+          f"(sum of fold times {sum(seconds.values()):.1f}s)")
+
+    residuals = pd.DataFrame({
+        "GEOID": df["GEOID"], "blocking": blocking, "fold": folds, "region": regions,
+        TARGET: df[TARGET], "prediction": pred, "residual": pred - df[TARGET],
+    })
+    per_fold = error_table(residuals, "fold")
+    per_fold["seconds"] = per_fold["fold"].map(seconds)
+    per_fold.insert(0, "blocking", blocking)
+    per_region = error_table(residuals, "region")
+    per_region.insert(0, "blocking", blocking)
+    return residuals, per_fold, per_region
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Spatially blocked cross-validation of the clean model")
+    parser.add_argument("--blocking", choices=BLOCKINGS, default="state")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--clusters", type=int, default=N_CLUSTERS, help="k-means blocks")
+    parser.add_argument("--workers", type=int, default=N_WORKERS, help="folds trained in parallel")
+    parser.add_argument("--seed", type=int, default=SEED)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    residuals, per_fold, per_region = run(args.blocking, args.folds, args.workers, args.clusters, args.seed)
+    overall = error_table(residuals.assign(all="all"), "all").iloc[0]
+    print(per_fold.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print(f"[cv] overall RMSE {overall['rmse']:.4f}, R² {overall['r2']:.4f}")
+    path = write_artifact(residuals, OUTPUT_ARTIFACT)
+    print(f"Out-of-fold residuals saved to {path}")
+    path = write_artifact(per_fold, FOLDS_ARTIFACT)
+    print(f"Per-fold errors saved to {path}")
+    path = write_artifact(per_region, REGIONS_ARTIFACT)
+    print(f"Per-region errors saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
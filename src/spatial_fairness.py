@@ -2,7 +2,7 @@
 
 import os
 import sys
-import joblib
+import argparse
 import pandas as pd
 import geopandas as gpd
 import numpy as np
@@ -12,85 +12,339 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-# Paths
-FEATURES_CSV        = os.path.join(PROJECT_ROOT, "data", "processed", "voting_features.csv")
-CLEAN_MODEL_PATH    = os.path.join(PROJECT_ROOT, "data", "processed", "xgb_automl_model_clean.pkl")
-SHAPE_PATH          = os.path.join(
-    PROJECT_ROOT, "data", "raw", "shapefiles", "cb_2018_us_county_500k.shp"
-)
-OUTPUT_PATH         = os.path.join(PROJECT_ROOT, "data", "processed", "fairness_metrics.csv")
+from config import FEATURES_ARTIFACT, PROCESSED_DIR, MEMORY_BUDGET_MB
+from explanation_cache import cached_compute, model_fingerprint, row_keys, digest
+from artifact_io import read_artifact, write_artifact, iter_artifact, ArtifactWriter
+from memory_budget import rows_per_block
+from fairness_engine import FairnessEngine, N_QUANTILES, grouping_name
+from model_registry import FEATURE_LIST, load_model
+
+# Paths / artifacts
+OUTPUT_ARTIFACT     = "fairness_metrics"
+GAPS_ARTIFACT       = "fairness_gaps"
+GROUPS_ARTIFACT     = "fairness_groups"
+CV_ARTIFACT         = "spatial_cv_residuals"
+
+# Inference on the gaps: resamples per test, (resample x row x grouping)
+# cells gathered per batch, CI level
+N_RESAMPLES    = 2000
+RESAMPLE_ELEMS = 1 << 23
+CI_LEVEL       = 0.95
 
 # Sensitive attributes
 SENSITIVE_ATTRS = ["pct_black", "pct_hisp", "median_income"]
 
-# Exactly the features the clean model was trained on:
-FEATURE_LIST = [
-    "proj_x", "proj_y", "total_pop", "sex_ratio",
-    "pct_black", "pct_hisp", "pct_bach", "median_income",
-    "pct_65_over", "pct_age_18_29", "gini", "pct_manuf",
-    "ln_pop_den", "pct_3rd_party", "turn_out", "pct_fb",
-    "pct_uninsured"
-]
-
 
-def predict_residuals():
+def predict_residuals(use_cache=True, attrs=SENSITIVE_ATTRS):
     # Load only the cleaned feature table
-    df = pd.read_csv(FEATURES_CSV, dtype={"GEOID": str})
+    columns = list(dict.fromkeys(["GEOID", "new_pct_dem"] + FEATURE_LIST + list(attrs)))
+    df = read_artifact(FEATURES_ARTIFACT, columns=columns)
     # True target
     y_true = df["new_pct_dem"]
     # Subset to exactly the model features
     X = df[FEATURE_LIST]
 
-    # Load clean FLAML model
-    automl = joblib.load(CLEAN_MODEL_PATH)
-    wrapped = automl.model
-    xgb_model = wrapped.model if hasattr(wrapped, "model") else wrapped
+    xgb_model = load_model()
 
-    # Predict and compute residual
-    preds = xgb_model.predict(X)
+    # Predict (reusing cached predictions for unchanged rows) and compute residual
+    preds = cached_compute(
+        "predict", digest(model_fingerprint(xgb_model), FEATURE_LIST), ["prediction"],
+        row_keys(X), lambda rows: xgb_model.predict(X.iloc[rows]), enabled=use_cache,
+    )[:, 0]
     res = pd.DataFrame({
         "GEOID": df["GEOID"],
         "residual": preds - y_true
     })
     # Carry along sensitive attrs for stratification
-    for attr in SENSITIVE_ATTRS:
+    for attr in attrs:
         res[attr] = df[attr]
     return res
 
 
-def compute_fairness(res_df):
-    df = res_df.copy()
-    global_gaps = {}
-    for attr in SENSITIVE_ATTRS:
-        # quantile‐based strata
-        bins = np.nanquantile(df[attr], np.linspace(0, 1, 5))
-        strata = pd.cut(df[attr], bins=bins, labels=False, include_lowest=True)
-        df[f"{attr}_stratum"] = strata
+def model_residuals(paths):
+    """Residuals of further models (e.g. bootstrap refits) on the feature table, one row per model."""
+    df = read_artifact(FEATURES_ARTIFACT, columns=["new_pct_dem"] + FEATURE_LIST)
+    y_true = df["new_pct_dem"].to_numpy()
+    return np.stack([load_model(path).predict(df[FEATURE_LIST]) - y_true for path in paths])
+
+
+def cv_residuals(geoids, name=CV_ARTIFACT):
+    """Out-of-fold residuals from spatial_cv.py, aligned to ``geoids``; the label names the blocking."""
+    cv  = read_artifact(name, columns=["GEOID", "blocking", "residual"])
+    pos = pd.Index(cv["GEOID"]).get_indexer(geoids)
+    if (pos < 0).any():
+        raise ValueError(f"{name} lacks {(pos < 0).sum()} counties; re-run spatial_cv.py")
+    return cv["residual"].to_numpy(dtype=float)[pos], f"spatial_cv_{cv['blocking'].iloc[0]}"
 
-        # mean residual by stratum and fairness score
-        means = df.groupby(f"{attr}_stratum")["residual"].mean()
-        df[f"{attr}_mean_residual"] = strata.map(means)
-        df[f"{attr}_fairness_score"] = (df["residual"] - df[f"{attr}_mean_residual"]).abs()
 
-        # global gap
-        global_gaps[attr] = means.max() - means.min()
+def build_engine(attrs, attr_names=SENSITIVE_ATTRS, n_quantiles=N_QUANTILES, intersections=()):
+    """FairnessEngine over each of ``attr_names`` plus each intersection (tuple of attributes)."""
+    groupings = [(a,) for a in attr_names] + [tuple(g) for g in intersections]
+    used = list(dict.fromkeys(a for g in groupings for a in g))
+    return FairnessEngine({a: attrs[a] for a in used}, groupings, n_quantiles)
 
+
+def report_gaps(engine, gaps):
     print("=== Global Fairness Gaps ===")
-    for attr, gap in global_gaps.items():
-        print(f"{attr}: {gap:.4f}")
+    for grouping, gap in zip(engine.groupings, np.atleast_2d(gaps)[0]):
+        print(f"{grouping_name(grouping)}: {gap:.4f}")
+
+
+def compute_fairness(res_df, engine=None):
+    """
+    Per-county stratum, stratum mean residual and fairness score for
+    each grouping of ``engine`` (quartiles of each SENSITIVE_ATTRS by
+    default), built in one pass over the integer-coded strata.
+    """
+    if engine is None:
+        engine = build_engine(res_df)
+    residual = res_df["residual"].to_numpy(dtype=float)
+    means = engine.means(residual)
+    report_gaps(engine, engine.gaps(residual))
+    return pd.concat([res_df.reset_index(drop=True),
+                      pd.DataFrame(engine.row_columns(residual, means=means))], axis=1)
+
+
+def stratified_rows(cells, rng, size):
+    """
+    (size, n) bootstrap row indices drawn within strata: each row is
+    replaced by a random row of its own cell, so every cell keeps its
+    count. Rows outside every cell (-1) stay where they are.
+    """
+    n = len(cells)
+    order  = np.argsort(cells, kind="stable")
+    sizes  = np.bincount(cells[cells >= 0])
+    starts = np.concatenate([[0], np.cumsum(sizes)])[:-1] + np.count_nonzero(cells < 0)
+    rows   = np.broadcast_to(np.arange(n), (size, n)).copy()
+    inside = np.flatnonzero(cells >= 0)
+    c      = cells[inside]
+    draw   = (rng.random((size, len(inside))) * sizes[c]).astype(np.int64)
+    rows[:, inside] = order[starts[c] + draw]
+    return rows
+
+
+def cell_gaps(cells, residual, rows):
+    """
+    (size,) max - min cell mean of one grouping when position i holds
+    ``residual[rows[k, i]]``, for each row k of ``rows`` (a permutation,
+    or ``stratified_rows`` on the same ``cells``). Every position keeps
+    its cell, so the cell counts are fixed and only this grouping's
+    sums are reduced, in a single ``bincount``.
+    """
+    inside = np.flatnonzero(cells >= 0)
+    c      = cells[inside]
+    n_cell = int(c.max()) + 1
+    counts = np.bincount(c, minlength=n_cell)
+    flat   = (np.arange(len(rows))[:, None] * n_cell + c).ravel()
+    sums   = np.bincount(flat, weights=residual[rows[:, inside]].ravel(),
+                         minlength=len(rows) * n_cell).reshape(len(rows), n_cell)
+    means  = sums[:, counts > 0] / counts[counts > 0]
+    return means.max(axis=1) - means.min(axis=1)
+
+
+def bias_corrected_interval(boot, observed, ci=CI_LEVEL):
+    """
+    Bias-corrected percentile interval of each column of ``boot``. The
+    percentiles are shifted by how far the observed value sits from the
+    bootstrap median, which undoes the upward bias of a max - min
+    statistic; the interval brackets the observed value unless more than
+    (1 + ci) / 2 of the resamples fall on one side of it.
+    """
+    from scipy.stats import norm
+    n_boot = np.sum(~np.isnan(boot), axis=0)
+    below  = (np.sum(boot < observed, axis=0) + 0.5 * np.sum(boot == observed, axis=0))
+    frac   = np.clip(below / np.maximum(n_boot, 1), 1 / (n_boot + 1), n_boot / (n_boot + 1))
+    z0     = norm.ppf(frac)
+    z      = norm.ppf((1 - ci) / 2)
+    low, high = norm.cdf(2 * z0 + z), norm.cdf(2 * z0 - z)
+    ci_low  = np.array([np.nanquantile(boot[:, g], low[g]) for g in range(boot.shape[1])])
+    ci_high = np.array([np.nanquantile(boot[:, g], high[g]) for g in range(boot.shape[1])])
+    return ci_low, ci_high
+
+
+def gap_inference(engine, residual, n_resamples=N_RESAMPLES, ci=CI_LEVEL, seed=42,
+                  max_elems=RESAMPLE_ELEMS):
+    """
+    Observed gap of every grouping, its permutation p-value (residuals
+    shuffled across rows) and bootstrap CI.
+
+    The bootstrap resamples rows within the grouping's own strata (every
+    cell keeps its size, so small intersection cells are not emptied or
+    doubled), and the interval is bias-corrected: a max - min gap of
+    resampled means is biased upward, and plain percentiles of it can
+    miss the observed gap entirely.
+
+    Resamples are drawn a batch at a time as (batch, n) index matrices
+    and reduced one grouping at a time (``cell_gaps``); a batch gathers
+    at most ``max_elems`` (resample, row, grouping) cells.
+    """
+    rng = np.random.default_rng(seed)
+    residual = np.asarray(residual, dtype=float)
+    n, n_groupings = len(residual), len(engine.groupings)
+    observed = engine.gaps(residual)[0]
+    batch = max(1, max_elems // (n * n_groupings))
+    local = engine.cells - engine.offsets[:-1]                 # cell within its grouping, per column
+    local[engine.cells < 0] = -1
+
+    perm, boot = [], []
+    for lo in range(0, n_resamples, batch):
+        b = min(batch, n_resamples - lo)
+        shuffled = rng.permuted(np.broadcast_to(np.arange(n), (b, n)), axis=1)
+        perm.append(np.stack([cell_gaps(local[:, g], residual, shuffled) for g in range(n_groupings)], axis=1))
+        boot.append(np.stack([cell_gaps(local[:, g], residual, stratified_rows(local[:, g], rng, b))
+                              for g in range(n_groupings)], axis=1))
+    perm, boot = np.concatenate(perm), np.concatenate(boot)
+
+    ci_low, ci_high = bias_corrected_interval(boot, observed, ci)
+    return pd.DataFrame({
+        "grouping": [grouping_name(g) for g in engine.groupings],
+        "gap": observed,
+        "p_value": (1 + (perm >= observed).sum(axis=0)) / (n_resamples + 1),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "n_resamples": n_resamples,
+    })
+
+
+def check_intervals(engine, residual, n_resamples=N_RESAMPLES, ci=CI_LEVEL, seed=0):
+    """
+    Inference on null data (the residuals shuffled across rows, so no
+    stratum differs but by chance): every CI must bracket its gap.
+    Returns the table with a ``brackets`` column.
+    """
+    null = np.random.default_rng(seed).permutation(np.asarray(residual, dtype=float))
+    gaps = gap_inference(engine, null, n_resamples=n_resamples, ci=ci, seed=seed + 1)
+    gaps["brackets"] = (gaps["ci_low"] <= gaps["gap"]) & (gaps["gap"] <= gaps["ci_high"])
+    return gaps
+
+
+def save_inference(engine, residual, n_resamples, ci=CI_LEVEL, directory=PROCESSED_DIR, check=False):
+    gaps = gap_inference(engine, residual, n_resamples=n_resamples, ci=ci)
+    print(f"=== Fairness gap inference ({n_resamples} resamples, {ci:.0%} CI) ===")
+    for row in gaps.itertuples():
+        print(f"{row.grouping}: {row.gap:.4f}  [{row.ci_low:.4f}, {row.ci_high:.4f}]  p = {row.p_value:.4f}")
+    path = write_artifact(gaps, GAPS_ARTIFACT, directory=directory)
+    print(f"Fairness gap inference saved to {path}")
+    if check:
+        null = check_intervals(engine, residual, n_resamples=n_resamples, ci=ci)
+        print("=== CI check on shuffled residuals ===")
+        for row in null.itertuples():
+            print(f"{row.grouping}: {row.gap:.4f}  [{row.ci_low:.4f}, {row.ci_high:.4f}]  "
+                  f"{'ok' if row.brackets else 'MISSES THE GAP'}")
+        if not null["brackets"].all():
+            raise SystemExit("Bootstrap CIs do not bracket the observed gap on null data")
+
+
+def save_groups(engine, residuals, models, directory=PROCESSED_DIR):
+    """Per-cell statistics of every model, and each model's gaps printed side by side."""
+    path = write_artifact(engine.group_table(residuals, models), GROUPS_ARTIFACT, directory=directory)
+    if len(models) > 1:
+        print("=== Fairness gaps by model ===")
+        print(engine.gap_table(residuals, models).to_string(float_format=lambda v: f"{v:.4f}"))
+    print(f"Fairness group statistics saved to {path}")
+
+
+def stream_fairness(memory_budget_mb, xgb_model=None, source=FEATURES_ARTIFACT,
+                    name=OUTPUT_ARTIFACT, directory=PROCESSED_DIR, n_resamples=0,
+                    attr_names=SENSITIVE_ATTRS, n_quantiles=N_QUANTILES, intersections=(),
+                    check_ci=False):
+    """
+    ``predict_residuals`` + ``compute_fairness`` over row blocks.
+
+    The first pass predicts block by block and keeps only the residual
+    and the stratifying attributes (a few floats per row), from which
+    the engine codes the strata and computes every cell mean; the second
+    pass reads GEOIDs block by block and appends each block's metrics.
+    """
+    if xgb_model is None:
+        xgb_model = load_model()
+    used = list(dict.fromkeys(list(attr_names) + [a for g in intersections for a in g]))
+    columns = list(dict.fromkeys(["new_pct_dem"] + FEATURE_LIST + used))
+    block_rows = rows_per_block(64 + len(columns) * 8 * 3, memory_budget_mb)
+
+    residual, attrs = [], {attr: [] for attr in used}
+    for block in iter_artifact(source, columns=columns, batch_rows=block_rows, directory=directory):
+        residual.append(xgb_model.predict(block[FEATURE_LIST]) - block["new_pct_dem"].to_numpy())
+        for attr in used:
+            attrs[attr].append(block[attr].to_numpy(dtype=np.float64))
+    residual = np.concatenate(residual)
+    attrs = {attr: np.concatenate(parts) for attr, parts in attrs.items()}
+
+    engine = build_engine(attrs, attr_names, n_quantiles, intersections)
+    means  = engine.means(residual)
+    report_gaps(engine, engine.gaps(residual))
+    if n_resamples:
+        save_inference(engine, residual, n_resamples, directory=directory, check=check_ci)
+
+    offset = 0
+    with ArtifactWriter(name, directory=directory) as writer:
+        for block in iter_artifact(source, columns=["GEOID"], batch_rows=block_rows, directory=directory):
+            rows = slice(offset, offset + len(block))
+            offset += len(block)
+            res = {"GEOID": block["GEOID"].to_numpy(), "residual": residual[rows]}
+            res.update({attr: attrs[attr][rows] for attr in used})
+            res.update(engine.row_columns(residual[rows], rows=rows, means=means))
+            writer.write(pd.DataFrame(res))
+    print(f"Fairness metrics saved to {writer.path} ({writer.rows} rows in blocks of {block_rows})")
+
+
+def parse_intersection(text):
+    return tuple(a.strip() for a in text.split(","))
+
 
-    return df
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Residual fairness across demographic strata")
+    parser.add_argument("--attrs", nargs="+", default=SENSITIVE_ATTRS, metavar="ATTR",
+                        help="attributes stratified on their own")
+    parser.add_argument("--intersect", action="append", default=[], type=parse_intersection,
+                        metavar="A,B[,...]", help="also stratify on this intersection of attributes")
+    parser.add_argument("--quantiles", type=int, default=N_QUANTILES,
+                        help="quantile strata per attribute")
+    parser.add_argument("--models", nargs="+", default=[], metavar="PATH",
+                        help="further model files scored on the same strata (fairness_groups)")
+    parser.add_argument("--cv-residuals", action="store_true",
+                        help=f"also score the out-of-fold residuals of spatial_cv.py ({CV_ARTIFACT})")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="stream over row blocks sized to this budget")
+    parser.add_argument("--inference", action="store_true",
+                        help=f"add permutation p-values and bootstrap CIs for each gap ({GAPS_ARTIFACT})")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES,
+                        help="permutations and bootstrap resamples per test")
+    parser.add_argument("--check-ci", action="store_true",
+                        help="with --inference, also check that the CIs bracket the gaps of shuffled "
+                             "(null) residuals; exits non-zero if one does not")
+    return parser.parse_args(argv)
 
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    n_resamples = args.resamples if args.inference else 0
+    if args.memory_budget:
+        stream_fairness(args.memory_budget, n_resamples=n_resamples, attr_names=args.attrs,
+                        n_quantiles=args.quantiles, intersections=args.intersect, check_ci=args.check_ci)
+        return
     # 1. Predict residuals on the clean tabular data
-    res_df = predict_residuals()
+    used = list(dict.fromkeys(args.attrs + [a for g in args.intersect for a in g]))
+    res_df = predict_residuals(attrs=used)
+    engine = build_engine(res_df, args.attrs, args.quantiles, args.intersect)
     # 2. Compute fairness metrics
-    fairness_df = compute_fairness(res_df)
+    fairness_df = compute_fairness(res_df, engine)
+    residual = res_df["residual"].to_numpy(dtype=float)
+    if n_resamples:
+        save_inference(engine, residual, n_resamples, check=args.check_ci)
+    residuals = residual[None, :]
+    models = ["clean"]
+    if args.models:
+        residuals = np.vstack([residuals, model_residuals(args.models)])
+        models += [os.path.splitext(os.path.basename(path))[0] for path in args.models]
+    if args.cv_residuals:
+        cv, label = cv_residuals(res_df["GEOID"])
+        residuals = np.vstack([residuals, cv])
+        models.append(label)
+    save_groups(engine, residuals, models)
     # 3. Save
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    fairness_df.to_csv(OUTPUT_PATH, index=False)
-    print(f"Fairness metrics saved to {OUTPUT_PATH}")
+    path = write_artifact(fairness_df, OUTPUT_ARTIFACT)
+    print(f"Fairness metrics saved to {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+# src/spatial_weights.py
+
+import os
+import sys
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from config import PROCESSED_DIR
+
+# Cached weight matrices, one .npz per (geometry, kernel, parameters)
+WEIGHTS_DIR = os.path.join(PROCESSED_DIR, "weights")
+
+# "knn": equal weights on the k nearest neighbours
+# "band": equal weights on every neighbour within ``threshold``
+# "idw": inverse distance ** power on the k nearest neighbours
+KERNELS = ("knn", "band", "idw")
+
+
+def coords_hash(coords):
+    """Short hash of a coordinate array, identifying the geometry a matrix was built on."""
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    return hashlib.sha256(coords.tobytes() + str(coords.shape).encode()).hexdigest()[:16]
+
+
+def row_standardise(W):
+    """Scale each row to sum to one; rows without neighbours stay zero."""
+    sums = np.asarray(W.sum(axis=1)).ravel()
+    inv  = np.divide(1.0, sums, out=np.zeros_like(sums), where=sums > 0)
+    return sparse.diags(inv) @ W
+
+
+def nearest(coords, k):
+    """(distances, indices) of each point's k nearest neighbours, excluding itself."""
+    tree = cKDTree(coords)
+    dist, idx = tree.query(coords, k=k + 1)
+    # Drop the point itself; with duplicate coordinates it may not come first
+    own  = idx == np.arange(len(coords))[:, None]
+    keep = ~own
+    keep[~own.any(axis=1), -1] = False
+    return dist[keep].reshape(len(coords), k), idx[keep].reshape(len(coords), k)
+
+
+def _from_neighbours(dist, idx, kernel, power):
+    n, k = idx.shape
+    if kernel == "idw":
+        vals = 1.0 / np.maximum(dist, np.finfo(float).tiny) ** power
+    else:
+        vals = np.ones_like(dist)
+    W = sparse.csr_matrix((vals.ravel(), idx.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
+    return row_standardise(W).tocsr()
+
+
+def build_weights(coords, kernel="knn", k=5, threshold=None, power=1.0):
+    """Row-standardised sparse (n, n) spatial weights from point coordinates."""
+    coords = np.asarray(coords, dtype=np.float64)
+    if kernel == "band":
+        if threshold is None:
+            raise ValueError("The 'band' kernel needs a distance threshold")
+        tree = cKDTree(coords)
+        W = tree.sparse_distance_matrix(tree, threshold, output_type="coo_matrix").tocsr()
+        W.setdiag(0)
+        W.eliminate_zeros()
+        W.data[:] = 1.0
+        islands = int((np.diff(W.indptr) == 0).sum())
+        if islands:
+            print(f"[weights] {islands} points have no neighbour within {threshold}")
+        return row_standardise(W).tocsr()
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}'; expected one of {KERNELS}")
+    dist, idx = nearest(coords, k)
+    return _from_neighbours(dist, idx, kernel, power)
+
+
+def weights_path(coords, kernel, k=5, threshold=None, power=1.0, cache_dir=WEIGHTS_DIR):
+    params = {"knn": f"k{k}", "band": f"d{threshold:g}" if threshold else "d", "idw": f"k{k}_p{power:g}"}
+    return os.path.join(cache_dir, f"{coords_hash(coords)}_{kernel}_{params[kernel]}.npz")
+
+
+def load_weights(coords, kernel="knn", k=5, threshold=None, power=1.0,
+                 cache_dir=WEIGHTS_DIR, use_cache=True):
+    """``build_weights``, reusing the matrix cached for the same geometry and parameters."""
+    path = weights_path(coords, kernel, k, threshold, power, cache_dir)
+    if use_cache and os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+    W = build_weights(coords, kernel, k, threshold, power)
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + ".tmp.npz"
+        sparse.save_npz(tmp, W)
+        os.replace(tmp, path)
+    return W
+
+
+def lag_suffix(kernel, param):
+    return {"knn": f"lag{param}", "band": f"band{param:g}", "idw": f"idw{param}"}[kernel]
+
+
+def stacked_weights(coords, ks=(5,), kernel="knn", thresholds=(), power=1.0,
+                    cache_dir=WEIGHTS_DIR, use_cache=True):
+    """(params, W): the weight matrices for every parameter stacked into one (len(params) * n, n) CSR."""
+    coords = np.asarray(coords, dtype=np.float64)
+    params = list(thresholds) if kernel == "band" else list(ks)
+    mats = [
+        load_weights(coords, kernel, k=p, threshold=p, power=power,
+                     cache_dir=cache_dir, use_cache=use_cache)
+        for p in params
+    ]
+    return params, sparse.vstack(mats, format="csr")
+
+
+def apply_lags(params, W, values, kernel="knn", rows=None):
+    """
+    Lags of every column of ``values`` (all n points) from a stacked
+    matrix, for the output ``rows`` (a slice; all rows by default).
+    Only the matching rows of each stacked block are multiplied, so a
+    row block costs O(block * k) however large n is.
+    """
+    values = pd.DataFrame(values)
+    n = len(values)
+    lo, hi, _ = (rows or slice(None)).indices(n)
+    take = np.concatenate([np.arange(i * n + lo, i * n + hi) for i in range(len(params))])
+    lags = W[take] @ values.to_numpy(dtype=np.float64)
+
+    out = {}
+    m = hi - lo
+    for i, p in enumerate(params):
+        block = lags[i * m:(i + 1) * m]
+        for j, var in enumerate(values.columns):
+            out[f"{var}_{lag_suffix(kernel, p)}"] = block[:, j]
+    return pd.DataFrame(out, index=values.index[lo:hi])
+
+
+def spatial_lags(values, coords, ks=(5,), kernel="knn", thresholds=(), power=1.0,
+                 cache_dir=WEIGHTS_DIR, use_cache=True):
+    """
+    Spatial lags of every column of ``values`` for every k (``knn`` /
+    ``idw``) or distance threshold (``band``).
+
+    The weight matrices for all parameters are stacked into one
+    (len(params) * n, n) sparse matrix and applied to the whole
+    (n, n_vars) value block in a single multiply. Output columns are
+    ``<var>_lag<k>`` (knn), ``<var>_idw<k>`` or ``<var>_band<d>``.
+    """
+    params, W = stacked_weights(coords, ks, kernel, thresholds, power, cache_dir, use_cache)
+    return apply_lags(params, W, values, kernel)
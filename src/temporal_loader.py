@@ -1,65 +1,200 @@
 # src/temporal_loader.py
 
 import os
-import pandas as pd
+import re
+import sys
 import glob
+import shutil
+import argparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 # Base paths
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
-RAW_DIR       = os.path.join(PROJECT_ROOT, "data", "raw")
-OUTPUT_PATH   = os.path.join(PROJECT_ROOT, "data", "processed", "voting_panel.csv")
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
 
-def load_yearly_voting(years, pattern="voting_{year}.csv"):
+from config import PROCESSED_DIR
+
+RAW_DIR   = os.path.join(PROJECT_ROOT, "data", "raw")
+PANEL_DIR = os.path.join(PROCESSED_DIR, "voting_panel")     # year=YYYY/part.parquet
+
+VOTING_PATTERN = "voting_{year}.csv"
+ACS_PATTERN    = "acs_{year}.csv"
+
+# Compact panel types: county_id and the other labels are dictionary-encoded
+# (categorical in pandas), every measure float32, the year int16
+KEYS          = ["county_id", "year"]
+LABEL_COLUMNS = {"county_id": 5, "state": 2, "county": 3, "name": None}
+YEAR_TYPE     = pa.int16()
+MEASURE_TYPE  = pa.float32()
+PARTITIONING  = ds.partitioning(pa.schema([("year", YEAR_TYPE)]), flavor="hive")
+
+
+def clean_name(column):
+    return column.strip().lower().replace(" ", "_")
+
+
+def read_year(path, year):
+    """
+    One raw CSV as a typed Arrow table: code / name columns as strings
+    (zero-padded, never parsed as numbers), everything else float32,
+    plus an int16 ``year``. Column names are standardised.
+    """
+    header = pacsv.open_csv(path).schema.names
+    names  = {c: clean_name(c) for c in header}
+    labels = {c: pa.string() for c in header if names[c] in LABEL_COLUMNS}
+    table  = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(column_types=labels))
+    table  = table.rename_columns([names[c] for c in table.column_names])
+
+    columns = {}
+    for name, col in zip(table.column_names, table.columns):
+        if name in LABEL_COLUMNS:
+            width = LABEL_COLUMNS[name]
+            columns[name] = pc.utf8_lpad(col, width, padding="0") if width else col
+        else:
+            columns[name] = col.cast(MEASURE_TYPE)
+    columns["year"] = pa.array([year] * len(table), type=YEAR_TYPE)
+    return pa.table(columns)
+
+
+def merge_year(voting, acs):
+    """
+    Inner join of one year's voting and ACS tables on county_id. Labels
+    both have are taken from the voting table; ACS measures the voting
+    table also has get an ``_acs`` suffix.
+    """
+    shared = [c for c in acs.column_names if c in voting.column_names and c not in KEYS]
+    acs = acs.drop_columns([c for c in shared if c in LABEL_COLUMNS])
+    acs = acs.rename_columns([f"{c}_acs" if c in shared else c for c in acs.column_names])
+    merged = voting.join(acs, keys=KEYS, join_type="inner")
+    return merged.combine_chunks()
+
+
+def compact(table):
+    """Labels dictionary-encoded (categorical), keys first."""
+    fields = []
+    for name in table.column_names:
+        col = table[name]
+        if name in LABEL_COLUMNS:
+            col = col.dictionary_encode()
+        fields.append((name, col))
+    order = [n for n in KEYS if n in table.column_names] + [n for n in table.column_names if n not in KEYS]
+    fields = dict(fields)
+    return pa.table({n: fields[n] for n in order})
+
+
+# ── Partitioned store ────────────────────────────────────────────────────────
+
+def partition_dir(year, panel_dir=PANEL_DIR):
+    return os.path.join(panel_dir, f"year={year}")
+
+
+def panel_years(panel_dir=PANEL_DIR):
+    """Years already in the store (from directory names only)."""
+    years = []
+    for path in glob.glob(os.path.join(panel_dir, "year=*")):
+        match = re.fullmatch(r"year=(\d+)", os.path.basename(path))
+        if match and os.path.exists(os.path.join(path, "part.parquet")):
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def raw_years(raw_dir=RAW_DIR):
+    """Years with both a voting and an ACS file in ``raw_dir``."""
+    found = []
+    for path in glob.glob(os.path.join(raw_dir, VOTING_PATTERN.format(year="*"))):
+        match = re.search(r"(\d{4})", os.path.basename(path))
+        if match and os.path.exists(os.path.join(raw_dir, ACS_PATTERN.format(year=match.group(1)))):
+            found.append(int(match.group(1)))
+    return sorted(found)
+
+
+def write_partition(table, year, panel_dir=PANEL_DIR):
+    """Write one year's partition atomically (the year lives in the path, not the file)."""
+    final = partition_dir(year, panel_dir)
+    tmp   = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    pq.write_table(table.drop_columns(["year"]), os.path.join(tmp, "part.parquet"))
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+    return final
+
+
+def append_years(years=None, overwrite=False, raw_dir=RAW_DIR, panel_dir=PANEL_DIR):
     """
-    Load voting CSVs for each year into a single DataFrame with a 'year' column.
-    Expects files in data/raw named like voting_2016.csv, voting_2020.csv, etc.
+    Build the partition of every year in ``years`` (default: all raw
+    years) that is not in the store yet, or of all of them with
+    ``overwrite``. Each year is read, merged and written on its own;
+    existing partitions are never opened. Returns the years written.
     """
-    dfs = []
-    for yr in years:
-        filepath = os.path.join(RAW_DIR, pattern.format(year=yr))
-        df = pd.read_csv(filepath, dtype={"county_id": str})
-        df["year"] = yr
-        dfs.append(df)
-    return pd.concat(dfs, ignore_index=True)
-
-def load_yearly_acs(years, pattern="acs_{year}.csv"):
+    years = raw_years(raw_dir) if years is None else list(years)
+    have  = set(panel_years(panel_dir))
+    written = []
+    for year in years:
+        if year in have and not overwrite:
+            continue
+        voting = read_year(os.path.join(raw_dir, VOTING_PATTERN.format(year=year)), year)
+        acs    = read_year(os.path.join(raw_dir, ACS_PATTERN.format(year=year)), year)
+        table  = compact(merge_year(voting, acs))
+        write_partition(table, year, panel_dir)
+        print(f"[panel] {year}: {table.num_rows} counties x {table.num_columns} columns "
+              f"({table.nbytes / 2**20:.1f} MiB in memory)")
+        written.append(year)
+    return written
+
+
+def panel_dataset(panel_dir=PANEL_DIR):
     """
-    Load ACS demographic CSVs for each year into a DataFrame with 'year' column.
-    Expects data/raw/acs_2016.csv, etc.
+    The store as one Arrow dataset. Partitions may differ in columns (a
+    variable added in a later vintage), so the schema is the union of
+    the partition footers; years without a column read it as null.
     """
-    dfs = []
-    for yr in years:
-        filepath = os.path.join(RAW_DIR, pattern.format(year=yr))
-        df = pd.read_csv(filepath, dtype={"county_id": str})
-        df["year"] = yr
-        dfs.append(df)
-    return pd.concat(dfs, ignore_index=True)
-
-def merge_panel(voting_df, acs_df):
+    paths = [os.path.join(partition_dir(y, panel_dir), "part.parquet") for y in panel_years(panel_dir)]
+    if not paths:
+        raise FileNotFoundError(f"No panel partitions in {panel_dir}; run temporal_loader.py first")
+    schema = pa.unify_schemas([pq.read_schema(p) for p in paths] + [pa.schema([("year", YEAR_TYPE)])])
+    return ds.dataset(paths, schema=schema, format="parquet", partitioning=PARTITIONING,
+                      partition_base_dir=panel_dir)
+
+
+def read_panel(start=None, end=None, columns=None, panel_dir=PANEL_DIR):
     """
-    Merge voting and ACS panels on ['county_id', 'year'], standardize columns.
+    Panel rows for ``start <= year <= end`` (either bound optional) as
+    a DataFrame with categorical labels, float32 measures and int16
+    year. Only the partitions in range, and only ``columns``, are read.
     """
-    df = voting_df.merge(acs_df, on=["county_id", "year"], how="inner")
-    # Clean column names
-    df.rename(columns=lambda x: x.strip().lower().replace(" ", "_"), inplace=True)
-    return df
+    dataset = panel_dataset(panel_dir)
+    expr = None
+    if start is not None:
+        expr = ds.field("year") >= start
+    if end is not None:
+        expr = (ds.field("year") <= end) if expr is None else expr & (ds.field("year") <= end)
+    if columns is not None:
+        columns = list(dict.fromkeys(KEYS + list(columns)))
+    table = dataset.to_table(columns=columns, filter=expr)
+    df = table.to_pandas()
+    df["year"] = df["year"].astype("int16")
+    return df[KEYS + [c for c in df.columns if c not in KEYS]]
 
-def save_panel(df, path=OUTPUT_PATH):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    df.to_csv(path, index=False)
-    print(f"Panel data saved to {path}")
 
-if __name__ == "__main__":
-    # Define the years you have data for
-    years = [2016, 2020, 2024]
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build / extend the year-partitioned voting + ACS panel")
+    parser.add_argument("--years", nargs="+", type=int, default=None,
+                        help="years to add (default: every year with voting and ACS files)")
+    parser.add_argument("--overwrite", action="store_true", help="rebuild these years' partitions")
+    return parser.parse_args(argv)
 
-    # Load panels
-    voting = load_yearly_voting(years, pattern="voting_{year}.csv")
-    acs    = load_yearly_acs(years, pattern="acs_{year}.csv")
 
-    # Merge into a panel
-    panel = merge_panel(voting, acs)
+def main(argv=None):
+    args = parse_args(argv)
+    written = append_years(args.years, args.overwrite)
+    print(f"Panel partitions in {PANEL_DIR}: {panel_years()} ({len(written)} written this run)")
 
-    # Save out
-    save_panel(panel)
-    print(f"Panel data saved to {OUTPUT_PATH}")
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()